@@ -0,0 +1,708 @@
+#!/usr/bin/env python
+"""
+Benchmarks of pystiebeleltron against the local Modbus simulator.
+
+Measures throughput (operations/s), p50/p99 latency, CPU time and memory
+allocations per operation for decoding, synchronous updates, cached getters,
+selective updates, history and capture recording, startup of one-shot
+processes, the asyncio API and the fleet poller. Results are written
+as JSON, so runs can be compared to catch regressions:
+
+    python -m benchmarks.bench --rtt 0.01 --output new.json
+    python -m benchmarks.bench --rtt 0.01 --compare new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.simulator import Simulator
+from pystiebeleltron import pystiebeleltron as pyse
+
+# Benchmarks are registered here in execution order.
+BENCHMARKS = []
+
+
+class Skipped(Exception):
+    """Benchmark cannot run in this environment."""
+
+
+def benchmark(func):
+    """Register a benchmark function."""
+    BENCHMARKS.append(func)
+    return func
+
+
+def _percentile(samples, fraction):
+    """Return the percentile of sorted samples."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class _Measurement():
+    """Collects latency, CPU and allocation samples of an operation."""
+
+    def __init__(self, iterations, alloc_iterations):
+        self.iterations = iterations
+        self.alloc_iterations = alloc_iterations
+        self.latencies = []
+        self.elapsed = self.cpu = 0.0
+        self.peak = self.blocks = 0
+
+    def start(self):
+        """Start the timed calls."""
+        self.cpu = time.thread_time()
+        self.elapsed = time.perf_counter()
+
+    def stop(self):
+        """Stop the timed calls."""
+        self.elapsed = time.perf_counter() - self.elapsed
+        self.cpu = time.thread_time() - self.cpu
+
+    def start_alloc(self):
+        """Start tracing memory allocations."""
+        self.blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+
+    def stop_alloc(self):
+        """Stop tracing memory allocations."""
+        _, self.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.blocks = sys.getallocatedblocks() - self.blocks
+
+    def result(self):
+        """Return a dict of the measured values."""
+        latencies = sorted(self.latencies)
+        return {
+            'iterations': self.iterations,
+            'ops_per_sec': self.iterations / self.elapsed,
+            'p50_ms': _percentile(latencies, 0.5) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000,
+            'cpu_ms_per_op': self.cpu / self.iterations * 1000,
+            'alloc_peak_bytes': self.peak,
+            'alloc_blocks_per_op': self.blocks / self.alloc_iterations,
+        }
+
+
+def measure(operation, iterations, warmup=3, alloc_iterations=20):
+    """Measure an operation.
+
+    Args:
+        operation: Function without arguments to be measured.
+        iterations: Number of timed calls.
+        warmup: Number of calls before measuring.
+        alloc_iterations: Number of calls traced for memory allocations.
+
+    Returns:
+        Dict of the measured values.
+    """
+    for _ in range(warmup):
+        operation()
+
+    stats = _Measurement(iterations, alloc_iterations)
+    stats.start()
+    for _ in range(iterations):
+        op_start = time.perf_counter()
+        operation()
+        stats.latencies.append(time.perf_counter() - op_start)
+    stats.stop()
+
+    stats.start_alloc()
+    for _ in range(alloc_iterations):
+        operation()
+    stats.stop_alloc()
+    return stats.result()
+
+
+async def measure_async(operation, iterations, warmup=3, alloc_iterations=20):
+    """Measure a coroutine function, see measure()."""
+    for _ in range(warmup):
+        await operation()
+
+    stats = _Measurement(iterations, alloc_iterations)
+    stats.start()
+    for _ in range(iterations):
+        op_start = time.perf_counter()
+        await operation()
+        stats.latencies.append(time.perf_counter() - op_start)
+    stats.stop()
+
+    stats.start_alloc()
+    for _ in range(alloc_iterations):
+        await operation()
+    stats.stop_alloc()
+    return stats.result()
+
+
+def _sync_client(host, port):
+    """Return a connected pymodbus TCP client."""
+    try:
+        from pymodbus.client.sync import ModbusTcpClient
+    except ImportError as exc:
+        raise Skipped('pymodbus unavailable: {}'.format(exc))
+    client = ModbusTcpClient(host=host, port=port, timeout=2)
+    client.connect()
+    return client
+
+
+def _run_async(coroutine_function):
+    """Run a coroutine function on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine_function())
+    finally:
+        loop.close()
+
+
+@benchmark
+def decode_get_conv_val(env):
+    """Decode all registers one by one with get_conv_val."""
+    api = pyse.StiebelEltronAPI(None, 1)
+    names = pyse.SNAPSHOT_FIELDS
+
+    def operation():
+        for name in names:
+            api.get_conv_val(name)
+    return measure(operation, env.iterations * 10)
+
+
+@benchmark
+def decode_snapshot(env):
+    """Decode all registers at once with snapshot()."""
+    api = pyse.StiebelEltronAPI(None, 1)
+    return measure(lambda: api.snapshot(refresh=False), env.iterations * 10)
+
+
+class _MemoryResponse():
+    """Read response of the in-memory client."""
+
+    def __init__(self, registers):
+        self.registers = registers
+
+
+class _MemoryClient():
+    """Client answering every read with zeros, without any I/O."""
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        return _MemoryResponse([0] * count)
+
+    read_holding_registers = read_input_registers
+
+
+@benchmark
+def update_offline(env):
+    """Full update() against an in-memory client (Python overhead only)."""
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    return measure(api.update, env.iterations * 10)
+
+
+@benchmark
+def update_offline_observed(env):
+    """update_offline with a MetricsObserver attached."""
+    from pystiebeleltron.instrumentation import MetricsObserver
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    api.add_observer(MetricsObserver())
+    return measure(api.update, env.iterations * 10)
+
+
+@benchmark
+def update_offline_history(env):
+    """update_offline recording all registers in a History."""
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    api.record_history(retention=86400, interval=10)
+    return measure(api.update, env.iterations * 10)
+
+
+@benchmark
+def update_offline_derived(env):
+    """update_offline feeding the derived values of a one hour window."""
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    api.track_derived(window=3600)
+    return measure(api.update, env.iterations * 10)
+
+
+@benchmark
+def derived_values(env):
+    """Derived values of a one hour window after a day of 10 s updates."""
+    from pystiebeleltron.derived import DerivedMetrics
+    derived = DerivedMetrics(window=3600)
+    for second in range(0, 86400, 10):
+        derived.add({'OPERATING_STATUS': 2 if second % 1800 < 900 else 0,
+                     'COMPRESSOR_STARTS': second // 1800,
+                     'FLOW_TEMPERATURE': 35.0, 'RETURN_TEMPERATURE': 30.0,
+                     'FLOW_RATE': 12.0}, float(second))
+    return measure(derived.values, env.iterations * 10)
+
+
+@benchmark
+def history_downsample(env):
+    """Downsample a full day of 10 s samples to 5 minute windows."""
+    from pystiebeleltron.history import History
+    history = History(['FLOW_TEMPERATURE'], retention=86400, interval=10)
+    end = time.time()
+    for second in range(0, 86400, 10):
+        history.append('FLOW_TEMPERATURE', second % 50, end - 86400 + second)
+    return measure(
+        lambda: history.downsample('FLOW_TEMPERATURE', 300, last=86400),
+        env.iterations)
+
+
+class _DriftingClient(_MemoryClient):
+    """In-memory client whose FLOW_TEMPERATURE changes every 10 seconds."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.requests = 0
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        self.requests += 1
+        values = [0] * count
+        if address <= 11 < address + count:
+            values[11 - address] = int(self.now // 10)
+        return _MemoryResponse(values)
+
+    read_holding_registers = read_input_registers
+
+
+@benchmark
+def scheduler_hour(env):
+    """Simulated hour of adaptive polling, FLOW_TEMPERATURE changing."""
+    from pystiebeleltron.scheduler import AdaptiveScheduler
+    client = _DriftingClient()
+    api = pyse.StiebelEltronAPI(client, 1)
+
+    def operation():
+        client.now = 0.0
+        client.requests = 0
+        scheduler = AdaptiveScheduler(api, min_interval=10,
+                                      max_interval=600)
+        while client.now < 3600:
+            scheduler.tick(client.now)
+            client.now += scheduler.delay(client.now)
+        return scheduler
+
+    result = measure(operation, max(1, env.iterations // 20), warmup=1,
+                     alloc_iterations=1)
+    stats = operation().get_stats()
+    # update() every 10 seconds: 1080 requests, 22680 registers
+    result['requests_per_hour'] = stats['requests']
+    result['registers_per_hour'] = stats['registers']
+    return result
+
+
+@benchmark
+def exporter_scrape(env):
+    """HTTP scrape of an exporter of 10 polled in-memory units."""
+    import urllib.request
+    from pystiebeleltron.exporter import Exporter
+    exporter = Exporter(interval=60)
+    for slave in range(1, 11):
+        exporter.add_unit(pyse.StiebelEltronAPI(_MemoryClient(), slave),
+                          host='bench', slave=slave)
+    exporter.start()
+    try:
+        _, port = exporter.start_server('127.0.0.1', 0)
+        while not exporter.render():
+            time.sleep(0.001)
+        url = 'http://127.0.0.1:{}/metrics'.format(port)
+
+        def operation():
+            with urllib.request.urlopen(url) as response:
+                response.read()
+
+        result = measure(operation, env.iterations, alloc_iterations=5)
+        result['body_bytes'] = len(exporter.render())
+        result['renders'] = exporter.renders
+        return result
+    finally:
+        exporter.stop()
+
+
+@benchmark
+def update_offline_capture(env):
+    """update_offline writing every update to a capture file."""
+    import tempfile
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    with tempfile.TemporaryDirectory() as directory:
+        api.start_capture(os.path.join(directory, 'bench.cap'))
+        try:
+            return measure(api.update, env.iterations * 10)
+        finally:
+            api.stop_capture()
+
+
+@benchmark
+def capture_replay(env):
+    """Decode 10000 captured records into snapshots."""
+    import tempfile
+    from pystiebeleltron.capture import CaptureReader, CaptureWriter
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1)
+    api.update()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.cap')
+        with CaptureWriter(path) as writer:
+            for second in range(10000):
+                writer.write(api._values, timestamp=float(second))
+        with CaptureReader(path) as reader:
+            result = measure(lambda: sum(1 for _ in reader.snapshots()),
+                             max(1, env.iterations // 20), warmup=1,
+                             alloc_iterations=1)
+    result['records_per_sec'] = result['ops_per_sec'] * 10000
+    return result
+
+
+def _large_map():
+    """Return a register map of 5 blocks with 120 registers each."""
+    from pystiebeleltron.registermap import READ_CALLS, RegisterMap
+    return RegisterMap('large', {
+        block: (block * 1000, {
+            'R{}_{}'.format(block, i): {'addr': block * 1000 + i, 'type': 2}
+            for i in range(120)}, READ_CALLS['input'])
+        for block in range(1, 6)})
+
+
+@benchmark
+def update_offline_large_map(env):
+    """update_offline and snapshot() with a 600 register map."""
+    api = pyse.StiebelEltronAPI(_MemoryClient(), 1, register_map=_large_map())
+    return measure(api.snapshot, env.iterations * 10)
+
+
+@benchmark
+def update_sync(env):
+    """Full update() of all blocks."""
+    client = _sync_client(env.host, env.port)
+    api = pyse.StiebelEltronAPI(client, 1)
+    try:
+        return measure(api.update, env.iterations)
+    finally:
+        client.close()
+
+
+@benchmark
+def update_native(env):
+    """Full update() of all blocks with the built-in transport."""
+    from pystiebeleltron.transport import ModbusTcpTransport
+    conn = ModbusTcpTransport(env.host, env.port, timeout=2)
+    api = pyse.StiebelEltronAPI(conn, 1)
+    try:
+        return measure(api.update, env.iterations)
+    finally:
+        conn.close()
+
+
+def _concurrent_updates(env, single_flight):
+    """Measure 8 threads calling update() at the same time."""
+    import threading
+    from pystiebeleltron.connection import ManagedConnection
+    from pystiebeleltron.transport import ModbusTcpTransport
+    conn = ManagedConnection(env.host, env.port, timeout=2,
+                             client_factory=ModbusTcpTransport)
+    api = pyse.StiebelEltronAPI(conn, 1, single_flight=single_flight)
+    barrier = threading.Barrier(9)
+
+    def worker():
+        while True:
+            barrier.wait()
+            if stop:
+                return
+            api.update()
+            barrier.wait()
+
+    stop = False
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+
+    def operation():
+        barrier.wait()
+        barrier.wait()
+
+    iterations = max(1, env.iterations // 5)
+    try:
+        result = measure(operation, iterations, alloc_iterations=1)
+    finally:
+        stop = True
+        barrier.wait()
+        for thread in threads:
+            thread.join()
+        conn.close()
+    result['requests_per_op'] = \
+        conn.get_health().requests / (iterations + 4)
+    return result
+
+
+@benchmark
+def update_threads(env):
+    """8 threads calling update() at once on one connection."""
+    return _concurrent_updates(env, single_flight=False)
+
+
+@benchmark
+def update_threads_single_flight(env):
+    """update_threads sharing identical updates in flight."""
+    return _concurrent_updates(env, single_flight=True)
+
+
+@benchmark
+def update_selective(env):
+    """update() of the operating status only."""
+    client = _sync_client(env.host, env.port)
+    api = pyse.StiebelEltronAPI(client, 1)
+    try:
+        return measure(lambda: api.update(names=['OPERATING_STATUS']),
+                       env.iterations)
+    finally:
+        client.close()
+
+
+def _getters(api):
+    """Return an operation calling all getters."""
+    def operation():
+        api.get_current_temp()
+        api.get_current_humidity()
+        api.get_target_temp()
+        api.get_operation()
+        api.get_heating_status()
+        api.get_cooling_status()
+        api.get_filter_alarm_status()
+    return operation
+
+
+@benchmark
+def getters_update_on_read(env):
+    """All seven getters with update_on_read and no cache."""
+    client = _sync_client(env.host, env.port)
+    api = pyse.StiebelEltronAPI(client, 1, update_on_read=True)
+    try:
+        return measure(_getters(api), max(1, env.iterations // 10),
+                       alloc_iterations=2)
+    finally:
+        client.close()
+
+
+@benchmark
+def getters_cached(env):
+    """All seven getters with update_on_read and a 1 s cache."""
+    client = _sync_client(env.host, env.port)
+    api = pyse.StiebelEltronAPI(client, 1, update_on_read=True, cache_ttl=1)
+    try:
+        result = measure(_getters(api), env.iterations)
+        result['cache'] = api.get_cache_stats()
+        return result
+    finally:
+        client.close()
+
+
+@benchmark
+def getters_polled(env):
+    """All seven getters served by a background poller (1 s interval)."""
+    from pystiebeleltron.transport import ModbusTcpTransport
+    conn = ModbusTcpTransport(env.host, env.port, timeout=2)
+    api = pyse.StiebelEltronAPI(conn, 1, update_on_read=True)
+    api.start_polling(interval=1)
+    try:
+        while api.get_polled_snapshot().snapshot is None:
+            time.sleep(0.001)
+        return measure(_getters(api), env.iterations * 10)
+    finally:
+        api.stop_polling()
+        conn.close()
+
+
+def _run_python(*args):
+    """Return an operation running a Python process with the package."""
+    environ = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(pyse.__file__)))
+    environ['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, environ.get('PYTHONPATH')]))
+    command = [sys.executable] + list(args)
+
+    def operation():
+        subprocess.run(command, env=environ, check=True,
+                       stdout=subprocess.DEVNULL)
+    return operation
+
+
+@benchmark
+def startup_import(env):
+    """Interpreter start and import of the command line interface."""
+    return measure(_run_python('-c', 'import pystiebeleltron.cli'),
+                   max(1, env.iterations // 10), warmup=1, alloc_iterations=1)
+
+
+@benchmark
+def startup_cli_read(env):
+    """One-shot `python -m pystiebeleltron read --block 3` process."""
+    return measure(_run_python('-m', 'pystiebeleltron', '--port',
+                               str(env.port), 'read', env.host,
+                               '--block', '3'),
+                   max(1, env.iterations // 10), warmup=1, alloc_iterations=1)
+
+
+async def _async_connect(env):
+    """Return a connected asyncio client."""
+    from pystiebeleltron.aio import connect
+    try:
+        return await connect(env.host, env.port)
+    except Exception as exc:  # pylint: disable=broad-except
+        raise Skipped('asyncio client unavailable: {!r}'.format(exc))
+
+
+@benchmark
+def update_async(env):
+    """Full update() of the asyncio API, blocks read concurrently."""
+    from pystiebeleltron.aio import AsyncStiebelEltronAPI
+
+    async def run():
+        conn = await _async_connect(env)
+        api = AsyncStiebelEltronAPI(conn, 1)
+        try:
+            return await measure_async(api.update, env.iterations)
+        finally:
+            if hasattr(conn, 'close'):
+                conn.close()
+    return _run_async(run)
+
+
+@benchmark
+def update_async_native(env):
+    """update_async with the built-in asyncio transport."""
+    from pystiebeleltron.aio import AsyncStiebelEltronAPI, open_connection
+
+    async def run():
+        conn = await open_connection(env.host, env.port)
+        api = AsyncStiebelEltronAPI(conn, 1)
+        try:
+            return await measure_async(api.update, env.iterations)
+        finally:
+            conn.close()
+    return _run_async(run)
+
+
+def _fleet_sweep(env, client_factory):
+    """Measure FleetPoller sweeps over all simulated units."""
+    from pystiebeleltron.fleet import FleetPoller
+
+    async def run():
+        await client_factory(env.host, env.port)
+        targets = [(env.host, env.port, unit)
+                   for unit in range(1, env.units + 1)]
+        poller = FleetPoller(targets, concurrency=env.concurrency,
+                             client_factory=client_factory)
+        try:
+            result = await measure_async(
+                poller.sweep, max(1, env.iterations // 20), warmup=1,
+                alloc_iterations=1)
+        finally:
+            poller.close()
+        result['units'] = env.units
+        result['units_per_sec'] = result['ops_per_sec'] * env.units
+        return result
+    return _run_async(run)
+
+
+@benchmark
+def fleet_sweep(env):
+    """One FleetPoller sweep over all simulated units."""
+    return _fleet_sweep(env, lambda host, port: _async_connect(env))
+
+
+@benchmark
+def fleet_sweep_native(env):
+    """fleet_sweep with the built-in asyncio transport."""
+    from pystiebeleltron.aio import open_connection
+    return _fleet_sweep(env, open_connection)
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline run.
+
+    Returns:
+        List of regression descriptions.
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'ops_per_sec' not in base or \
+                'ops_per_sec' not in result:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:.1f} ops/s, baseline {:.1f}'.format(
+                name, result['ops_per_sec'], base['ops_per_sec']))
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append('{}: p99 {:.3f} ms, baseline {:.3f}'.format(
+                name, result['p99_ms'], base['p99_ms']))
+    return regressions
+
+
+def main(argv=None):
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rtt', type=float, default=0.005,
+                        help='simulated round-trip time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='probability of dropped requests')
+    parser.add_argument('--slow', type=float, default=0.0,
+                        help='probability of slow responses')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--units', type=int, default=50,
+                        help='simulated units for the fleet benchmark')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--only', action='append',
+                        help='run only the named benchmark(s)')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change reported as regression')
+    env = parser.parse_args(argv)
+
+    simulator = Simulator(rtt=env.rtt, jitter=env.jitter, drop=env.drop,
+                          slow=env.slow, seed=0)
+    env.host, env.port = simulator.start()
+    results = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(env).items()
+                       if key not in ('output', 'compare', 'only')},
+        },
+        'results': {},
+    }
+    try:
+        for func in BENCHMARKS:
+            if env.only and func.__name__ not in env.only:
+                continue
+            try:
+                result = func(env)
+            except Skipped as exc:
+                result = {'skipped': str(exc)}
+            results['results'][func.__name__] = result
+            print('{:<24} {}'.format(func.__name__, ', '.join(
+                '{}={:.4g}'.format(k, v) if isinstance(v, float) else
+                '{}={}'.format(k, v) for k, v in result.items())))
+    finally:
+        simulator.stop()
+
+    if env.output:
+        with open(env.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if env.compare:
+        with open(env.compare) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  env.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Local Modbus TCP simulator of ISG gateways with injectable latency.
+
+Serves read holding/input registers (function codes 3, 4) and write
+single/multiple registers (6, 16) for any number of unit ids. Every response
+is delayed by the configured round-trip time plus random jitter, requests can
+be dropped (no response) or answered slowly, to mimic real gateways.
+
+The simulator runs its own event loop in a background thread:
+
+    sim = Simulator(rtt=0.02, jitter=0.005)
+    host, port = sim.start()
+    ...
+    sim.stop()
+"""
+import asyncio
+import random
+import struct
+import threading
+
+_MBAP = struct.Struct('>HHHB')
+_READ_FUNCTIONS = {3: 'holding', 4: 'input'}
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_ADDRESS = 2
+
+
+class Simulator():
+    """Modbus TCP server hosting many simulated heat pumps."""
+
+    def __init__(self, rtt=0.0, jitter=0.0, drop=0.0, slow=0.0,
+                 slow_delay=1.0, size=3000, serialize=False, seed=None):
+        """Initialize the simulator.
+
+        Args:
+            rtt: Round-trip time in seconds added to every response.
+            jitter: Maximum random deviation of the round-trip time.
+            drop: Probability of not answering a request.
+            slow: Probability of answering a request slowly.
+            slow_delay: Additional delay of slow responses in seconds.
+            size: Number of holding and input registers per unit.
+            serialize: Answer one request per connection at a time, like the
+                ISG does, instead of answering pipelined requests in parallel.
+            seed: Seed of the random generator for reproducible runs.
+        """
+        self.rtt = rtt
+        self.jitter = jitter
+        self.drop = drop
+        self.slow = slow
+        self.slow_delay = slow_delay
+        self.size = size
+        self.serialize = serialize
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._units = {}
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._thread = None
+
+    def _registers(self, unit, kind):
+        """Return the register list of a unit, creating it on first use."""
+        if unit not in self._units:
+            self._units[unit] = {'holding': [0] * self.size,
+                                 'input': [0] * self.size}
+        return self._units[unit][kind]
+
+    def set_input_register(self, address, value, unit=1):
+        """Set an input register of a unit."""
+        self._registers(unit, 'input')[address] = int(value) & 0xFFFF
+
+    def set_holding_register(self, address, value, unit=1):
+        """Set a holding register of a unit."""
+        self._registers(unit, 'holding')[address] = int(value) & 0xFFFF
+
+    def get_holding_register(self, address, unit=1):
+        """Return a holding register of a unit."""
+        return self._registers(unit, 'holding')[address]
+
+    def _handle_pdu(self, unit, pdu):
+        """Execute a request PDU and return the response PDU."""
+        function = pdu[0]
+        if function in _READ_FUNCTIONS:
+            address, count = struct.unpack_from('>HH', pdu, 1)
+            registers = self._registers(unit, _READ_FUNCTIONS[function])
+            if count < 1 or count > 125 or address + count > self.size:
+                return bytes((function | 0x80, ILLEGAL_ADDRESS))
+            values = registers[address:address + count]
+            return struct.pack('>BB%dH' % count, function, 2 * count, *values)
+        if function == 6:
+            address, value = struct.unpack_from('>HH', pdu, 1)
+            if address >= self.size:
+                return bytes((function | 0x80, ILLEGAL_ADDRESS))
+            self._registers(unit, 'holding')[address] = value
+            return pdu[:5]
+        if function == 16:
+            address, count = struct.unpack_from('>HH', pdu, 1)
+            if address + count > self.size:
+                return bytes((function | 0x80, ILLEGAL_ADDRESS))
+            values = struct.unpack_from('>%dH' % count, pdu, 6)
+            self._registers(unit, 'holding')[address:address + count] = \
+                values
+            return pdu[:5]
+        return bytes((function | 0x80, ILLEGAL_FUNCTION))
+
+    def _delay(self):
+        """Return the response delay of a request or None to drop it."""
+        if self.drop and self._random.random() < self.drop:
+            return None
+        delay = self.rtt
+        if self.jitter:
+            delay += self._random.uniform(-self.jitter, self.jitter)
+        if self.slow and self._random.random() < self.slow:
+            delay += self.slow_delay
+        return max(0.0, delay)
+
+    async def _respond(self, writer, tid, unit, pdu, delay):
+        """Send the response of a request after its delay."""
+        if delay:
+            await asyncio.sleep(delay)
+        response = self._handle_pdu(unit, pdu)
+        writer.write(_MBAP.pack(tid, 0, len(response) + 1, unit) + response)
+
+    async def _serve(self, reader, writer):
+        """Serve a client connection."""
+        self._writers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(_MBAP.size)
+                tid, _, length, unit = _MBAP.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                delay = self._delay()
+                if delay is None:
+                    continue
+                if self.serialize:
+                    await self._respond(writer, tid, unit, pdu, delay)
+                else:
+                    asyncio.ensure_future(
+                        self._respond(writer, tid, unit, pdu, delay))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start the simulator in a background thread.
+
+        Returns:
+            Tuple of host and port the simulator listens on.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._serve, host, port))
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            # Disconnect clients which are still connected
+            for writer in list(self._writers):
+                writer.close()
+            self._loop.run_until_complete(asyncio.gather(
+                *asyncio.all_tasks(self._loop), return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(
+            target=run, name='ModbusSimulator', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self._server.sockets[0].getsockname()[:2]
+
+    def disconnect(self):
+        """Close all client connections, as a restarting gateway does."""
+        def close():
+            for writer in list(self._writers):
+                writer.close()
+
+        self._loop.call_soon_threadsafe(close)
+
+    def stop(self):
+        """Stop the simulator."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=5020)
+    parser.add_argument('--rtt', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop', type=float, default=0.0)
+    parser.add_argument('--slow', type=float, default=0.0)
+    args = parser.parse_args()
+
+    simulator = Simulator(rtt=args.rtt, jitter=args.jitter, drop=args.drop,
+                          slow=args.slow)
+    print('Listening on {}:{}'.format(*simulator.start(port=args.port)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import time
 from pystiebeleltron import pystiebeleltron as pyse
 from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 
@@ -23,20 +22,15 @@ def execute_tests(unit):
     test_function(unit, "get_heating_status")
     test_function(unit, "get_cooling_status")
 
-    # Test set_target_temp
+    # Test writing the target temperature
     print("Setting temperature to 20.0")
-    current_temp = unit.get_target_temp
-    unit.set_target_temp(20.0)
-    time.sleep(3)
-    unit.update()
-    mod_temp = unit.get_target_temp
-    if mod_temp != 20.0:
-        print("unit.set_target_temp failed!")
-    if mod_temp != current_temp:
-        unit.set_target_temp(current_temp)
-        time.sleep(3)
-        unit.update()
-    print("get_target_temp: {}".format(unit.get_target_temp))
+    current_temp = unit.get_target_temp()
+    if not unit.write_and_confirm('ROOM_TEMP_HEAT_DAY_HC1', 20.0):
+        print("unit.write_and_confirm failed!")
+    if current_temp != 20.0:
+        unit.write_and_confirm('ROOM_TEMP_HEAT_DAY_HC1', current_temp)
+    print("get_target_temp: {}".format(unit.get_target_temp()))
+    print("apply latency: {}".format(unit.get_apply_latency()))
 
 
 def main():
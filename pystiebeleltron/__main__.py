@@ -0,0 +1,6 @@
+"""Run the command line interface: python -m pystiebeleltron."""
+import sys
+
+from pystiebeleltron.cli import main
+
+sys.exit(main())
@@ -0,0 +1,384 @@
+"""
+Asyncio connection to a Stiebel Eltron ModBus API.
+
+The asynchronous API works on top of a connected asyncio client protocol,
+whose read and write calls return awaitables: the built-in
+AsyncModbusTcpTransport (see open_connection) or the pymodbus asyncio client
+(see connect). The register blocks are requested concurrently on the same
+connection; the responses are matched by their transaction id, so a refresh
+costs about one round-trip.
+"""
+import asyncio
+import logging
+import socket
+import time
+
+from pystiebeleltron.pystiebeleltron import (
+    B2_OPERATING_MODE_WRITE, CONFIRM_BACKOFF, CONFIRM_INTERVAL,
+    CONFIRM_MAX_INTERVAL, ERROR_OBJ_UNAVAILBLE, WRITE_ABORTED,
+    ExceptionResponseError, StiebelEltronAPI, _check_exception_response,
+    _is_error, _probe_failure)
+from pystiebeleltron.transport import (
+    _MAX_LENGTH, _MBAP, _MIN_LENGTH, _parse_pdu, _Requests)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def connect(host, port=502):
+    """Open an asyncio Modbus TCP connection to an ISG.
+
+    Requires the pymodbus 2.x asyncio client, which is imported on first use.
+
+    Args:
+        host: Host name or IP address of the ISG.
+        port: Modbus TCP port.
+
+    Returns:
+        Connected client protocol, to be passed to AsyncStiebelEltronAPI.
+
+    Raises:
+        ConnectionError: The connection could not be opened.
+    """
+    from pymodbus.client.asynchronous.async_io import init_tcp_client
+
+    client = await init_tcp_client(
+        None, asyncio.get_event_loop(), host, port)
+    if client.protocol is None:
+        raise ConnectionError(
+            'Connecting to {}:{} failed'.format(host, port))
+    return client.protocol
+
+
+class AsyncModbusTcpTransport(_Requests, asyncio.Protocol):
+    """Asyncio Modbus TCP client protocol with pipelined requests."""
+
+    def __init__(self):
+        self._transport = None
+        self._tid = 0
+        self._buffer = bytearray()
+        # Transaction id -> (future, function code) of pending requests
+        self._pending = {}
+
+    def connection_made(self, transport):
+        self._transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def connection_lost(self, exc):
+        self._transport = None
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Connection lost'))
+
+    def data_received(self, data):
+        buffer = self._buffer
+        buffer += data
+        while len(buffer) >= _MBAP.size:
+            tid, _, length, _ = _MBAP.unpack_from(buffer)
+            if not _MIN_LENGTH <= length <= _MAX_LENGTH:
+                self._transport.close()
+                return
+            end = _MBAP.size + length - 1
+            if len(buffer) < end:
+                break
+            future, function = self._pending.pop(tid, (None, None))
+            if future is not None and not future.done():
+                with memoryview(buffer) as view:
+                    try:
+                        future.set_result(
+                            _parse_pdu(function, view[_MBAP.size:end]))
+                    except ConnectionError as exc:
+                        future.set_exception(exc)
+            del buffer[:end]
+
+    async def _execute(self, unit, function, body):
+        """Send a request and wait for its response.
+
+        Raises:
+            ConnectionError: The connection is closed or was lost.
+        """
+        if self._transport is None:
+            raise ConnectionError('Connection closed')
+        tid = self._next_tid()
+        future = asyncio.get_event_loop().create_future()
+        self._pending[tid] = (future, function)
+        self._transport.write(_MBAP.pack(tid, 0, len(body) + 2, unit) +
+                              bytes((function,)) + body)
+        try:
+            return await future
+        finally:
+            self._pending.pop(tid, None)
+
+    def is_socket_open(self):
+        """Check if the connection is open."""
+        return self._transport is not None
+
+    def close(self):
+        """Close the connection."""
+        if self._transport is not None:
+            self._transport.close()
+
+
+async def open_connection(host, port=502):
+    """Open an asyncio Modbus TCP connection with the built-in transport.
+
+    Unlike connect(), this does not require pymodbus. It is the default
+    client_factory of the FleetPoller.
+
+    Returns:
+        Connected AsyncModbusTcpTransport.
+    """
+    _, protocol = await asyncio.get_event_loop().create_connection(
+        AsyncModbusTcpTransport, host, port)
+    return protocol
+
+
+class AsyncStiebelEltronAPI(StiebelEltronAPI):
+    """Stiebel Eltron API for asyncio.
+
+    Offers the same getters and setters as StiebelEltronAPI as coroutines.
+    """
+
+    async def update(self, names=None, blocks=None):
+        """Request current values from heat pump.
+
+        Without arguments, all blocks are read. Otherwise only the ranges
+        covering the given registers and blocks are read (see plan_reads).
+
+        Args:
+            names: Iterable of register names.
+            blocks: Iterable of block numbers.
+        """
+        if names is None:
+            blocks = self._map.blocks if blocks is None else blocks
+        return await self._update_shared(
+            self._select_ranges(names, blocks), blocks)
+
+    async def _update_ranges(self, ranges, blocks=None):
+        """Read the given register ranges concurrently and store them.
+
+        Values are only stored if all ranges could be read. The blocks
+        fully covered by the ranges are fresh afterwards.
+        """
+        try:
+            results = await asyncio.gather(
+                *[self._read_range(read_range) for read_range in ranges])
+        except (AttributeError, ConnectionError) as exc:
+            # The unit does not reply reliably
+            _LOGGER.warning('Modbus read failed: %s', exc)
+            return False
+
+        self._store_ranges(list(zip(ranges, results)))
+        self._mark_fresh(blocks)
+        return True
+
+    def _single_flights(self):
+        """Return the AsyncSingleFlight groups of updates and range reads."""
+        from pystiebeleltron.singleflight import AsyncSingleFlight
+        return (AsyncSingleFlight(
+                    lambda saved: self._notify_shared('update', saved)),
+                AsyncSingleFlight(
+                    lambda saved: self._notify_shared('read', saved)))
+
+    async def _read_range_now(self, read_range):
+        """Read a register range from the heat pump."""
+        if not self._observers:
+            return await self._request_range(read_range)
+        start = time.perf_counter()
+        try:
+            registers = await self._request_range(read_range)
+        except Exception as exc:
+            self._notify_request(read_range, start, exc)
+            raise
+        self._notify_request(read_range, start)
+        return registers
+
+    async def _request_range(self, read_range):
+        """Send the read request of a register range."""
+        block, offset, count = read_range
+        start_addr, _, read_call = self._map.blocks[block]
+        response = await getattr(self._conn, read_call)(
+            unit=self._slave,
+            address=start_addr + offset,
+            count=count)
+        _check_exception_response(response)
+        if len(response.registers) != count:
+            raise AttributeError('Incomplete response')
+        return response.registers
+
+    async def snapshot(self, refresh=True):
+        """Return all register values decoded in one pass.
+
+        Args:
+            refresh: Request current values from the heat pump first.
+
+        Returns:
+            Snapshot or None, if the refresh failed.
+        """
+        if refresh and not await self.update():
+            return None
+        return super().snapshot(refresh=False)
+
+    async def write_values(self, values, skip_unchanged=True):
+        """Write several holding registers at once.
+
+        See StiebelEltronAPI.write_values.
+        """
+        results, runs = self._plan_writes(values, skip_unchanged)
+        failed = False
+        for address, words, names in runs:
+            if failed:
+                results.update(dict.fromkeys(names, WRITE_ABORTED))
+                continue
+            try:
+                if len(words) == 1:
+                    response = await self._conn.write_register(
+                        unit=self._slave, address=address, value=words[0])
+                else:
+                    response = await self._conn.write_registers(
+                        unit=self._slave, address=address, values=words)
+            except ConnectionError:
+                response = None
+                failed = True
+            failed = failed or _is_error(response)
+            self._written(results, words, names, not failed)
+        return results
+
+    async def write_and_confirm(self, name, value, timeout=None):
+        """Write a holding register and wait until the heat pump applied it.
+
+        See StiebelEltronAPI.write_and_confirm.
+        """
+        word = await self._write_async(name, value)
+        if word is None:
+            return False
+
+        start = time.monotonic()
+        deadline = start + (timeout if timeout is not None
+                            else self.get_confirm_timeout())
+        interval = CONFIRM_INTERVAL
+        while True:
+            await asyncio.sleep(
+                min(interval, max(0.0, deadline - time.monotonic())))
+            if await self.update(names=(name,)) and \
+                    self._confirmed(name, word):
+                self._record_apply_latency(time.monotonic() - start)
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            interval = min(interval * CONFIRM_BACKOFF, CONFIRM_MAX_INTERVAL)
+
+    async def probe_capabilities(self, samples=1):
+        """Detect the registers supported by the heat pump.
+
+        See StiebelEltronAPI.probe_capabilities.
+        """
+        values = {}
+        for block in self._map.blocks:
+            try:
+                values[block] = [await self._probe_block_async(block)
+                                 for _ in range(samples)]
+            except ExceptionResponseError:
+                # The heat pump does not have the block
+                pass
+            except AttributeError as exc:
+                raise _probe_failure(block, exc) from exc
+        return self._apply_probe(values)
+
+    async def _probe_block_async(self, block):
+        """Return the raw words of a block, 0x8000 where nothing is read."""
+        words = [ERROR_OBJ_UNAVAILBLE] * self._map.block_sizes[block]
+        for read_range in self._map.block_ranges[block]:
+            words[read_range.offset:read_range.offset + read_range.count] = \
+                await self._read_range(read_range)
+        return words
+
+    async def _write_async(self, name, value):
+        """Write a single holding register.
+
+        Returns:
+            The written word, None if the write failed or was rejected.
+        """
+        address, word = self._map.encode_value(name, value)
+        try:
+            failed = _is_error(await self._conn.write_register(
+                unit=self._slave, address=address, value=word))
+        except ConnectionError:
+            failed = True
+        self.invalidate(self._map.index[name][0])
+        return None if failed else word
+
+    def start_polling(self, interval=10.0, names=None, blocks=None,
+                      on_publish=None):
+        """Not supported, run update() in a task instead."""
+        raise TypeError('Polling threads are not supported with asyncio')
+
+    def _refresh(self, name):
+        """Refreshing is done by the awaitable getters."""
+
+    async def _refresh_async(self, name):
+        """Refresh the block of a register, if update_on_read."""
+        if not self._update_on_read:
+            return
+        if self._cache_ttl is None:
+            await self.update()
+            return
+
+        entry = self._map.index.get(name)
+        if entry is None:
+            return
+        block = entry[0]
+        if not self._is_fresh(block):
+            await self._update_shared(self._block_ranges[block], (block,))
+
+    # Handle room temperature & humidity
+
+    async def get_current_temp(self):
+        """Get the current room temperature."""
+        await self._refresh_async('ACTUAL_ROOM_TEMPERATURE_HC1')
+        return super().get_current_temp()
+
+    async def get_target_temp(self):
+        """Get the target room temperature."""
+        await self._refresh_async('ROOM_TEMP_HEAT_DAY_HC1')
+        return super().get_target_temp()
+
+    async def set_target_temp(self, temp):
+        """Set the target room temperature (day)(HC1)."""
+        await self._write_async('ROOM_TEMP_HEAT_DAY_HC1', temp)
+
+    async def get_current_humidity(self):
+        """Get the current room humidity."""
+        await self._refresh_async('RELATIVE_HUMIDITY_HC1')
+        return super().get_current_humidity()
+
+    # Handle operation mode
+
+    async def get_operation(self):
+        """Return the current mode of operation."""
+        await self._refresh_async('OPERATING_MODE')
+        return super().get_operation()
+
+    async def set_operation(self, mode):
+        """Set the operation mode."""
+        await self._write_async(
+            'OPERATING_MODE', B2_OPERATING_MODE_WRITE.get(mode))
+
+    # Handle device status
+
+    async def get_heating_status(self):
+        """Return heater status."""
+        await self._refresh_async('OPERATING_STATUS')
+        return super().get_heating_status()
+
+    async def get_cooling_status(self):
+        """Cooling status."""
+        await self._refresh_async('OPERATING_STATUS')
+        return super().get_cooling_status()
+
+    async def get_filter_alarm_status(self):
+        """Return filter alarm."""
+        await self._refresh_async('OPERATING_STATUS')
+        return super().get_filter_alarm_status()
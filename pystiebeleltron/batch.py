@@ -0,0 +1,96 @@
+"""
+Vectorized decoding of raw register blocks.
+
+Decodes many samples of raw register words at once, e.g. to backfill
+analytics from captured register dumps. Requires NumPy, which is an optional
+dependency (pip install pystiebeleltron[numpy]).
+
+Decoding follows the codec of each register: values are scaled floats,
+signed data types are read as two's complement and values the codec decodes
+to None (unavailable objects, sensor errors, out of range) are NaN.
+"""
+import functools
+
+import numpy as np
+
+from pystiebeleltron.pystiebeleltron import CODECS, DEFAULT_MAP
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_block(register_map, block):
+    """Return the per-column decode tables of a block from its codecs."""
+    codecs = [None] * register_map.block_sizes[block]
+    for name in register_map.blocks[block][1]:
+        _, offset, codec = register_map.index[name]
+        codecs[offset] = codec
+    # Offsets without register decode to NaN
+    gaps = np.array([codec is None for codec in codecs])
+    codecs = [codec or CODECS[6] for codec in codecs]
+
+    multiplier = np.array([c.multiplier for c in codecs], dtype=np.float64)
+    signed = np.array([c.signed for c in codecs])
+    minimum = np.array([c.minimum for c in codecs])
+    maximum = np.array([c.maximum for c in codecs])
+    sentinels = [
+        (np.uint16(sentinel),
+         np.array([sentinel in c.sentinels for c in codecs]))
+        for sentinel in sorted(set().union(*(c.sentinels for c in codecs)))]
+    return (multiplier, signed, minimum, maximum, sentinels,
+            gaps if gaps.any() else None)
+
+
+def decode_block(raw, block, register_map=DEFAULT_MAP):
+    """Decode raw register words of a block.
+
+    Args:
+        raw: Array-like of shape (samples, block length) or (block length,)
+            with the raw 16 bit register words.
+        block: Block number (1, 2 or 3 of the ISG map).
+        register_map: RegisterMap of the words.
+
+    Returns:
+        Float array of the same shape with the scaled values.
+    """
+    multiplier, signed, minimum, maximum, sentinels, gaps = \
+        _compile_block(register_map, block)
+    words = np.asarray(raw).astype(np.uint16)
+    if words.shape[-1] != multiplier.shape[0]:
+        raise ValueError('Block {} has {} registers, got {}'.format(
+            block, multiplier.shape[0], words.shape[-1]))
+
+    ints = np.where(signed, words.view(np.int16), words)
+    invalid = (ints < minimum) | (ints > maximum)
+    for sentinel, columns in sentinels:
+        invalid |= columns & (words == sentinel)
+    if gaps is not None:
+        invalid |= gaps
+
+    values = ints / multiplier
+    values[invalid] = np.nan
+    return values
+
+
+def decode_blocks(*blocks, register_map=DEFAULT_MAP):
+    """Decode raw words of all blocks.
+
+    For the ISG map these are block 1 of shape (samples, 33), block 2 of
+    shape (samples, 27) and block 3 of shape (samples, 3).
+
+    Args:
+        blocks: Raw words of every block of the register map, in block
+            number order.
+        register_map: RegisterMap of the words.
+
+    Returns:
+        Float array of shape (samples, registers), columns in the fields
+        order of the register map (SNAPSHOT_FIELDS for the ISG map).
+    """
+    if len(blocks) != len(register_map.blocks):
+        raise ValueError('Register map {} has {} blocks, got {}'.format(
+            register_map.name, len(register_map.blocks), len(blocks)))
+    values = np.concatenate(
+        [decode_block(raw, block, register_map)
+         for raw, block in zip(blocks, register_map.blocks)], axis=-1)
+    if register_map.field_getter is not None:
+        values = values[..., list(register_map.field_positions)]
+    return values
@@ -0,0 +1,134 @@
+"""
+Registers supported by a heat pump.
+
+Depending on the model and its installed options (second heating circuit,
+ventilation, solar collector, ...) many registers report the "object
+unavailable" value 0x8000 on every read. StiebelEltronAPI.probe_capabilities
+reads all blocks once and records the registers which carry values. With
+the Capabilities set, updates only read the supported ranges and the other
+registers are reported as absent.
+
+Capabilities can be saved per device and loaded on the next start, so the
+probe only runs once:
+
+    caps = Capabilities.load(path) if os.path.exists(path) else None
+    if caps is None:
+        caps = api.probe_capabilities()
+        caps.save(path)
+    else:
+        api.set_capabilities(caps)
+"""
+import json
+
+from pystiebeleltron.pystiebeleltron import DEFAULT_MAP, ERROR_OBJ_UNAVAILBLE
+from pystiebeleltron.registermap import load_map
+
+# Version of the saved file format
+FORMAT_VERSION = 1
+
+
+class Capabilities():
+    """Set of registers supported by a heat pump."""
+
+    def __init__(self, supported, register_map=DEFAULT_MAP):
+        """Initialize the capabilities.
+
+        Args:
+            supported: Iterable of supported register names.
+            register_map: RegisterMap of the heat pump.
+
+        Raises:
+            ValueError: A name is not a known register.
+        """
+        supported = frozenset(supported)
+        unknown = supported.difference(register_map.index)
+        if unknown:
+            raise ValueError('Unknown registers {}'.format(
+                ', '.join(sorted(unknown))))
+        self.register_map = register_map
+        self.supported = supported
+        self.absent = frozenset(register_map.index).difference(supported)
+        # Block number -> ranges covering the supported registers
+        self.block_ranges = {
+            block: register_map.plan_reads(supported.intersection(regmap))
+            for block, (_, regmap, _) in register_map.blocks.items()
+        }
+
+    @classmethod
+    def from_values(cls, values, register_map=DEFAULT_MAP):
+        """Derive the capabilities from probed raw register values.
+
+        A register is supported unless it reported 0x8000 in every probe.
+
+        Args:
+            values: Dict of block number to a list of raw value sequences,
+                one per probe. Blocks which could not be read are missing.
+            register_map: RegisterMap of the heat pump.
+        """
+        supported = set()
+        for name, (block, offset, _) in register_map.index.items():
+            if any(sample[offset] != ERROR_OBJ_UNAVAILBLE
+                   for sample in values.get(block, ())):
+                supported.add(name)
+        return cls(supported, register_map)
+
+    def supports(self, name):
+        """Check if a register is supported."""
+        return name in self.supported
+
+    def supports_block(self, block):
+        """Check if any register of a block is supported."""
+        return bool(self.block_ranges[block])
+
+    def to_dict(self):
+        """Return the capabilities as JSON serializable dict."""
+        return {'version': FORMAT_VERSION,
+                'map': self.register_map.name,
+                'supported': sorted(self.supported)}
+
+    @classmethod
+    def from_dict(cls, data, register_map=None):
+        """Create capabilities from a dict returned by to_dict.
+
+        Args:
+            data: Dict returned by to_dict.
+            register_map: RegisterMap of the heat pump, None to load the
+                shipped map named in the data.
+
+        Raises:
+            ValueError: Unsupported format version, unknown registers or
+                a register map of another name.
+        """
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError('Unsupported capabilities version {!r}'.format(
+                data.get('version')))
+        map_name = data.get('map', DEFAULT_MAP.name)
+        if register_map is None:
+            register_map = load_map(map_name)
+        elif register_map.name != map_name:
+            raise ValueError('Capabilities of register map {}'.format(
+                map_name))
+        return cls(data['supported'], register_map)
+
+    def save(self, path):
+        """Save the capabilities as JSON file."""
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
+
+    @classmethod
+    def load(cls, path, register_map=None):
+        """Load capabilities saved with save(), see from_dict."""
+        with open(path) as source:
+            return cls.from_dict(json.load(source), register_map)
+
+    def __eq__(self, other):
+        return isinstance(other, Capabilities) and \
+            self.register_map is other.register_map and \
+            self.supported == other.supported
+
+    def __hash__(self):
+        return hash(self.supported)
+
+    def __repr__(self):
+        return 'Capabilities({} supported, {} absent)'.format(
+            len(self.supported), len(self.absent))
@@ -0,0 +1,370 @@
+"""
+Raw register capture files.
+
+A CaptureWriter appends the raw register words of every update to a binary
+file, a CaptureReader memory-maps it to replay the samples through the same
+decode path (snapshots) or as NumPy arrays for pystiebeleltron.batch:
+
+    api.start_capture('unit1.cap')
+    api.update()
+    api.stop_capture()
+
+    with CaptureReader('unit1.cap') as reader:
+        for snapshot in reader.snapshots():
+            print(snapshot.timestamp, snapshot['FLOW_TEMPERATURE'])
+
+File format (little endian): the magic bytes, the length of the header, the
+JSON header with the register map the words belong to, padding to 8 bytes
+and fixed-width records. A record holds the timestamp (float64, seconds since
+epoch), a bit mask of the blocks read by the update (one byte per 8 blocks
+of the map, bit i: i-th block), the words of all blocks in block order and
+padding to 8 bytes.
+Blocks which were not read contain the last known words, words which were
+never read the "object unavailable" value 0x8000, which decodes to None as
+in live snapshots.
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from pystiebeleltron.pystiebeleltron import (DEFAULT_MAP,
+                                             ERROR_OBJ_UNAVAILBLE, Snapshot)
+from pystiebeleltron.registermap import RegisterMap, load_map
+
+MAGIC = b'PYSECAP\x01'
+VERSION = 2
+_HEADER_LENGTH = struct.Struct('<I')
+_TIMESTAMP = struct.Struct('<d')
+_ALIGNMENT = 8
+# Words are stored little endian
+_SWAP = sys.byteorder == 'big'
+
+Record = collections.namedtuple('Record', 'timestamp blocks words')
+Record.__doc__ = """Captured update: timestamp, block numbers read and the
+raw words of all blocks (array('H') in block order)."""
+
+
+def _aligned(size):
+    """Round a size up to the record alignment."""
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _mask_size(register_map):
+    """Return the size of the block mask of the register map."""
+    return -(-len(register_map.blocks) // 8)
+
+
+def _record_size(register_map):
+    """Return the size of a record of the register map."""
+    return _aligned(_TIMESTAMP.size + _mask_size(register_map) +
+                    2 * sum(register_map.block_sizes.values()))
+
+
+def _header(register_map):
+    """Return the encoded file header of a register map."""
+    header = json.dumps({'version': VERSION,
+                         'record_size': _record_size(register_map),
+                         'map': register_map.to_dict()}).encode()
+    size = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+    return MAGIC + _HEADER_LENGTH.pack(len(header)) + header + \
+        bytes(_aligned(size) - size)
+
+
+def _read_header(data):
+    """Parse a file header.
+
+    Args:
+        data: Buffer starting at the beginning of the file.
+
+    Returns:
+        Tuple of the parsed header and the offset of the first record.
+
+    Raises:
+        ValueError: The data is no capture file.
+    """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not a capture file')
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    if len(data) < start:
+        raise ValueError('Truncated capture header')
+    length, = _HEADER_LENGTH.unpack_from(data, len(MAGIC))
+    try:
+        header = json.loads(bytes(data[start:start + length]).decode())
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid capture header')
+    if not isinstance(header, dict) or header.get('version') != VERSION:
+        raise ValueError('Unsupported capture version')
+    return header, _aligned(start + length)
+
+
+def _same_layout(register_map, other):
+    """Check if two register maps have the same blocks and block sizes."""
+    return register_map.block_sizes == other.block_sizes and all(
+        register_map.blocks[block][0] == other.blocks[block][0]
+        for block in register_map.blocks)
+
+
+class CaptureWriter():
+    """Append raw register words to a capture file."""
+
+    def __init__(self, path, register_map=DEFAULT_MAP):
+        """Open a capture file, appending if it exists.
+
+        Args:
+            path: File name.
+            register_map: RegisterMap of the captured words.
+
+        Raises:
+            ValueError: The existing file is no capture of the register map.
+        """
+        self.register_map = register_map
+        self._file = open(path, 'ab+')
+        try:
+            self._file.seek(0)
+            if self._file.read(1):
+                self._check_header()
+            else:
+                self._file.write(_header(register_map))
+        except Exception:
+            self._file.close()
+            raise
+        self._blocks = tuple(register_map.blocks)
+        self._mask_size = _mask_size(register_map)
+        self._record = bytearray(_record_size(register_map))
+
+    def _check_header(self):
+        """Check that the existing file captures the register map."""
+        self._file.seek(0)
+        head = self._file.read(len(MAGIC) + _HEADER_LENGTH.size)
+        if len(head) < len(MAGIC) + _HEADER_LENGTH.size:
+            raise ValueError('Not a capture file')
+        length, = _HEADER_LENGTH.unpack_from(head, len(MAGIC))
+        header, data_offset = _read_header(head + self._file.read(length))
+        if header.get('map') != self.register_map.to_dict():
+            raise ValueError('{} captures another register map'.format(
+                self._file.name))
+        record_size = _record_size(self.register_map)
+        size = self._file.seek(0, os.SEEK_END)
+        partial = (size - data_offset) % record_size
+        if partial:
+            # Cut a record which was not completely written
+            self._file.truncate(size - partial)
+
+    def write(self, values, blocks=None, timestamp=None, known=None):
+        """Append a record.
+
+        Args:
+            values: Dict of block number to raw words (array('H') of the
+                block size), e.g. the values store of the API.
+            blocks: Block numbers read by the update, all if None.
+            timestamp: Seconds since epoch, now if None.
+            known: Dict of block number to the flags of the words which
+                were read so far (see StiebelEltronAPI.get_known), all if
+                None. Words never read are stored as 0x8000.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        record = self._record
+        mask = 0
+        for bit, block in enumerate(self._blocks):
+            if blocks is None or block in blocks:
+                mask |= 1 << bit
+        _TIMESTAMP.pack_into(record, 0, timestamp)
+        position = _TIMESTAMP.size + self._mask_size
+        record[_TIMESTAMP.size:position] = mask.to_bytes(self._mask_size,
+                                                         'little')
+        for block in self._blocks:
+            words = values[block]
+            flags = None if known is None else known[block]
+            if flags is not None and 0 in flags:
+                words = array('H', (word if flag else ERROR_OBJ_UNAVAILBLE
+                                    for word, flag in zip(words, flags)))
+            if _SWAP:
+                words = array('H', words)
+                words.byteswap()
+            end = position + 2 * len(words)
+            record[position:end] = words
+            position = end
+        self._file.write(record)
+
+    def flush(self):
+        """Write buffered records to the file."""
+        self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CaptureReader():
+    """Memory-mapped capture file with random access to its records."""
+
+    def __init__(self, path, register_map=None):
+        """Open a capture file.
+
+        Args:
+            path: File name.
+            register_map: RegisterMap to decode the words with, e.g. with
+                changed codecs. Its blocks must match the captured ones.
+                The map stored in the file if None.
+
+        Raises:
+            ValueError: The file is no valid capture or the register map
+                does not match it.
+        """
+        with open(path, 'rb') as source:
+            self._mmap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._data_offset, captured = self._read_header()
+            if register_map is None:
+                register_map = captured
+            elif not _same_layout(register_map, captured):
+                raise ValueError(
+                    'Register map {!r} does not match the capture'.format(
+                        register_map.name))
+        except ValueError:
+            self._mmap.close()
+            raise
+        self.register_map = register_map
+        self.record_size = _record_size(register_map)
+        self._blocks = tuple(register_map.blocks)
+        self._words_offset = _TIMESTAMP.size + _mask_size(register_map)
+        self._words = sum(register_map.block_sizes.values())
+        self._length = (len(self._mmap) - self._data_offset) // \
+            self.record_size
+
+    def _read_header(self):
+        """Return the offset of the first record and the captured map.
+
+        The bundled register map is used if the captured one equals it.
+        """
+        header, data_offset = _read_header(self._mmap)
+        data = header.get('map')
+        try:
+            bundled = load_map(data['name'])
+        except (KeyError, TypeError, ValueError):
+            bundled = None
+        if bundled is not None and bundled.to_dict() == data:
+            captured = bundled
+        else:
+            captured = RegisterMap.from_dict(data)
+        if header.get('record_size') != _record_size(captured):
+            raise ValueError('Invalid capture record size')
+        return data_offset, captured
+
+    def __len__(self):
+        return self._length
+
+    def _offset(self, index):
+        """Return the file offset of a record."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('Record index out of range')
+        return self._data_offset + index * self.record_size
+
+    def timestamp(self, index):
+        """Return the timestamp of a record."""
+        return _TIMESTAMP.unpack_from(self._mmap, self._offset(index))[0]
+
+    def words(self, index):
+        """Return the raw words of all blocks of a record as array('H')."""
+        offset = self._offset(index) + self._words_offset
+        words = array('H')
+        words.frombytes(self._mmap[offset:offset + 2 * self._words])
+        if _SWAP:
+            words.byteswap()
+        return words
+
+    def __getitem__(self, index):
+        offset = self._offset(index)
+        timestamp, = _TIMESTAMP.unpack_from(self._mmap, offset)
+        mask = int.from_bytes(
+            self._mmap[offset + _TIMESTAMP.size:offset + self._words_offset],
+            'little')
+        return Record(timestamp,
+                      tuple(block for bit, block in enumerate(self._blocks)
+                            if mask & 1 << bit),
+                      self.words(index))
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
+
+    def bisect(self, timestamp):
+        """Return the index of the first record at or after a timestamp."""
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def snapshot(self, index):
+        """Decode a record into a Snapshot."""
+        return Snapshot(self.timestamp(index),
+                        self.register_map.decode(self.words(index)),
+                        register_map=self.register_map)
+
+    def snapshots(self, start=0, stop=None):
+        """Yield the Snapshots of a range of records."""
+        for index in range(*slice(start, stop).indices(self._length)):
+            yield self.snapshot(index)
+
+    def arrays(self, start=0, stop=None):
+        """Return NumPy views of a range of records without copying.
+
+        The raw block arrays can be decoded with
+        pystiebeleltron.batch.decode_blocks(*blocks,
+        register_map=reader.register_map). Requires NumPy.
+
+        Returns:
+            Tuple of the timestamps (float64 array) and a list of the raw
+            words of every block (uint16 arrays of shape (records, block
+            size)).
+        """
+        import numpy as np
+
+        start, stop, _ = slice(start, stop).indices(self._length)
+        count = max(0, stop - start)
+        offset = self._data_offset + start * self.record_size
+        timestamps = np.ndarray((count,), '<f8', self._mmap, offset,
+                                (self.record_size,))
+        blocks = []
+        position = offset + self._words_offset
+        for block in self._blocks:
+            size = self.register_map.block_sizes[block]
+            blocks.append(np.ndarray((count, size), '<u2', self._mmap,
+                                     position, (self.record_size, 2)))
+            position += 2 * size
+        return timestamps, blocks
+
+    def close(self):
+        """Unmap the file.
+
+        Arrays returned by arrays() keep the mapping open until they are
+        released.
+        """
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,123 @@
+"""
+Change detection on top of the Stiebel Eltron API.
+
+A ChangeTracker compares the register values of an API instance with the
+values it reported last and yields only the registers which changed, so
+consumers do not need to re-ship unchanged values after every update.
+"""
+import collections
+
+from pystiebeleltron.pystiebeleltron import B3_OPERATING_STATUS, _check_sync
+
+Change = collections.namedtuple('Change', 'name value previous')
+Change.__doc__ = """Changed register or OPERATING_STATUS.<FLAG> status bit."""
+
+
+class ChangeTracker():
+    """Yield registers whose value changed since they were last reported."""
+
+    def __init__(self, api, deadbands=None, status_bits=False):
+        """Initialize the tracker.
+
+        The first call of changes() reports all registers.
+
+        Args:
+            api: StiebelEltronAPI instance to track.
+            deadbands: Dict of register name to the minimum change of the
+                converted value to be reported, e.g. {'FLOW_TEMPERATURE': 0.2}.
+                Changes are measured against the last reported value, so slow
+                drifts are reported once they exceed the deadband.
+            status_bits: Report the changed bits of OPERATING_STATUS as
+                'OPERATING_STATUS.<FLAG>' with a boolean value instead of the
+                register itself.
+        """
+        register_map = api.get_register_map()
+        self._api = api
+        self._status_bits = status_bits
+        self._status_entry = \
+            register_map.index.get('OPERATING_STATUS', (None, None))[:2]
+        self._reported = {block: None for block in register_map.blocks}
+        self._deadbands = {}
+        for name, deadband in (deadbands or {}).items():
+            block, offset, _ = register_map.index[name]
+            self._deadbands[(block, offset)] = deadband
+
+        # Register names and codecs per block, indexed by offset. Offsets
+        # without register (gaps in the map) are None.
+        self._layout = {}
+        for block, size in register_map.block_sizes.items():
+            layout = [None] * size
+            for name in register_map.blocks[block][1]:
+                _, offset, codec = register_map.index[name]
+                layout[offset] = (name, codec.decode)
+            self._layout[block] = layout
+
+    def changes(self):
+        """Yield a Change for every register changed since the last call.
+
+        Registers absent from the capabilities of the heat pump and registers
+        which were not read yet are skipped.
+        """
+        capabilities = self._api.get_capabilities()
+        absent = capabilities.absent if capabilities is not None else ()
+        for block in self._layout:
+            current = self._api.get_raw_values(block)
+            known = self._api.get_known(block)
+            reported = self._reported[block]
+            if reported is None:
+                reported = self._reported[block] = [None] * len(current)
+            elif current.tolist() == reported:
+                continue
+
+            layout = self._layout[block]
+            for offset, raw in enumerate(current):
+                previous_raw = reported[offset]
+                if raw == previous_raw or not known[offset]:
+                    continue
+                if layout[offset] is None:
+                    reported[offset] = raw
+                    continue
+                name, decode = layout[offset]
+                if name in absent:
+                    continue
+                value = decode(raw)
+                previous = None if previous_raw is None else \
+                    decode(previous_raw)
+
+                deadband = self._deadbands.get((block, offset))
+                if (deadband is not None and value is not None and
+                        previous is not None and
+                        abs(value - previous) < deadband):
+                    continue
+
+                reported[offset] = raw
+                if self._status_bits and \
+                        (block, offset) == self._status_entry:
+                    yield from self._status_changes(raw, previous_raw)
+                else:
+                    yield Change(name, value, previous)
+
+    @staticmethod
+    def _status_changes(raw, previous_raw):
+        """Yield the changed bits of the operating status."""
+        for flag, mask in B3_OPERATING_STATUS.items():
+            state = bool(raw & mask)
+            if previous_raw is None or state != bool(previous_raw & mask):
+                yield Change('OPERATING_STATUS.' + flag, state,
+                             None if previous_raw is None else not state)
+
+    def poll(self, names=None, blocks=None):
+        """Update the API and yield the changes.
+
+        With the asyncio API, await update() and call changes() instead.
+
+        Args:
+            names: Register names to update, see StiebelEltronAPI.update.
+            blocks: Block numbers to update, see StiebelEltronAPI.update.
+
+        Raises:
+            TypeError: The API is an AsyncStiebelEltronAPI.
+        """
+        _check_sync(self._api, 'ChangeTracker.poll')
+        if self._api.update(names, blocks):
+            yield from self.changes()
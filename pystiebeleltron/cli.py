@@ -0,0 +1,231 @@
+"""
+Command line interface for one-shot reads and writes, e.g. from cron.
+
+    python -m pystiebeleltron read 192.168.1.20 --block 3
+    python -m pystiebeleltron read 192.168.1.20 FLOW_TEMPERATURE --json
+    python -m pystiebeleltron write 192.168.1.20 ROOM_TEMP_HEAT_DAY_HC1 21.5
+
+The export command instead runs a Prometheus exporter polling the units
+until interrupted, see pystiebeleltron.exporter:
+
+    python -m pystiebeleltron export 192.168.1.20 192.168.1.21/2
+
+Only the requested registers are read. The import path is kept short for
+fast startup: the built-in Modbus TCP transport is used instead of pymodbus
+and the asyncio, instrumentation and connection management modules are not
+imported at all.
+"""
+import argparse
+import json
+import sys
+
+from pystiebeleltron import pystiebeleltron as pyse
+
+
+def _connect(host, port, timeout):
+    """Return a connected Modbus TCP client."""
+    from pystiebeleltron.transport import ModbusTcpTransport
+    client = ModbusTcpTransport(host, port, timeout)
+    if not client.connect():
+        raise ConnectionError('Connecting to {}:{} failed'.format(host, port))
+    return client
+
+
+def _parse_value(name, text):
+    """Convert a command line value, operating modes may be given by name."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if name == 'OPERATING_MODE' and text in pyse.B2_OPERATING_MODE_WRITE:
+        return pyse.B2_OPERATING_MODE_WRITE[text]
+    raise ValueError('Invalid value {!r} for {}'.format(text, name))
+
+
+def _format(value):
+    """Return the text output of a decoded value."""
+    if value is None:
+        return 'unavailable'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read(api, names, blocks, as_json):
+    """Read and print registers, all if neither names nor blocks are given.
+
+    Returns:
+        Exit code.
+    """
+    register_map = api.get_register_map()
+    if not names and not blocks:
+        blocks = list(register_map.blocks)
+    selected = dict.fromkeys(names)
+    for block in blocks:
+        selected.update(dict.fromkeys(register_map.blocks[block][1]))
+
+    if not api.update(names=names or None, blocks=blocks or None):
+        return 1
+    values = [(name, api.get_conv_val(name)) for name in selected]
+    if as_json:
+        print(json.dumps(dict(values)))
+    else:
+        for name, value in values:
+            print('{}={}'.format(name, _format(value)))
+    return 0
+
+
+def write(api, name, value, confirm):
+    """Write a holding register.
+
+    Returns:
+        Exit code.
+    """
+    if confirm:
+        return 0 if api.write_and_confirm(name, value) else 1
+    result = api.write_values({name: value}, skip_unchanged=False)
+    return 0 if result[name] == pyse.WRITE_DONE else 1
+
+
+def _parse_target(text, default_unit):
+    """Return the host and unit id of a HOST[/UNIT] argument."""
+    host, _, unit = text.partition('/')
+    try:
+        return host, int(unit) if unit else default_unit
+    except ValueError:
+        raise ValueError('Invalid unit id in {!r}'.format(text))
+
+
+def export(targets, args, register_map):
+    """Serve Prometheus metrics of the units until interrupted.
+
+    Returns:
+        Exit code.
+    """
+    import time
+    from pystiebeleltron.connection import ConnectionPool
+    from pystiebeleltron.exporter import Exporter
+    from pystiebeleltron.transport import ModbusTcpTransport
+
+    pool = ConnectionPool(timeout=args.timeout,
+                          client_factory=ModbusTcpTransport)
+    exporter = Exporter(interval=args.interval)
+    for host, unit in targets:
+        exporter.add_unit(pool.api(host, args.port, unit,
+                                   register_map=register_map),
+                          host=host, slave=unit)
+    try:
+        exporter.start()
+        exporter.start_server(args.listen, args.listen_port)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+    except OSError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        exporter.stop()
+        pool.close()
+
+
+def _parser():
+    """Return the argument parser."""
+    parser = argparse.ArgumentParser(
+        prog='python -m pystiebeleltron',
+        description='Read and write registers of a Stiebel Eltron ISG.')
+    parser.add_argument('--port', type=int, default=502)
+    parser.add_argument('--unit', type=int, default=1,
+                        help='Modbus unit id of the heat pump')
+    parser.add_argument('--timeout', type=float, default=3.0,
+                        help='request timeout in seconds')
+    parser.add_argument('--map', help='register map file (default: ISG)')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    read_parser = commands.add_parser('read', help='read registers')
+    read_parser.add_argument('host')
+    read_parser.add_argument('names', nargs='*', metavar='NAME',
+                             help='register names')
+    read_parser.add_argument('--block', type=int, action='append',
+                             default=[], help='read all registers of a block')
+    read_parser.add_argument('--json', action='store_true',
+                             help='print a JSON object')
+
+    write_parser = commands.add_parser('write',
+                                       help='write a holding register')
+    write_parser.add_argument('host')
+    write_parser.add_argument('name', metavar='NAME')
+    write_parser.add_argument('value', metavar='VALUE')
+    write_parser.add_argument('--confirm', action='store_true',
+                              help='wait until the heat pump applied it')
+
+    export_parser = commands.add_parser(
+        'export', help='serve Prometheus metrics of polled units')
+    export_parser.add_argument('targets', nargs='+', metavar='HOST[/UNIT]',
+                               help='gateways, optionally with a unit id')
+    export_parser.add_argument('--interval', type=float, default=10.0,
+                               help='poll interval in seconds')
+    export_parser.add_argument('--listen', default='',
+                               help='address to listen on (default: all)')
+    export_parser.add_argument('--listen-port', type=int, default=9780,
+                               help='HTTP port of the metrics')
+    return parser
+
+
+def main(argv=None, connect=_connect):
+    """Run the command line interface.
+
+    Args:
+        argv: Arguments, sys.argv[1:] if None.
+        connect: Function (host, port, timeout) returning a connected
+            Modbus client.
+
+    Returns:
+        Exit code.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+
+    register_map = pyse.DEFAULT_MAP
+    if args.map:
+        from pystiebeleltron.registermap import RegisterMap
+        register_map = RegisterMap.load(args.map)
+
+    if args.command == 'export':
+        try:
+            targets = [_parse_target(target, args.unit)
+                       for target in args.targets]
+        except ValueError as exc:
+            parser.error(str(exc))
+        if args.interval <= 0:
+            parser.error('--interval must be positive')
+        return export(targets, args, register_map)
+
+    if args.command == 'read':
+        unknown = [name for name in args.names
+                   if name not in register_map.index] + \
+                  [str(block) for block in args.block
+                   if block not in register_map.blocks]
+        if unknown:
+            parser.error('unknown registers or blocks: ' + ', '.join(unknown))
+    else:
+        try:
+            value = _parse_value(args.name, args.value)
+            register_map.encode_value(args.name, value)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    try:
+        client = connect(args.host, args.port, args.timeout)
+    except (ConnectionError, OSError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    try:
+        api = pyse.StiebelEltronAPI(client, args.unit,
+                                    register_map=register_map)
+        if args.command == 'read':
+            return read(api, args.names, args.block, args.json)
+        return write(api, args.name, value, args.confirm)
+    finally:
+        client.close()
@@ -0,0 +1,229 @@
+"""
+Managed Modbus TCP connections to ISG gateways.
+
+A ManagedConnection wraps a pymodbus TCP client and can be passed to
+StiebelEltronAPI in place of a raw client. It connects on first use,
+reconnects with exponential backoff when the gateway drops the session and
+tracks the health of the connection. A ConnectionPool hands out one shared
+connection per gateway, so all units (slave ids) behind a gateway reuse the
+same TCP session.
+"""
+import collections
+import random
+import threading
+import time
+
+from pystiebeleltron.pystiebeleltron import StiebelEltronAPI
+
+Health = collections.namedtuple(
+    'Health', 'connected last_success last_failure consecutive_failures '
+              'rtt_ewma requests failures reconnects')
+Health.__doc__ = """Health of a connection. Times are seconds since epoch,
+the round-trip time EWMA is in seconds (None before the first success)."""
+
+
+def _pymodbus_client(host, port, timeout):
+    """Create a pymodbus TCP client (imported on first use)."""
+    from pymodbus.client.sync import ModbusTcpClient
+    return ModbusTcpClient(host=host, port=port, timeout=timeout)
+
+
+class ManagedConnection():
+    """Self-healing Modbus TCP connection to a gateway."""
+
+    def __init__(self, host, port=502, timeout=3.0, backoff=1.0,
+                 max_backoff=300.0, ewma_alpha=0.2,
+                 client_factory=_pymodbus_client):
+        """Initialize the connection.
+
+        Args:
+            host: Host name or IP address of the ISG.
+            port: Modbus TCP port.
+            timeout: Request timeout in seconds.
+            backoff: Delay in seconds before the first reconnect attempt,
+                doubled with every failed attempt.
+            max_backoff: Upper bound of the reconnect delay in seconds.
+            ewma_alpha: Weight of a new sample in the round-trip time EWMA.
+            client_factory: Function (host, port, timeout) returning an
+                unconnected pymodbus compatible client.
+        """
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._ewma_alpha = ewma_alpha
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = threading.Lock()
+        self._next_attempt = 0.0
+        self._connect_failures = 0
+        self._connected_once = False
+        self._observers = ()
+
+        self._last_success = None
+        self._last_failure = None
+        self._consecutive_failures = 0
+        self._rtt_ewma = None
+        self._requests = 0
+        self._failures = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        """Connect the client, honouring the reconnect backoff."""
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError('{}:{} unavailable, retry in {:.1f}s'.format(
+                self.host, self.port, self._next_attempt - now))
+
+        if self._client is None:
+            self._client = self._client_factory(
+                self.host, self.port, self._timeout)
+        start = time.perf_counter()
+        connected = self._client.connect()
+        for observer in self._observers:
+            observer.on_reconnect(self.host, self.port,
+                                  time.perf_counter() - start, connected)
+        if not connected:
+            self._connect_failures += 1
+            self._delay_reconnect(self._connect_failures)
+            raise ConnectionError('Connecting to {}:{} failed'.format(
+                self.host, self.port))
+        self._connect_failures = 0
+        self._next_attempt = 0.0
+        if self._connected_once:
+            self._reconnects += 1
+        self._connected_once = True
+
+    def _delay_reconnect(self, failures):
+        """Delay the next connection attempt by the backoff of failures."""
+        delay = min(self._backoff * 2 ** (failures - 1), self._max_backoff)
+        self._next_attempt = time.monotonic() + \
+            delay * random.uniform(0.8, 1.2)
+
+    def _record_failure(self):
+        """Count a failed request."""
+        self._failures += 1
+        self._consecutive_failures += 1
+        self._last_failure = time.time()
+
+    def _execute(self, method, *args, **kwargs):
+        """Run a client request, reconnecting if needed."""
+        with self._lock:
+            self._requests += 1
+            requested = False
+            try:
+                if self._client is None or not self._is_connected():
+                    self._connect()
+                start = time.monotonic()
+                requested = True
+                result = getattr(self._client, method)(*args, **kwargs)
+            except Exception as exc:  # pylint: disable=broad-except
+                self._record_failure()
+                self._drop()
+                if requested:
+                    # A gateway accepting connections but failing every
+                    # request is not reconnected to right away either
+                    self._delay_reconnect(self._consecutive_failures)
+                if isinstance(exc, ConnectionError):
+                    raise
+                raise ConnectionError('Request to {}:{} failed: {!r}'.format(
+                    self.host, self.port, exc)) from exc
+
+            if hasattr(result, 'isError') and result.isError():
+                # Exception response or timeout, reported to the caller
+                self._record_failure()
+                return result
+
+            rtt = time.monotonic() - start
+            self._rtt_ewma = rtt if self._rtt_ewma is None else \
+                self._rtt_ewma + self._ewma_alpha * (rtt - self._rtt_ewma)
+            self._last_success = time.time()
+            self._consecutive_failures = 0
+            return result
+
+    def _is_connected(self):
+        """Check if the client has an open socket."""
+        is_socket_open = getattr(self._client, 'is_socket_open', None)
+        return is_socket_open() if is_socket_open is not None else True
+
+    def _drop(self):
+        """Close the client after a failure, it reconnects on next use."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        """Read input registers (function code 4)."""
+        return self._execute('read_input_registers', address, count, **kwargs)
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        """Read holding registers (function code 3)."""
+        return self._execute(
+            'read_holding_registers', address, count, **kwargs)
+
+    def write_register(self, address, value, **kwargs):
+        """Write a single holding register (function code 6)."""
+        return self._execute('write_register', address, value, **kwargs)
+
+    def write_registers(self, address, values, **kwargs):
+        """Write multiple holding registers (function code 16)."""
+        return self._execute('write_registers', address, values, **kwargs)
+
+    def add_observer(self, observer):
+        """Attach an instrumentation Observer for connection attempts."""
+        self._observers = self._observers + (observer,)
+
+    def get_health(self):
+        """Return the Health of the connection."""
+        return Health(
+            self._client is not None, self._last_success, self._last_failure,
+            self._consecutive_failures, self._rtt_ewma, self._requests,
+            self._failures, self._reconnects)
+
+    def close(self):
+        """Close the connection."""
+        with self._lock:
+            self._drop()
+
+
+class ConnectionPool():
+    """Shared managed connections, one per gateway."""
+
+    def __init__(self, **connection_args):
+        """Initialize the pool.
+
+        Args:
+            connection_args: Keyword arguments for every ManagedConnection.
+        """
+        self._connection_args = connection_args
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port=502):
+        """Return the connection to a gateway, creating it on first use."""
+        with self._lock:
+            conn = self._connections.get((host, port))
+            if conn is None:
+                conn = ManagedConnection(host, port, **self._connection_args)
+                self._connections[(host, port)] = conn
+            return conn
+
+    def api(self, host, port=502, slave=1, **api_args):
+        """Return a StiebelEltronAPI for a unit on a pooled connection."""
+        return StiebelEltronAPI(self.get(host, port), slave, **api_args)
+
+    def get_health(self):
+        """Return the Health of all connections by (host, port)."""
+        with self._lock:
+            connections = dict(self._connections)
+        return {gateway: conn.get_health()
+                for gateway, conn in connections.items()}
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,307 @@
+"""
+Derived values of a heat pump, computed while updating.
+
+The registers hold the ingredients of the values operators watch: the
+compressor duty cycle (COMPRESSOR bit of OPERATING_STATUS), the compressor
+start rate (COMPRESSOR_STARTS), the heat output (FLOW_RATE times the
+FLOW_TEMPERATURE / RETURN_TEMPERATURE difference) and the defrost frequency
+(EVAPORATOR_DEFROST bit). DerivedMetrics keeps running aggregates of them
+over a sliding window, fed by every update, so they are available without
+scanning a history:
+
+    derived = api.track_derived(window=3600)
+    api.update()
+    ...
+    values = derived.values()
+    print(values.compressor_duty_cycle, values.heat_output)
+
+Each sample costs O(1) amortized: the window aggregates keep running sums
+and drop expired entries from the front of a deque. Values are held from one
+update to the next, gaps longer than max_gap count as unknown.
+"""
+import collections
+import time
+
+from pystiebeleltron.pystiebeleltron import B3_OPERATING_STATUS, DEFAULT_MAP
+
+# Volumetric heat capacity of water in kJ/(l K)
+WATER_HEAT_CAPACITY = 4.19
+
+DerivedValues = collections.namedtuple(
+    'DerivedValues',
+    'compressor_duty_cycle compressor_starts compressor_starts_per_hour '
+    'defrosts defrosts_per_hour defrost_duty_cycle delta_t heat_output')
+DerivedValues.__doc__ = """Derived values over the sliding window.
+
+Duty cycles are fractions of the covered time (0 to 1), delta_t is the mean
+flow minus return temperature in K and heat_output the mean thermal power in
+kW, estimated from FLOW_RATE in l/min. Rates are per hour of the covered
+time. Values are None until they can be computed.
+"""
+
+_INGREDIENTS = ('OPERATING_STATUS', 'COMPRESSOR_STARTS', 'FLOW_TEMPERATURE',
+                'RETURN_TEMPERATURE', 'FLOW_RATE')
+
+
+class TimeWeightedWindow():
+    """Time-weighted mean of a piecewise constant value over a window."""
+
+    __slots__ = ('window', 'max_gap', '_segments', '_integral', '_duration',
+                 '_last_time', '_last_value')
+
+    def __init__(self, window, max_gap=None):
+        """Initialize the window.
+
+        Args:
+            window: Length of the window in seconds.
+            max_gap: Longest time in seconds a value is held, None for no
+                limit.
+        """
+        self.window = window
+        self.max_gap = max_gap
+        # (start, end, value) of the covered periods, oldest first
+        self._segments = collections.deque()
+        self._integral = 0.0
+        self._duration = 0.0
+        self._last_time = None
+        self._last_value = None
+
+    def add(self, timestamp, value):
+        """Add a sample, held until the next one.
+
+        Args:
+            timestamp: Seconds since epoch, must not decrease.
+            value: Number or None if the value is not available.
+        """
+        last_time = self._last_time
+        duration = None if last_time is None else timestamp - last_time
+        if self._last_value is not None and duration is not None and \
+                duration > 0 and \
+                (self.max_gap is None or duration <= self.max_gap):
+            self._segments.append((last_time, timestamp, self._last_value))
+            self._integral += self._last_value * duration
+            self._duration += duration
+        self._last_time = timestamp
+        self._last_value = value
+        self._expire(timestamp)
+
+    def _expire(self, now):
+        """Drop the covered time before the window."""
+        cutoff = now - self.window
+        segments = self._segments
+        while segments and segments[0][0] < cutoff:
+            start, end, value = segments[0]
+            if end <= cutoff:
+                segments.popleft()
+                self._integral -= value * (end - start)
+                self._duration -= end - start
+            else:
+                # Trim the oldest segment to the window
+                segments[0] = (cutoff, end, value)
+                self._integral -= value * (cutoff - start)
+                self._duration -= cutoff - start
+        if not segments:
+            # No rounding errors left over
+            self._integral = self._duration = 0.0
+
+    @property
+    def duration(self):
+        """Seconds covered by the window."""
+        return self._duration
+
+    def mean(self, now=None):
+        """Return the mean over the window ending at now, None if empty.
+
+        Args:
+            now: End of the window in seconds since epoch, the last sample
+                if None.
+        """
+        if now is not None:
+            self._expire(now)
+        if self._duration <= 0:
+            return None
+        return self._integral / self._duration
+
+
+class EventWindow():
+    """Number of events within a window."""
+
+    __slots__ = ('window', '_events', '_count', '_since', '_last_time')
+
+    def __init__(self, window):
+        """Initialize the window.
+
+        Args:
+            window: Length of the window in seconds.
+        """
+        self.window = window
+        # (timestamp, count) of the events, oldest first
+        self._events = collections.deque()
+        self._count = 0
+        self._since = None
+        self._last_time = None
+
+    def observe(self, timestamp, count=0):
+        """Record count events at a time, 0 to extend the observed period.
+
+        Args:
+            timestamp: Seconds since epoch, must not decrease.
+            count: Number of events.
+        """
+        if self._since is None:
+            self._since = timestamp
+        if count:
+            self._events.append((timestamp, count))
+            self._count += count
+        self._last_time = timestamp
+        self._expire(timestamp)
+
+    def _expire(self, now):
+        """Drop the events before the window."""
+        cutoff = now - self.window
+        events = self._events
+        while events and events[0][0] <= cutoff:
+            self._count -= events.popleft()[1]
+
+    def count(self, now=None):
+        """Return the number of events in the window ending at now.
+
+        None before the first observation.
+        """
+        if self._since is None:
+            return None
+        if now is not None:
+            self._expire(now)
+        return self._count
+
+    def rate(self, now=None):
+        """Return the events per hour, None before a period was observed.
+
+        The rate is taken over the observed part of the window.
+        """
+        now = self._last_time if now is None else now
+        if self._since is None or now is None:
+            return None
+        period = min(now - self._since, self.window)
+        if period <= 0:
+            return None
+        return self.count(now) * 3600.0 / period
+
+
+class DerivedMetrics():
+    """Running derived values of a heat pump over a sliding window."""
+
+    def __init__(self, window=3600.0, max_gap=600.0,
+                 register_map=DEFAULT_MAP):
+        """Initialize the aggregates.
+
+        Args:
+            window: Length of the sliding window in seconds.
+            max_gap: Longest time in seconds between two updates in which
+                values are held, longer gaps count as unknown.
+            register_map: RegisterMap of the heat pump. Values whose
+                registers it lacks stay None.
+        """
+        if window <= 0 or max_gap <= 0:
+            raise ValueError('Window and max_gap must be positive')
+        self.window = window
+        self.max_gap = max_gap
+        self.register_map = register_map
+        self._compressor = TimeWeightedWindow(window, max_gap)
+        self._defrost = TimeWeightedWindow(window, max_gap)
+        self._delta_t = TimeWeightedWindow(window, max_gap)
+        self._heat_output = TimeWeightedWindow(window, max_gap)
+        self._starts = EventWindow(window)
+        self._defrosts = EventWindow(window)
+        self._last_starts = None
+        self._last_status = None
+        # Block -> {offset: (name, decoder)} of the ingredient registers
+        self._layout = {}
+        for name in _INGREDIENTS:
+            if name in register_map.index:
+                block, offset, codec = register_map.index[name]
+                self._layout.setdefault(block, {})[offset] = \
+                    (name, codec.decode)
+
+    def record(self, results, timestamp=None):
+        """Add the values of read register ranges.
+
+        Args:
+            results: List of (ReadRange, raw register values) tuples.
+            timestamp: Seconds since epoch, now if None.
+        """
+        values = {}
+        for (block, offset, count), registers in results:
+            layout = self._layout.get(block)
+            if layout is None:
+                continue
+            for position, (name, decode) in layout.items():
+                if offset <= position < offset + count:
+                    values[name] = decode(registers[position - offset])
+        if values:
+            self.add(values, time.time() if timestamp is None else timestamp)
+
+    def add(self, values, timestamp=None):
+        """Add converted register values of one update.
+
+        Args:
+            values: Dict of register name to converted value (None if not
+                available), registers which were not read are left out.
+            timestamp: Seconds since epoch, now if None.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if 'OPERATING_STATUS' in values:
+            self._add_status(values['OPERATING_STATUS'], timestamp)
+
+        if 'COMPRESSOR_STARTS' in values:
+            starts = values['COMPRESSOR_STARTS']
+            previous = self._last_starts
+            # A decreasing counter was reset, no starts are counted
+            self._starts.observe(
+                timestamp, starts - previous
+                if starts is not None and previous is not None and
+                starts > previous else 0)
+            if starts is not None:
+                self._last_starts = starts
+
+        if 'FLOW_TEMPERATURE' in values or 'RETURN_TEMPERATURE' in values:
+            flow = values.get('FLOW_TEMPERATURE')
+            ret = values.get('RETURN_TEMPERATURE')
+            delta_t = flow - ret \
+                if flow is not None and ret is not None else None
+            self._delta_t.add(timestamp, delta_t)
+            flow_rate = values.get('FLOW_RATE')
+            self._heat_output.add(
+                timestamp,
+                flow_rate / 60.0 * WATER_HEAT_CAPACITY * delta_t
+                if flow_rate is not None and delta_t is not None else None)
+
+    def _add_status(self, status, timestamp):
+        """Add an OPERATING_STATUS value."""
+        if status is None:
+            self._compressor.add(timestamp, None)
+            self._defrost.add(timestamp, None)
+            return
+        defrost_bit = B3_OPERATING_STATUS['EVAPORATOR_DEFROST']
+        self._compressor.add(
+            timestamp, 1 if status & B3_OPERATING_STATUS['COMPRESSOR'] else 0)
+        self._defrost.add(timestamp, 1 if status & defrost_bit else 0)
+        previous = self._last_status
+        # Defrosts are counted when the bit is set
+        self._defrosts.observe(
+            timestamp, 1 if previous is not None and status & defrost_bit
+            and not previous & defrost_bit else 0)
+        self._last_status = status
+
+    def values(self, now=None):
+        """Return the DerivedValues of the window ending at now.
+
+        Args:
+            now: Seconds since epoch, the last update if None.
+        """
+        return DerivedValues(
+            self._compressor.mean(now), self._starts.count(now),
+            self._starts.rate(now), self._defrosts.count(now),
+            self._defrosts.rate(now), self._defrost.mean(now),
+            self._delta_t.mean(now), self._heat_output.mean(now))
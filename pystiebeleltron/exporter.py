@@ -0,0 +1,247 @@
+"""
+Prometheus exporter for one or many heat pumps.
+
+The Exporter polls every unit on its own schedule (a Poller thread per
+unit) and serves the values of all registers as gauges, plus the
+OPERATING_STATUS flags as a gauge labeled by flag and an up gauge per unit.
+The metrics text is rendered only when the values of a unit change, so a
+scrape writes a pre-rendered buffer and never causes Modbus requests,
+however many scrapers there are:
+
+    exporter = Exporter(interval=10)
+    exporter.add_unit(pool.api('192.168.1.20'), host='192.168.1.20', slave=1)
+    exporter.start()
+    exporter.start_server(port=9780)
+
+    python -m pystiebeleltron export 192.168.1.20 192.168.1.21/2
+
+Scrapers asking for OpenMetrics in the Accept header get the same samples
+in that format.
+"""
+import re
+import threading
+
+from pystiebeleltron.pystiebeleltron import B3_OPERATING_STATUS
+
+DEFAULT_PORT = 9780
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = \
+    'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_INVALID_NAME_CHARS = re.compile('[^a-zA-Z0-9_]')
+
+
+def _escape(value):
+    """Escape a label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format(value):
+    """Return the text of a sample value."""
+    return repr(float(value))
+
+
+class _Unit():
+    """Exported heat pump."""
+
+    __slots__ = ('api', 'labels', 'key', 'samples')
+
+    def __init__(self, api, labels):
+        self.api = api
+        # Formatted label pairs, e.g. 'host="isg",slave="1"'
+        self.labels = labels
+        # Values and state of the rendered samples
+        self.key = None
+        # Metric name -> sample lines
+        self.samples = {}
+
+
+class Exporter():
+    """Poll heat pumps and serve their registers as Prometheus metrics.
+
+    Attributes:
+        renders: Number of times the metrics text was rendered.
+    """
+
+    def __init__(self, interval=10.0, prefix='stiebeleltron'):
+        """Initialize the exporter.
+
+        Args:
+            interval: Poll interval of every unit in seconds.
+            prefix: Prefix of the metric names.
+        """
+        self.interval = interval
+        self.prefix = prefix
+        self.renders = 0
+        self._units = []
+        # Metric name -> (help text, type) in rendering order
+        self._families = {}
+        self._register_metrics = {}
+        self._up = self._family(
+            prefix + '_up', 'Whether the last poll of the unit succeeded.')
+        self._flags = self._family(
+            prefix + '_operating_status_flag',
+            'Flags of the OPERATING_STATUS register (1 if set).')
+        self._lock = threading.Lock()
+        self._server = None
+        self._server_thread = None
+        self._render()
+
+    def _family(self, name, help_text, kind='gauge'):
+        """Register a metric family and return its name."""
+        self._families.setdefault(name, (help_text, kind))
+        return name
+
+    def _register_metric(self, register_map, name):
+        """Return the metric name of a register."""
+        metric = self._register_metrics.get(name)
+        if metric is None:
+            metric = self._register_metrics[name] = self._family(
+                '{}_{}'.format(self.prefix,
+                               _INVALID_NAME_CHARS.sub('_', name.lower())),
+                'Register {} of block {}.'.format(
+                    name, register_map.index[name][0]))
+        return metric
+
+    def add_unit(self, api, **labels):
+        """Export a heat pump, call before start().
+
+        Args:
+            api: StiebelEltronAPI of the unit.
+            labels: Label values identifying the unit, e.g. host and slave.
+        """
+        unit = _Unit(api, ','.join('{}="{}"'.format(key, _escape(value))
+                                   for key, value in sorted(labels.items())))
+        self._units.append(unit)
+
+    def start(self):
+        """Start polling all units."""
+        for unit in self._units:
+            unit.api.start_polling(
+                self.interval,
+                on_publish=lambda polled, unit=unit: self._publish(
+                    unit, polled))
+
+    def _publish(self, unit, polled):
+        """Re-render the metrics if the published values of a unit changed.
+
+        The values of the last successful poll stay exported with up 0
+        while the unit fails.
+        """
+        snapshot = polled.snapshot
+        key = (snapshot.values if snapshot is not None else None,
+               polled.error is None)
+        if key == unit.key:
+            return
+        with self._lock:
+            unit.samples = self._unit_samples(unit, polled)
+            unit.key = key
+            self._render()
+
+    def _sample(self, metric, labels, value):
+        """Return a sample line."""
+        if labels:
+            return '{}{{{}}} {}'.format(metric, labels, value)
+        return '{} {}'.format(metric, value)
+
+    def _unit_samples(self, unit, polled):
+        """Return the sample lines of a unit by metric name."""
+        labels = unit.labels
+        samples = {self._up: [self._sample(
+            self._up, labels, 1 if polled.error is None else 0)]}
+        snapshot = polled.snapshot
+        if snapshot is None:
+            return samples
+        register_map = snapshot.register_map
+        for name, value in zip(register_map.fields, snapshot.values):
+            if value is not None and name not in snapshot.absent:
+                metric = self._register_metric(register_map, name)
+                samples[metric] = [self._sample(metric, labels,
+                                                _format(value))]
+        if snapshot.get('OPERATING_STATUS') is not None:
+            prefix = labels + ',' if labels else ''
+            samples[self._flags] = [
+                self._sample(self._flags, '{}flag="{}"'.format(prefix, flag),
+                             int(flag in snapshot.operating_status))
+                for flag in B3_OPERATING_STATUS]
+        return samples
+
+    def _render(self):
+        """Render the metrics text of all units."""
+        lines = []
+        for metric, (help_text, kind) in self._families.items():
+            samples = [line for unit in self._units
+                       for line in unit.samples.get(metric, ())]
+            if samples:
+                lines.append('# HELP {} {}'.format(metric, help_text))
+                lines.append('# TYPE {} {}'.format(metric, kind))
+                lines.extend(samples)
+        body = '\n'.join(lines).encode() + (b'\n' if lines else b'')
+        # Scrapes read either the previous or the new buffers
+        self._bodies = (body, body + b'# EOF\n')
+        self.renders += 1
+
+    def render(self, openmetrics=False):
+        """Return the rendered metrics text.
+
+        Args:
+            openmetrics: Return the OpenMetrics format instead of the
+                Prometheus text format.
+        """
+        return self._bodies[1 if openmetrics else 0]
+
+    def start_server(self, host='', port=DEFAULT_PORT):
+        """Serve the metrics over HTTP in a background thread.
+
+        Args:
+            host: Address to listen on, all interfaces if empty.
+            port: TCP port, a free one if 0.
+
+        Returns:
+            The (host, port) the server listens on.
+        """
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Write the pre-rendered metrics text."""
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in \
+                    self.headers.get('Accept', '')
+                body = exporter.render(openmetrics)
+                self.send_response(200)
+                self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE
+                                 if openmetrics else CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever, name='StiebelEltronExporter',
+            daemon=True)
+        self._server_thread.start()
+        return self._server.server_address[:2]
+
+    def stop(self):
+        """Stop the server and polling of all units."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+        for unit in self._units:
+            unit.api.stop_polling()
@@ -0,0 +1,186 @@
+"""
+Poll a fleet of Stiebel Eltron heat pumps concurrently.
+
+The FleetPoller refreshes many ISG gateways with the asyncio API. At most
+`concurrency` units are requested at the same time, every unit gets its own
+timeout and units which stop replying are polled less often (exponential
+backoff) until they answer again. Units behind the same gateway share one
+connection, which is opened again after the gateway dropped it.
+"""
+import asyncio
+import collections
+import random
+import time
+
+from pystiebeleltron.aio import AsyncStiebelEltronAPI, open_connection
+
+Target = collections.namedtuple('Target', 'host port slave timeout')
+Target.__new__.__defaults__ = (None,)
+Target.__doc__ = """Heat pump to poll. timeout None uses the poller default."""
+
+UnitSnapshot = collections.namedtuple(
+    'UnitSnapshot',
+    'target ok timestamp latency values error consecutive_failures')
+UnitSnapshot.__doc__ = """Result of refreshing one unit.
+
+values is the Snapshot of the unit (None on failure), error the exception
+type name of the last failure or None.
+"""
+
+
+def _is_open(conn):
+    """Check if a gateway connection is still open."""
+    is_socket_open = getattr(conn, 'is_socket_open', None)
+    if is_socket_open is not None:
+        return is_socket_open()
+    # Client protocol of pymodbus
+    return getattr(conn, 'connected', True)
+
+
+class _Unit():
+    """Polling state of a single target."""
+
+    __slots__ = ('target', 'api', 'next_poll', 'failures', 'snapshot')
+
+    def __init__(self, target):
+        self.target = target
+        self.api = None
+        self.next_poll = 0.0
+        self.failures = 0
+        self.snapshot = None
+
+
+class FleetPoller():
+    """Refresh many heat pumps with bounded parallelism."""
+
+    def __init__(self, targets, concurrency=50, timeout=5.0, interval=60.0,
+                 jitter=0.1, max_backoff=900.0,
+                 client_factory=open_connection):
+        """Initialize the fleet poller.
+
+        Args:
+            targets: Iterable of (host, port, slave) or Target tuples.
+            concurrency: Maximum number of units refreshed at once.
+            timeout: Default timeout in seconds for refreshing one unit.
+            interval: Poll interval in seconds.
+            jitter: Relative random spread of the poll interval (0.1 = 10%).
+            max_backoff: Upper bound in seconds for the delay after failures.
+            client_factory: Coroutine function (host, port) returning a
+                connected asyncio Modbus client, the built-in transport by
+                default.
+        """
+        self._units = [_Unit(Target(*target)) for target in targets]
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._interval = interval
+        self._jitter = jitter
+        self._max_backoff = max_backoff
+        self._client_factory = client_factory
+        self._connections = {}
+        self._locks = {}
+        self._semaphore = None
+
+    def _delay(self, failures):
+        """Return the jittered delay until the next poll."""
+        delay = min(self._interval * (2 ** failures), self._max_backoff) \
+            if failures else self._interval
+        return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    async def _get_api(self, unit):
+        """Return the API of a unit, connecting to its gateway if needed."""
+        if unit.api is None:
+            gateway = (unit.target.host, unit.target.port)
+            lock = self._locks.setdefault(gateway, asyncio.Lock())
+            async with lock:
+                conn = self._connections.get(gateway)
+                if conn is None:
+                    conn = await self._client_factory(*gateway)
+                    self._connections[gateway] = conn
+            unit.api = AsyncStiebelEltronAPI(conn, unit.target.slave)
+        return unit.api
+
+    def _drop_connection(self, unit):
+        """Close the gateway connection of a unit after a connection error."""
+        gateway = (unit.target.host, unit.target.port)
+        conn = self._connections.pop(gateway, None)
+        if conn is not None and hasattr(conn, 'close'):
+            conn.close()
+        for other in self._units:
+            if (other.target.host, other.target.port) == gateway:
+                other.api = None
+
+    async def _poll(self, unit):
+        """Refresh a single unit and record its snapshot."""
+        timeout = unit.target.timeout or self._timeout
+        async with self._semaphore:
+            start = time.monotonic()
+            error = None
+            values = None
+            try:
+                api = await asyncio.wait_for(self._get_api(unit), timeout)
+                values = await asyncio.wait_for(api.snapshot(), timeout)
+                if values is None:
+                    error = 'ModbusReadFailed'
+                    gateway = (unit.target.host, unit.target.port)
+                    if not _is_open(self._connections.get(gateway)):
+                        # The gateway dropped the session, connect again
+                        self._drop_connection(unit)
+            except asyncio.TimeoutError as exc:
+                # Only this unit is slow, the gateway may serve the others
+                error = type(exc).__name__
+            except OSError as exc:
+                error = type(exc).__name__
+                self._drop_connection(unit)
+            except Exception as exc:  # pylint: disable=broad-except
+                error = type(exc).__name__
+            latency = time.monotonic() - start
+
+        unit.failures = 0 if error is None else unit.failures + 1
+        unit.next_poll = time.monotonic() + self._delay(unit.failures)
+        unit.snapshot = UnitSnapshot(
+            unit.target, error is None, time.time(), latency, values, error,
+            unit.failures)
+        return unit.snapshot
+
+    async def sweep(self, due_only=False):
+        """Refresh the units once.
+
+        Args:
+            due_only: Only refresh units whose poll time has come.
+
+        Returns:
+            List of UnitSnapshot of the refreshed units.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        now = time.monotonic()
+        units = [unit for unit in self._units
+                 if not due_only or unit.next_poll <= now]
+        return list(await asyncio.gather(*[self._poll(u) for u in units]))
+
+    async def run(self, callback):
+        """Poll the fleet until cancelled.
+
+        Args:
+            callback: Called with the list of UnitSnapshot after each sweep.
+        """
+        while self._units:
+            snapshots = await self.sweep(due_only=True)
+            if snapshots:
+                callback(snapshots)
+            next_poll = min(unit.next_poll for unit in self._units)
+            await asyncio.sleep(max(0.0, next_poll - time.monotonic()))
+
+    def get_snapshots(self):
+        """Return the last snapshot of every unit polled so far."""
+        return [unit.snapshot for unit in self._units
+                if unit.snapshot is not None]
+
+    def close(self):
+        """Close all gateway connections."""
+        for conn in self._connections.values():
+            if hasattr(conn, 'close'):
+                conn.close()
+        self._connections.clear()
+        for unit in self._units:
+            unit.api = None
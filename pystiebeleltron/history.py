@@ -0,0 +1,249 @@
+"""
+Recent register history of a heat pump.
+
+A History keeps the converted values of every update in fixed-size ring
+buffers, one per register, so dashboards and derived values (COP, defrost
+frequency, compressor start rate) can query the recent past without polling
+the heat pump again:
+
+    history = api.record_history(retention=24 * 3600, interval=10)
+    api.update()
+    ...
+    for bucket in history.downsample('FLOW_TEMPERATURE', 300, last=86400):
+        print(bucket.start, bucket.min, bucket.max, bucket.mean)
+
+Buffers are allocated once (array('d') of timestamps and values), appending
+a sample overwrites the oldest one.
+"""
+import bisect
+import collections
+import math
+import time
+from array import array
+
+from pystiebeleltron.pystiebeleltron import DEFAULT_MAP
+
+Sample = collections.namedtuple('Sample', 'timestamp value')
+Sample.__doc__ = """Converted register value, None if it was not available.
+The timestamp is in seconds since epoch."""
+
+Bucket = collections.namedtuple('Bucket', 'start min max mean count')
+Bucket.__doc__ = """Aggregated samples of a window starting at start (seconds
+since epoch, a multiple of the window length). count is the number of
+available values."""
+
+_NAN = float('nan')
+
+
+class RingBuffer():
+    """Fixed-size buffer of (timestamp, value) samples."""
+
+    __slots__ = ('capacity', '_times', '_values', '_next', '_size')
+
+    def __init__(self, capacity):
+        """Initialize the buffer.
+
+        Args:
+            capacity: Number of samples kept, older ones are overwritten.
+        """
+        if capacity < 1:
+            raise ValueError('Capacity must be positive')
+        self.capacity = capacity
+        self._times = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, value):
+        """Append a sample, timestamps must not decrease.
+
+        Args:
+            timestamp: Seconds since epoch.
+            value: Number or None if the value is not available.
+        """
+        index = self._next
+        self._times[index] = timestamp
+        self._values[index] = _NAN if value is None else value
+        self._next = (index + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def latest(self):
+        """Return the newest Sample or None if the buffer is empty."""
+        if not self._size:
+            return None
+        index = self._next - 1
+        return Sample(self._times[index], _value(self._values[index]))
+
+    def arrays(self, since=None, until=None):
+        """Return the timestamps and values in a time range, oldest first.
+
+        Args:
+            since: Start of the range (inclusive), None for the oldest sample.
+            until: End of the range (exclusive), None for the newest sample.
+
+        Returns:
+            Tuple of array('d') timestamps and values (NaN if unavailable).
+        """
+        if self._size < self.capacity:
+            times = self._times[:self._size]
+            values = self._values[:self._size]
+        else:
+            times = self._times[self._next:] + self._times[:self._next]
+            values = self._values[self._next:] + self._values[:self._next]
+        first = 0 if since is None else bisect.bisect_left(times, since)
+        last = len(times) if until is None else \
+            bisect.bisect_left(times, until)
+        return times[first:last], values[first:last]
+
+
+def _value(value):
+    """Return None for NaN values."""
+    return None if math.isnan(value) else value
+
+
+class History():
+    """Ring buffers of the converted register values of a heat pump."""
+
+    def __init__(self, names=None, retention=86400, interval=60,
+                 register_map=DEFAULT_MAP):
+        """Initialize the history.
+
+        Args:
+            names: Register names to keep, all registers of the map if None.
+            retention: Period in seconds to keep, older samples are not
+                returned by queries.
+            interval: Expected minimum time in seconds between updates. The
+                buffers hold retention / interval samples, so more frequent
+                updates shorten the period actually kept.
+            register_map: RegisterMap of the heat pump.
+        """
+        if retention <= 0 or interval <= 0:
+            raise ValueError('Retention and interval must be positive')
+        names = register_map.index if names is None else names
+        unknown = [name for name in names if name not in register_map.index]
+        if unknown:
+            raise ValueError('Unknown registers: ' + ', '.join(unknown))
+
+        self.retention = retention
+        self.register_map = register_map
+        capacity = int(math.ceil(retention / interval)) + 1
+        self._buffers = {name: RingBuffer(capacity) for name in names}
+        # Buffers and decoders per block, indexed by offset. Offsets of
+        # registers which are not kept are None.
+        self._layout = {}
+        for name, buffer in self._buffers.items():
+            block, offset, codec = register_map.index[name]
+            layout = self._layout.setdefault(
+                block, [None] * register_map.block_sizes[block])
+            layout[offset] = (buffer, codec.decode)
+
+    @property
+    def names(self):
+        """Names of the registers kept."""
+        return tuple(self._buffers)
+
+    def record(self, results, timestamp=None):
+        """Append the values of read register ranges.
+
+        Args:
+            results: List of (ReadRange, raw register values) tuples.
+            timestamp: Seconds since epoch, now if None.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        for (block, offset, count), registers in results:
+            layout = self._layout.get(block)
+            if layout is None:
+                continue
+            for entry, raw in zip(layout[offset:offset + count], registers):
+                if entry is not None:
+                    buffer, decode = entry
+                    buffer.append(timestamp, decode(raw))
+
+    def append(self, name, value, timestamp=None):
+        """Append a converted value of a register.
+
+        Args:
+            name: Register name.
+            value: Converted value or None if it is not available.
+            timestamp: Seconds since epoch, now if None.
+        """
+        self._buffers[name].append(
+            time.time() if timestamp is None else timestamp, value)
+
+    def _range(self, name, last, until):
+        """Return the timestamps and values of a query."""
+        end = time.time() if until is None else until
+        since = end - self.retention
+        if last is not None:
+            since = max(since, end - last)
+        return self._buffers[name].arrays(since, until)
+
+    def latest(self, name):
+        """Return the newest Sample of a register or None."""
+        return self._buffers[name].latest()
+
+    def samples(self, name, last=None, until=None):
+        """Return the samples of a register, oldest first.
+
+        Args:
+            name: Register name.
+            last: Period in seconds before until, the retention if None.
+            until: End of the period (exclusive) in seconds since epoch,
+                now if None.
+
+        Returns:
+            List of Sample.
+        """
+        times, values = self._range(name, last, until)
+        return [Sample(timestamp, _value(value))
+                for timestamp, value in zip(times, values)]
+
+    def downsample(self, name, window, last=None, until=None):
+        """Aggregate the samples of a register over fixed windows.
+
+        Windows start at multiples of window seconds since epoch. Windows
+        without available values are left out.
+
+        Args:
+            name: Register name.
+            window: Window length in seconds, e.g. 300.
+            last: Period in seconds before until, the retention if None.
+            until: End of the period (exclusive) in seconds since epoch,
+                now if None.
+
+        Returns:
+            List of Bucket, oldest first.
+        """
+        if window <= 0:
+            raise ValueError('Window must be positive')
+        buckets = []
+        start = None
+        low = high = total = 0.0
+        count = 0
+        for timestamp, value in zip(*self._range(name, last, until)):
+            if math.isnan(value):
+                # Not available
+                continue
+            bucket_start = timestamp - timestamp % window
+            if bucket_start != start:
+                if start is not None:
+                    buckets.append(Bucket(start, low, high, total / count,
+                                          count))
+                start = bucket_start
+                low = high = total = value
+                count = 1
+                continue
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+            total += value
+            count += 1
+        if start is not None:
+            buckets.append(Bucket(start, low, high, total / count, count))
+        return buckets
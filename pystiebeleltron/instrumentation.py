@@ -0,0 +1,228 @@
+"""
+Instrumentation of the Stiebel Eltron API.
+
+Observers are attached with StiebelEltronAPI.add_observer (and
+ManagedConnection.add_observer for connection events). They are called for
+every Modbus request, failure, decode pass and reconnect. Without attached
+observers the API skips all measurements.
+
+MetricsObserver records the events in a MetricsRegistry, which renders them
+in the Prometheus text exposition format.
+"""
+import bisect
+import threading
+
+# Modbus TCP framing: MBAP header, request and read response PDU sizes
+MBAP_SIZE = 7
+READ_REQUEST_SIZE = MBAP_SIZE + 5
+READ_RESPONSE_SIZE = MBAP_SIZE + 2
+
+
+def read_bytes(count):
+    """Return the bytes transferred by a Modbus TCP read of count registers."""
+    return READ_REQUEST_SIZE + READ_RESPONSE_SIZE + 2 * count
+
+
+class Observer():
+    """Base class of observers, all callbacks do nothing by default."""
+
+    def on_request(self, slave, block, address, count, duration, nbytes):
+        """Called after a successful read request.
+
+        Args:
+            slave: Modbus unit id.
+            block: Block number of the read registers.
+            address: First register address.
+            count: Number of registers.
+            duration: Request latency in seconds.
+            nbytes: Bytes transferred (request and response).
+        """
+
+    def on_request_error(self, slave, block, address, count, duration, exc):
+        """Called after a failed read request with the raised exception."""
+
+    def on_shared(self, slave, kind, requests):
+        """Called when a caller joined an identical request in flight.
+
+        Only with StiebelEltronAPI(single_flight=True).
+
+        Args:
+            slave: Modbus unit id.
+            kind: 'update' for a whole update, 'read' for a range read.
+            requests: Number of Modbus requests saved.
+        """
+
+    def on_decode(self, slave, stage, count, duration):
+        """Called after a decode pass.
+
+        Args:
+            slave: Modbus unit id.
+            stage: 'store' for storing read values, 'snapshot' for decoding.
+            count: Number of registers processed.
+            duration: Time spent in seconds.
+        """
+
+    def on_reconnect(self, host, port, duration, success):
+        """Called after a connection attempt of a ManagedConnection."""
+
+
+class _Metric():
+    """Metric with values per label set."""
+
+    def __init__(self, name, kind, help_text, labels):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _format_labels(self, label_values, extra=''):
+        """Return the label part of a sample line."""
+        pairs = ['{}="{}"'.format(k, v)
+                 for k, v in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, 'counter', help_text, labels)
+
+    def inc(self, *label_values, amount=1):
+        """Increase the counter of a label set."""
+        with self.lock:
+            self.values[label_values] = \
+                self.values.get(label_values, 0) + amount
+
+    def render(self):
+        """Yield the sample lines."""
+        for label_values, value in sorted(self.values.items()):
+            yield '{}{} {}'.format(
+                self.name, self._format_labels(label_values), value)
+
+
+class Histogram(_Metric):
+    """Histogram with cumulative buckets."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0)
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, 'histogram', help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        """Add an observation to the histogram of a label set."""
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def render(self):
+        """Yield the sample lines."""
+        for label_values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    self._format_labels(label_values, 'le="{}"'.format(bound)),
+                    cumulative)
+            labels = self._format_labels(label_values)
+            yield '{}_sum{} {}'.format(self.name, labels, total)
+            yield '{}_count{} {}'.format(self.name, labels, cumulative)
+
+
+class MetricsRegistry():
+    """Collection of metrics rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        """Create and register a Counter."""
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), **kwargs):
+        """Create and register a Histogram."""
+        return self._register(Histogram(name, help_text, labels, **kwargs))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsObserver(Observer):
+    """Observer recording the API events in a MetricsRegistry."""
+
+    def __init__(self, registry=None, prefix='stiebeleltron'):
+        """Initialize the observer.
+
+        Args:
+            registry: MetricsRegistry to use, a new one if None.
+            prefix: Prefix of the metric names.
+        """
+        self.registry = registry if registry is not None else \
+            MetricsRegistry()
+        reg = self.registry
+        self.request_duration = reg.histogram(
+            prefix + '_request_duration_seconds',
+            'Latency of Modbus read requests.', ('slave', 'block'))
+        self.request_bytes = reg.counter(
+            prefix + '_request_bytes_total',
+            'Bytes transferred by Modbus read requests.', ('slave', 'block'))
+        self.request_errors = reg.counter(
+            prefix + '_request_errors_total',
+            'Failed Modbus read requests.', ('slave', 'block', 'error'))
+        self.requests_saved = reg.counter(
+            prefix + '_requests_saved_total',
+            'Modbus requests saved by joining identical requests in flight.',
+            ('slave', 'kind'))
+        self.decode_seconds = reg.counter(
+            prefix + '_decode_seconds_total',
+            'Time spent storing and decoding register values.',
+            ('slave', 'stage'))
+        self.reconnects = reg.counter(
+            prefix + '_connects_total',
+            'Connection attempts.', ('host', 'port', 'success'))
+        self.reconnect_duration = reg.histogram(
+            prefix + '_connect_duration_seconds',
+            'Duration of connection attempts.', ('host', 'port'))
+
+    def on_request(self, slave, block, address, count, duration, nbytes):
+        self.request_duration.observe(duration, slave, block)
+        self.request_bytes.inc(slave, block, amount=nbytes)
+
+    def on_request_error(self, slave, block, address, count, duration, exc):
+        self.request_duration.observe(duration, slave, block)
+        self.request_errors.inc(slave, block, type(exc).__name__)
+
+    def on_shared(self, slave, kind, requests):
+        self.requests_saved.inc(slave, kind, amount=requests)
+
+    def on_decode(self, slave, stage, count, duration):
+        self.decode_seconds.inc(slave, stage, amount=duration)
+
+    def on_reconnect(self, host, port, duration, success):
+        self.reconnects.inc(host, port, str(success).lower())
+        self.reconnect_duration.observe(duration, host, port)
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        return self.registry.render()
@@ -0,0 +1,153 @@
+"""
+Background polling of a heat pump.
+
+A Poller thread owns the connection of a StiebelEltronAPI: it updates the
+registers on a fixed interval and publishes an immutable PolledSnapshot by
+replacing a single reference. Reader threads (e.g. web handlers calling the
+getters) get consistent values without locks and without Modbus requests:
+
+    poller = api.start_polling(interval=10)
+    ...
+    api.get_current_temp()              # served from the last snapshot
+    polled = api.get_polled_snapshot()
+    if polled.stale:
+        ...
+    api.stop_polling()
+
+Updates and writes of other threads are serialized with the poll cycles.
+"""
+import collections
+import threading
+import time
+
+
+class PolledSnapshot(collections.namedtuple(
+        'PolledSnapshot',
+        'snapshot updated attempted failures error interval')):
+    """Snapshot published by the Poller.
+
+    snapshot is the Snapshot of the last successful update (None before the
+    first one), updated and attempted are the time.monotonic() of the last
+    successful and the last attempted update, failures the number of failed
+    updates since the last success and error the type name of the last
+    failure (None after a success). interval is the poll interval in
+    seconds.
+    """
+
+    __slots__ = ()
+
+    @property
+    def age(self):
+        """Seconds since the last successful update, None before the first."""
+        if self.updated is None:
+            return None
+        return time.monotonic() - self.updated
+
+    @property
+    def stale(self):
+        """True if no update succeeded within twice the poll interval."""
+        age = self.age
+        return age is None or age > 2 * self.interval
+
+
+class Poller():
+    """Thread updating an API and publishing its snapshots."""
+
+    def __init__(self, api, interval=10.0, names=None, blocks=None,
+                 on_publish=None):
+        """Initialize the poller, start() starts the thread.
+
+        Args:
+            api: StiebelEltronAPI to update.
+            interval: Seconds between the starts of two updates.
+            names: Register names to update, see StiebelEltronAPI.update.
+            blocks: Block numbers to update, see StiebelEltronAPI.update.
+            on_publish: Function called by the poller thread with every
+                published PolledSnapshot.
+        """
+        if interval <= 0:
+            raise ValueError('Interval must be positive')
+        self.interval = interval
+        self._api = api
+        self._names = names
+        self._blocks = blocks
+        self._on_publish = on_publish
+        # Serializes the use of the connection by all threads
+        self.lock = threading.RLock()
+        self.polled = PolledSnapshot(None, None, None, 0, None, interval)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        """True while the thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the poller thread, the first update runs immediately."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='StiebelEltronPoller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the poller thread and wait until it finished.
+
+        Args:
+            timeout: Seconds to wait for a running update.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Poll until stopped, at a fixed rate."""
+        next_poll = time.monotonic()
+        while True:
+            self.poll()
+            next_poll += self.interval
+            delay = next_poll - time.monotonic()
+            if delay < 0:
+                # Overran the interval, skip the missed polls
+                next_poll -= delay
+                delay = 0
+            if self._stop.wait(delay):
+                return
+
+    def poll(self):
+        """Update the API once and publish the result.
+
+        Returns:
+            The published PolledSnapshot.
+        """
+        attempted = time.monotonic()
+        error = None
+        snapshot = None
+        try:
+            # The update takes the lock itself. Holding it here would block
+            # a concurrent identical update this one joins (single_flight).
+            if self._api.update(self._names, self._blocks):
+                with self.lock:
+                    snapshot = self._api._decode_snapshot()
+            else:
+                error = 'ConnectionError'
+        except Exception as exc:  # pylint: disable=broad-except
+            # Keep polling, the error is published
+            error = type(exc).__name__
+
+        previous = self.polled
+        if error is None:
+            polled = PolledSnapshot(snapshot, attempted, attempted, 0, None,
+                                    self.interval)
+        else:
+            polled = previous._replace(attempted=attempted,
+                                       failures=previous.failures + 1,
+                                       error=error)
+        # Readers see either the previous or the new snapshot
+        self.polled = polled
+        if self._on_publish is not None:
+            self._on_publish(polled)
+        return polled
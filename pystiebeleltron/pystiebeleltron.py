@@ -16,89 +16,35 @@ type | range      | for reading | for writing |        | size 1 | size 5
      |  327.67    |             |             |        |        |
 8    | 0 to 255   | 1           | 1           | No     | 1      | 5
 """
+import time
+from array import array
 
-# Error - sensor lead is missing or disconnected.
-ERROR_NOTAVAILABLE = -60
-# Error - short circuit of the sensor lead.
-ERROR_SHORTCUT = -50
-# Error - object unavailable.
-ERROR_OBJ_UNAVAILBLE = 0x8000
+from pystiebeleltron.registermap import (  # noqa: F401
+    CODECS, DATA_TYPES, ERROR_NOTAVAILABLE, ERROR_OBJ_UNAVAILBLE,
+    ERROR_SHORTCUT, MAX_READ_COUNT, MAX_READ_GAP, Codec, ReadRange,
+    RegisterMap, load_map)
 
-UNAVAILABLE_OBJECT = 32768
+# Register map of the ISG, see pystiebeleltron/maps/isg.json
+DEFAULT_MAP = load_map('isg')
 
 # Block 1 System values (Read input register) - page 29
-B1_START_ADDR = 0
-
-B1_REGMAP_INPUT = {
-    # HC = Heating Circuit
-    'ACTUAL_ROOM_TEMPERATURE_HC1':      {'addr':  0, 'type': 2, 'value': 0},
-    'SET_ROOM_TEMPERATURE_HC1':         {'addr':  1, 'type': 2, 'value': 0},
-    'RELATIVE_HUMIDITY_HC1':            {'addr':  2, 'type': 2, 'value': 0},
-    'ACTUAL_ROOM_TEMPERATURE_HC2':      {'addr':  3, 'type': 2, 'value': 0},
-    'SET_ROOM_TEMPERATURE_HC2':         {'addr':  4, 'type': 2, 'value': 0},
-    'RELATIVE_HUMIDITY_HC2':            {'addr':  5, 'type': 2, 'value': 0},
-    'OUTSIDE_TEMPERATURE':              {'addr':  6, 'type': 2, 'value': 0},
-    'ACTUAL_VALUE_HC1':                 {'addr':  7, 'type': 2, 'value': 0},
-    'SET_VALUE_HC1':                    {'addr':  8, 'type': 2, 'value': 0},
-    'ACTUAL_VALUE_HC2':                 {'addr':  9, 'type': 2, 'value': 0},
-    'SET_VALUE_HC2':                    {'addr': 10, 'type': 2, 'value': 0},
-    'FLOW_TEMPERATURE':                 {'addr': 11, 'type': 2, 'value': 0},
-    'RETURN_TEMPERATURE':               {'addr': 12, 'type': 2, 'value': 0},
-    'PRESSURE_HEATING_CIRCUIT':         {'addr': 13, 'type': 2, 'value': 0},
-    'FLOW_RATE':                        {'addr': 14, 'type': 2, 'value': 0},
-    'ACTUAL_DHW_TEMPERATURE':           {'addr': 15, 'type': 2, 'value': 0},
-    'SET_DHW_TEMPERATURE':              {'addr': 16, 'type': 2, 'value': 0},
-    'VENTILATION_AIR_ACTUAL_FAN_SPEED': {'addr': 17, 'type': 6, 'value': 0},
-    'VENTILATION_AIR_SET_FLOW_RATE':    {'addr': 18, 'type': 6, 'value': 0},
-    'EXTRACT_AIR_ACTUAL_FAN_SPEED':     {'addr': 19, 'type': 6, 'value': 0},
-    'EXTRACT_AIR_SET_FLOW_RATE':        {'addr': 20, 'type': 6, 'value': 0},
-    'EXTRACT_AIR_HUMIDITY':             {'addr': 21, 'type': 6, 'value': 0},
-    'EXTRACT_AIR_TEMPERATURE':          {'addr': 22, 'type': 2, 'value': 0},
-    'EXTRACT_AIR_DEW_POINT':            {'addr': 23, 'type': 2, 'value': 0},
-    'DEW_POINT_TEMPERATUR_HC1':         {'addr': 24, 'type': 2, 'value': 0},
-    'DEW_POINT_TEMPERATUR_HC2':         {'addr': 25, 'type': 2, 'value': 0},
-    'COLLECTOR_TEMPERATURE':            {'addr': 26, 'type': 2, 'value': 0},
-    'HOT_GAS_TEMPERATURE':              {'addr': 27, 'type': 2, 'value': 0},
-    'HIGH_PRESSURE':                    {'addr': 28, 'type': 7, 'value': 0},
-    'LOW_PRESSURE':                     {'addr': 29, 'type': 7, 'value': 0},
-    'COMPRESSOR_STARTS':                {'addr': 30, 'type': 6, 'value': 0},
-    'COMPRESSOR_SPEED':                 {'addr': 31, 'type': 2, 'value': 0},
-    'MIXED_WATER_AMOUNT':               {'addr': 32, 'type': 6, 'value': 0}
-}
+B1_START_ADDR, B1_REGMAP_INPUT = DEFAULT_MAP.blocks[1][:2]
+# Block 2 System parameters (Read/write holding register) - page 30
+B2_START_ADDR, B2_REGMAP_HOLDING = DEFAULT_MAP.blocks[2][:2]
+# Block 3 System status (Read input register) - page 31
+B3_START_ADDR, B3_REGMAP_INPUT = DEFAULT_MAP.blocks[3][:2]
 
+# Register blocks: block number -> (start address, register map, read call)
+BLOCKS = DEFAULT_MAP.blocks
+# Register name -> (block number, offset in block, codec)
+REGISTER_INDEX = DEFAULT_MAP.index
+# Snapshot schema: all register names ordered by block and offset
+SNAPSHOT_FIELDS = DEFAULT_MAP.fields
+SNAPSHOT_INDEX = DEFAULT_MAP.field_index
+# Ranges covering the full blocks
+BLOCK_RANGES = DEFAULT_MAP.block_ranges
 
-# Block 2 System parameters (Read/write holding register) - page 30
-B2_START_ADDR = 1000
-
-B2_REGMAP_HOLDING = {
-    'OPERATING_MODE':           {'addr': 1000, 'type': 8, 'value': 0},
-    'ROOM_TEMP_HEAT_DAY_HC1':   {'addr': 1001, 'type': 2, 'value': 0},
-    'ROOM_TEMP_HEAT_NIGHT_HC1': {'addr': 1002, 'type': 2, 'value': 0},
-    'MANUAL_SET_TEMP_HC1':      {'addr': 1003, 'type': 2, 'value': 0},
-    'ROOM_TEMP_HEAT_DAY_HC2':   {'addr': 1004, 'type': 2, 'value': 0},
-    'ROOM_TEMP_HEAT_NIGHT_HC2': {'addr': 1005, 'type': 2, 'value': 0},
-    'MANUAL_SET_TEAMP_HC2':     {'addr': 1006, 'type': 2, 'value': 0},
-    'GRADIENT_HC1':             {'addr': 1007, 'type': 7, 'value': 0},
-    'LOW_END_HC1':              {'addr': 1008, 'type': 2, 'value': 0},
-    'GRADIENT_HC2':             {'addr': 1009, 'type': 7, 'value': 0},
-    'LOW_END_HC2':              {'addr': 1010, 'type': 2, 'value': 0},
-    'DHW_TEMP_SET_DAY':         {'addr': 1011, 'type': 2, 'value': 0},
-    'DHW_TEMP_SET_NIGHT':       {'addr': 1012, 'type': 2, 'value': 0},
-    'DHW_TEMP_SET_MANUAL':      {'addr': 1013, 'type': 2, 'value': 0},
-    'MWM_SET_DAY':              {'addr': 1014, 'type': 6, 'value': 0},
-    'MWM_SET_NIGHT':            {'addr': 1015, 'type': 6, 'value': 0},
-    'MWM_SET_MANUAL':           {'addr': 1016, 'type': 6, 'value': 0},
-    'DAY_STAGE':                {'addr': 1017, 'type': 6, 'value': 0},
-    'NIGHT_STAGE':              {'addr': 1018, 'type': 6, 'value': 0},
-    'PARTY_STAGE':              {'addr': 1019, 'type': 6, 'value': 0},
-    'MANUAL_STAGE':             {'addr': 1020, 'type': 6, 'value': 0},
-    'ROOM_TEMP_COOL_DAY_HC1':   {'addr': 1021, 'type': 2, 'value': 0},
-    'ROOM_TEMP_COOL_NIGHT_HC1': {'addr': 1022, 'type': 2, 'value': 0},
-    'ROOM_TEMP_COOL_DAY_HC2':   {'addr': 1023, 'type': 2, 'value': 0},
-    'ROOM_TEMP_COOL_NIGHT_HC2': {'addr': 1024, 'type': 2, 'value': 0},
-    'RESET':                    {'addr': 1025, 'type': 6, 'value': 0},
-    'RESTART_ISG':              {'addr': 1026, 'type': 6, 'value': 0}
-}
+UNAVAILABLE_OBJECT = 32768
 
 B2_OPERATING_MODE_READ = {
     # AUTOMATIK
@@ -132,15 +78,6 @@ B2_RESTART_ISG = {
     'MENU': 2
 }
 
-# Block 3 System status (Read input register) - page 31
-B3_START_ADDR = 2000
-
-B3_REGMAP_INPUT = {
-    'OPERATING_STATUS': {'addr': 2000, 'type': 6, 'value': 0},
-    'FAULT_STATUS':     {'addr': 2001, 'type': 6, 'value': 0},
-    'BUS_STATUS':       {'addr': 2002, 'type': 6, 'value': 0}
-}
-
 B3_OPERATING_STATUS = {
     'SWITCHING_PROGRAM_ENABLED': (1 << 0),
     'COMPRESSOR': (1 << 1),
@@ -173,55 +110,462 @@ B3_BUS_STATUS = {
 }
 
 
+# Maximum number of registers of a single Modbus write request
+MAX_WRITE_COUNT = 123
+
+# Results of write_values per register
+WRITE_DONE = 'written'
+WRITE_UNCHANGED = 'unchanged'
+WRITE_FAILED = 'failed'
+WRITE_ABORTED = 'aborted'
+
+
+# Write confirmation: first re-read delay, its growth factor and upper bound
+CONFIRM_INTERVAL = 0.1
+CONFIRM_BACKOFF = 1.5
+CONFIRM_MAX_INTERVAL = 1.0
+# Timeout before apply latencies were observed and bounds of the adaptive one
+CONFIRM_TIMEOUT = 5.0
+CONFIRM_MIN_TIMEOUT = 1.0
+CONFIRM_MAX_TIMEOUT = 30.0
+
+
+def plan_reads(names, max_gap=MAX_READ_GAP):
+    """Compute the ranges to read for registers of the ISG map.
+
+    See RegisterMap.plan_reads.
+    """
+    return DEFAULT_MAP.plan_reads(names, max_gap)
+
+
+def encode_value(name, value):
+    """Encode a value for writing to a holding register of the ISG map.
+
+    Args:
+        name: Name of the holding register.
+        value: Value to be written.
+
+    Returns:
+        Tuple of register address and register word.
+    """
+    return DEFAULT_MAP.encode_value(name, value)
+
+
+class Snapshot():
+    """Immutable record of all decoded register values.
+
+    Values are accessed by register name (snapshot['FLOW_TEMPERATURE']) or
+    as the flat tuple `values` in the fields order of the register map
+    (SNAPSHOT_FIELDS for the ISG map).
+    """
+
+    __slots__ = ('timestamp', 'values', 'absent', 'register_map',
+                 'operating_mode', 'operating_status')
+
+    def __init__(self, timestamp, values, absent=frozenset(),
+                 register_map=DEFAULT_MAP):
+        """Initialize the snapshot.
+
+        Args:
+            timestamp: Time of the refresh (seconds since the epoch).
+            values: Decoded values in register_map.fields order.
+            absent: Names of registers not supported by the heat pump,
+                their values are None.
+            register_map: RegisterMap of the values.
+        """
+        index = register_map.field_index
+        status = index.get('OPERATING_STATUS')
+        status = (values[status] if status is not None else None) or 0
+        mode = index.get('OPERATING_MODE')
+        set_attr = super().__setattr__
+        set_attr('timestamp', timestamp)
+        set_attr('values', tuple(values))
+        set_attr('absent', absent)
+        set_attr('register_map', register_map)
+        set_attr('operating_mode', B2_OPERATING_MODE_READ.get(
+            values[mode] if mode is not None else None, 'UNKNOWN'))
+        set_attr('operating_status', frozenset(
+            flag for flag, mask in B3_OPERATING_STATUS.items()
+            if status & mask))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Snapshot is immutable')
+
+    def __getitem__(self, name):
+        if name in self.absent:
+            raise KeyError(name)
+        return self.values[self.register_map.field_index[name]]
+
+    def __repr__(self):
+        return 'Snapshot(timestamp={}, operating_mode={!r})'.format(
+            self.timestamp, self.operating_mode)
+
+    def get(self, name, default=None):
+        """Return the value of a register or default."""
+        index = self.register_map.field_index.get(name)
+        if index is None or name in self.absent:
+            return default
+        return self.values[index]
+
+    def as_dict(self):
+        """Return the register values as dict of name to value.
+
+        Absent registers are left out.
+        """
+        fields = self.register_map.fields
+        if not self.absent:
+            return dict(zip(fields, self.values))
+        return {name: value for name, value in zip(fields, self.values)
+                if name not in self.absent}
+
+
+class _NoLock():
+    """Lock of an API which is not shared with a Poller thread."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_LOCK = _NoLock()
+
+
+class ExceptionResponseError(AttributeError):
+    """The heat pump answered a read with a Modbus exception response.
+
+    Like other responses without registers it is an AttributeError. The
+    heat pump rejects reads of registers it does not have with an illegal
+    data address exception.
+    """
+
+
+def _log_read_failure(exc):
+    """Log a failed update."""
+    # logging imports threading, which is only loaded on failures to keep
+    # the command line start fast
+    import logging
+    logging.getLogger(__name__).warning('Modbus read failed: %s', exc)
+
+
+def _check_exception_response(response):
+    """Raise ExceptionResponseError for a Modbus exception response."""
+    exception_code = getattr(response, 'exception_code', None)
+    if exception_code is not None:
+        raise ExceptionResponseError(
+            'Modbus exception response {}'.format(exception_code))
+
+
+def _probe_failure(block, exc):
+    """Return the ConnectionError of a block which could not be probed."""
+    return ConnectionError('Probing block {} failed: {}'.format(block, exc))
+
+
+def _check_sync(api, message):
+    """Raise TypeError if the update method of an API is a coroutine."""
+    import inspect
+    if inspect.iscoroutinefunction(api.update):
+        raise TypeError(message + ' is not supported with asyncio')
+
+
+def _is_error(response):
+    """Check if a Modbus response is an error."""
+    return response is not None and hasattr(response, 'isError') and \
+        response.isError()
+
+
 class StiebelEltronAPI():
     """Stiebel Eltron API."""
 
-    def __init__(self, conn, slave, update_on_read=False):
-        """Initialize Stiebel Eltron communication."""
+    def __init__(self, conn, slave, update_on_read=False, cache_ttl=None,
+                 register_map=None, single_flight=False):
+        """Initialize Stiebel Eltron communication.
+
+        Args:
+            conn: Connected Modbus client.
+            slave: Modbus unit id of the heat pump.
+            update_on_read: Refresh the values on every read.
+            cache_ttl: Freshness window in seconds for update_on_read, either
+                one value for all blocks or a dict of block number to value.
+                None disables the cache and refreshes all blocks on each read.
+            register_map: RegisterMap of the device family, the ISG map
+                (DEFAULT_MAP) if None.
+            single_flight: Share identical updates and register range reads
+                which are in flight between concurrent callers (threads, or
+                coroutines of the asyncio API) instead of sending them again.
+        """
         self._conn = conn
-        self._block_1_input_regs = B1_REGMAP_INPUT
-        self._block_2_holding_regs = B2_REGMAP_HOLDING
-        self._block_3_input_regs = B3_REGMAP_INPUT
+        self._map = register_map = register_map or DEFAULT_MAP
         self._slave = slave
         self._update_on_read = update_on_read
+        # Raw register values per block, indexed by offset from block start
+        self._values = {block: array('H', bytes(2 * size))
+                        for block, size in register_map.block_sizes.items()}
+        # Flags of the values which were read from the heat pump
+        self._known = {block: bytearray(size)
+                       for block, size in register_map.block_sizes.items()}
+
+        if cache_ttl is None or isinstance(cache_ttl, dict):
+            self._cache_ttl = cache_ttl
+        else:
+            self._cache_ttl = {block: cache_ttl
+                               for block in register_map.blocks}
+        self._block_timestamps = {block: None
+                                  for block in register_map.blocks}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._observers = ()
+        # Supported registers, all until set_capabilities is called
+        self._capabilities = None
+        self._absent = frozenset()
+        self._absent_indexes = ()
+        self._block_ranges = register_map.block_ranges
+        # History the values of every update are recorded in
+        self._history = None
+        # DerivedMetrics fed by every update
+        self._derived = None
+        # CaptureWriter the raw words of every update are written to
+        self._capture = None
+        # Poller thread owning the connection and its lock
+        self._poller = None
+        self._io_lock = _NO_LOCK
+        # SingleFlight groups of updates and range reads, if enabled
+        self._update_flight = self._read_flight = None
+        if single_flight:
+            self._update_flight, self._read_flight = self._single_flights()
+        # Smoothed apply latency of writes and its mean deviation
+        self._apply_latency = None
+        self._apply_latency_dev = 0.0
+
+    def update(self, names=None, blocks=None):
+        """Request current values from heat pump.
+
+        Without arguments, all blocks are read. Otherwise only the ranges
+        covering the given registers and blocks are read (see plan_reads).
+
+        Args:
+            names: Iterable of register names.
+            blocks: Iterable of block numbers.
+        """
+        if names is None:
+            blocks = self._map.blocks if blocks is None else blocks
+        return self._update_shared(self._select_ranges(names, blocks), blocks)
+
+    def _single_flights(self):
+        """Return the SingleFlight groups of updates and range reads."""
+        from pystiebeleltron.singleflight import SingleFlight
+        return (SingleFlight(
+                    lambda saved: self._notify_shared('update', saved)),
+                SingleFlight(
+                    lambda saved: self._notify_shared('read', saved)))
+
+    def _update_shared(self, ranges, blocks):
+        """Update ranges, joining an identical update in flight if enabled."""
+        if self._update_flight is None:
+            return self._update_ranges(ranges, blocks)
+        return self._update_flight.do(
+            (ranges, None if blocks is None else tuple(blocks)),
+            self._update_ranges, ranges, blocks, cost=len(ranges))
+
+    def _select_ranges(self, names, blocks):
+        """Return the ranges to read for the given names and blocks.
+
+        Registers which are not supported by the heat pump are not read.
+        """
+        if names is None:
+            return tuple(read_range for block in blocks
+                         for read_range in self._block_ranges[block])
+        names = set(names)
+        for block in blocks or ():
+            names.update(self._map.blocks[block][1])
+        return self._map.plan_reads(names.difference(self._absent))
+
+    def _update_ranges(self, ranges, blocks=None):
+        """Read the given register ranges and store their values.
+
+        Values are only stored if all ranges could be read. While polling,
+        the update is serialized with the poll cycles and writes.
+
+        Args:
+            ranges: Iterable of ReadRange.
+            blocks: Blocks which are fully covered by the ranges and are
+                fresh after a successful update.
+        """
+        results = []
+        with self._io_lock:
+            try:
+                for read_range in ranges:
+                    results.append((read_range, self._read_range(read_range)))
+            except (AttributeError, ConnectionError) as exc:
+                # The unit does not reply reliably
+                _log_read_failure(exc)
+                return False
+
+            self._store_ranges(results)
+            self._mark_fresh(blocks)
+        return True
+
+    def _read_range(self, read_range):
+        """Read a register range, joining a read in flight if enabled."""
+        if self._read_flight is None:
+            return self._read_range_now(read_range)
+        return self._read_flight.do(read_range, self._read_range_now,
+                                    read_range)
 
-    def update(self):
-        """Request current values from heat pump."""
-        ret = True
+    def _read_range_now(self, read_range):
+        """Read a register range from the heat pump."""
+        if not self._observers:
+            return self._request_range(read_range)
+        start = time.perf_counter()
         try:
-            block_1_result_input = self._conn.read_input_registers(
-                unit=self._slave,
-                address=B1_START_ADDR,
-                count=len(self._block_1_input_regs)).registers
-            block_2_result_holding = self._conn.read_holding_registers(
-                unit=self._slave,
-                address=B2_START_ADDR,
-                count=len(self._block_2_holding_regs)).registers
-            block_3_result_input = self._conn.read_input_registers(
-                unit=self._slave,
-                address=B3_START_ADDR,
-                count=len(self._block_3_input_regs)).registers
-        except AttributeError:
-            # The unit does not reply reliably
-            ret = False
-            print("Modbus read failed")
+            registers = self._request_range(read_range)
+        except Exception as exc:
+            self._notify_request(read_range, start, exc)
+            raise
+        self._notify_request(read_range, start)
+        return registers
+
+    def _request_range(self, read_range):
+        """Send the read request of a register range."""
+        block, offset, count = read_range
+        start_addr, _, read_call = self._map.blocks[block]
+        response = getattr(self._conn, read_call)(
+            unit=self._slave,
+            address=start_addr + offset,
+            count=count)
+        _check_exception_response(response)
+        registers = response.registers
+        if len(registers) != count:
+            raise AttributeError('Incomplete response')
+        return registers
+
+    def add_observer(self, observer):
+        """Attach an instrumentation Observer."""
+        self._observers = self._observers + (observer,)
+
+    def remove_observer(self, observer):
+        """Detach an instrumentation Observer."""
+        self._observers = tuple(
+            other for other in self._observers if other is not observer)
+
+    def _notify_request(self, read_range, start, exc=None):
+        """Report a finished read request to the observers."""
+        # Imported here, so the API can be imported without instrumentation
+        from pystiebeleltron.instrumentation import read_bytes
+        duration = time.perf_counter() - start
+        block, offset, count = read_range
+        address = self._map.blocks[block][0] + offset
+        for observer in self._observers:
+            if exc is None:
+                observer.on_request(self._slave, block, address, count,
+                                    duration, read_bytes(count))
+            else:
+                observer.on_request_error(self._slave, block, address, count,
+                                          duration, exc)
+
+    def _notify_shared(self, kind, saved):
+        """Report an update or read joined in flight to the observers."""
+        for observer in self._observers:
+            observer.on_shared(self._slave, kind, saved)
+
+    def get_single_flight_stats(self):
+        """Return the numbers of executed and shared updates and reads.
+
+        requests_saved is the number of Modbus requests not sent, because
+        a caller joined an identical update or read in flight.
+        """
+        stats = {'updates': 0, 'updates_shared': 0, 'reads': 0,
+                 'reads_shared': 0, 'requests_saved': 0}
+        for kind, flight in (('updates', self._update_flight),
+                             ('reads', self._read_flight)):
+            if flight is not None:
+                stats[kind] = flight.executed
+                stats[kind + '_shared'] = flight.shared
+                stats['requests_saved'] += flight.saved
+        return stats
+
+    def _notify_decode(self, stage, count, start):
+        """Report a finished decode pass to the observers."""
+        duration = time.perf_counter() - start
+        for observer in self._observers:
+            observer.on_decode(self._slave, stage, count, duration)
+
+    def _store_ranges(self, results):
+        """Store read register values.
+
+        Args:
+            results: List of (ReadRange, register values) tuples.
+        """
+        if self._observers:
+            start = time.perf_counter()
+            self._store_ranges_raw(results)
+            self._notify_decode(
+                'store', sum(r.count for r, _ in results), start)
         else:
-            for k in self._block_1_input_regs:
-                self._block_1_input_regs[k]['value'] = \
-                    block_1_result_input[
-                        self._block_1_input_regs[k]['addr'] - B1_START_ADDR]
+            self._store_ranges_raw(results)
+        if self._history is not None:
+            self._history.record(results)
+        if self._derived is not None:
+            self._derived.record(results)
+        if self._capture is not None:
+            self._capture.write(self._values,
+                                {read_range[0] for read_range, _ in results},
+                                known=self._known)
+
+    def _store_ranges_raw(self, results):
+        """Store read register values without instrumentation."""
+        for (block, offset, count), registers in results:
+            # The built-in transport returns array('H'), copied as is
+            if not isinstance(registers, array):
+                registers = array('H', registers)
+            self._values[block][offset:offset + count] = registers
+            self._known[block][offset:offset + count] = b'\x01' * count
 
-            for k in self._block_2_holding_regs:
-                self._block_2_holding_regs[k]['value'] = \
-                    block_2_result_holding[
-                        self._block_2_holding_regs[k]['addr'] - B2_START_ADDR]
+    def _mark_fresh(self, blocks):
+        """Set the cache timestamp of fully read blocks."""
+        if blocks:
+            now = time.monotonic()
+            for block in blocks:
+                self._block_timestamps[block] = now
 
-            for k in self._block_3_input_regs:
-                self._block_3_input_regs[k]['value'] = \
-                    block_3_result_input[
-                        self._block_3_input_regs[k]['addr'] - B3_START_ADDR]
+    def _is_fresh(self, block):
+        """Check if a block can be served from the cache."""
+        timestamp = self._block_timestamps[block]
+        if (timestamp is not None and
+                time.monotonic() - timestamp < self._cache_ttl.get(block, 0)):
+            self._cache_hits += 1
+            return True
+        self._cache_misses += 1
+        return False
+
+    def _refresh(self, name):
+        """Refresh the block of a register, if update_on_read."""
+        if not self._update_on_read or self._poller is not None:
+            return
+        if self._cache_ttl is None:
+            self.update()
+            return
 
-        return ret
+        entry = self._map.index.get(name)
+        if entry is None:
+            return
+        block = entry[0]
+        if not self._is_fresh(block):
+            self._update_shared(self._block_ranges[block], (block,))
+
+    def invalidate(self, block=None):
+        """Mark a block (or all blocks) as stale.
+
+        Args:
+            block: Block number (1, 2 or 3) or None for all blocks.
+        """
+        for blk in self._map.blocks if block is None else (block,):
+            self._block_timestamps[blk] = None
+
+    def get_cache_stats(self):
+        """Return the number of cache hits and misses."""
+        return {'hits': self._cache_hits, 'misses': self._cache_misses}
 
     def get_conv_val(self, name):
         """Read and convert value.
@@ -232,107 +576,495 @@ class StiebelEltronAPI():
         Returns:
             Actual value or None.
         """
-        value_entry = self._block_1_input_regs.get(name)
-        if value_entry is None:
-            value_entry = self._block_2_holding_regs.get(name)
-        if value_entry is None:
-            value_entry = self._block_3_input_regs.get(name)
-        if value_entry is None:
+        poller = self._poller
+        if poller is not None:
+            snapshot = poller.polled.snapshot
+            return None if snapshot is None else snapshot.get(name)
+        entry = self._map.index.get(name)
+        if entry is None or name in self._absent:
+            return None
+
+        block, offset, codec = entry
+        return codec.decode(self._values[block][offset])
+
+    def get_raw_values(self, block):
+        """Return a copy of the raw register words of a block."""
+        return array('H', self._values[block])
+
+    def get_known(self, block):
+        """Return the flags of the words of a block which were read.
+
+        Returns:
+            bytes with 1 at the offsets read from the heat pump, 0 elsewhere.
+        """
+        return bytes(self._known[block])
+
+    def probe_capabilities(self, samples=1):
+        """Detect the registers supported by the heat pump.
+
+        All blocks are read `samples` times. Registers reporting the
+        "object unavailable" value 0x8000 in every read and blocks whose
+        reads are rejected with a Modbus exception response (illegal data
+        address) are unsupported. The result is applied with
+        set_capabilities.
+
+        Args:
+            samples: Number of reads per block.
+
+        Returns:
+            Capabilities of the heat pump.
+
+        Raises:
+            ConnectionError: A block could not be read for another reason,
+                e.g. a timeout, or no block is supported. The capabilities
+                are left unchanged.
+        """
+        values = {}
+        for block in self._map.blocks:
+            try:
+                values[block] = [self._probe_block(block)
+                                 for _ in range(samples)]
+            except ExceptionResponseError:
+                # The heat pump does not have the block
+                pass
+            except AttributeError as exc:
+                raise _probe_failure(block, exc) from exc
+        return self._apply_probe(values)
+
+    def _probe_block(self, block):
+        """Return the raw words of a block, 0x8000 where nothing is read."""
+        words = [ERROR_OBJ_UNAVAILBLE] * self._map.block_sizes[block]
+        with self._io_lock:
+            for read_range in self._map.block_ranges[block]:
+                words[read_range.offset:
+                      read_range.offset + read_range.count] = \
+                    self._read_range(read_range)
+        return words
+
+    def _apply_probe(self, values):
+        """Set the capabilities derived from probed raw values."""
+        from pystiebeleltron.capabilities import Capabilities
+        if not values:
+            raise ConnectionError('No register block could be read')
+        capabilities = Capabilities.from_values(values, self._map)
+        self.set_capabilities(capabilities)
+        return capabilities
+
+    def set_capabilities(self, capabilities):
+        """Read only the registers supported by the heat pump.
+
+        Unsupported registers are not read anymore and reported as absent:
+        get_conv_val returns None and snapshots leave them out.
+
+        Args:
+            capabilities: Capabilities of the heat pump, None to read all
+                registers again.
+
+        Raises:
+            ValueError: The capabilities belong to another register map.
+        """
+        if capabilities is None:
+            self._absent = frozenset()
+            self._block_ranges = self._map.block_ranges
+        elif capabilities.register_map is not self._map:
+            raise ValueError('Capabilities of register map {}'.format(
+                capabilities.register_map.name))
+        else:
+            self._absent = capabilities.absent
+            self._block_ranges = capabilities.block_ranges
+        self._capabilities = capabilities
+        self._absent_indexes = tuple(sorted(
+            self._map.field_index[name] for name in self._absent))
+        self.invalidate()
+
+    def get_register_map(self):
+        """Return the RegisterMap of the heat pump."""
+        return self._map
+
+    def get_capabilities(self):
+        """Return the Capabilities set on the API or None."""
+        return self._capabilities
+
+    def track_changes(self, deadbands=None, status_bits=False):
+        """Return a ChangeTracker yielding the registers changed per update.
+
+        See pystiebeleltron.changes.ChangeTracker for the arguments.
+        """
+        from pystiebeleltron.changes import ChangeTracker
+        return ChangeTracker(self, deadbands, status_bits)
+
+    def record_history(self, names=None, retention=86400, interval=60):
+        """Record the values of every update in a new History.
+
+        See pystiebeleltron.history.History for the arguments.
+
+        Returns:
+            The History, replacing one recorded before.
+        """
+        from pystiebeleltron.history import History
+        self._history = History(names, retention, interval, self._map)
+        return self._history
+
+    def set_history(self, history):
+        """Record the values of every update in a History.
+
+        Args:
+            history: History of the register map of the API or None to
+                stop recording.
+        """
+        if history is not None and history.register_map is not self._map:
+            raise ValueError('History is for register map {!r}'.format(
+                history.register_map.name))
+        self._history = history
+
+    def get_history(self):
+        """Return the History the updates are recorded in or None."""
+        return self._history
+
+    def track_derived(self, window=3600.0, max_gap=600.0):
+        """Compute derived values from every update in new DerivedMetrics.
+
+        See pystiebeleltron.derived.DerivedMetrics for the arguments.
+
+        Returns:
+            The DerivedMetrics, replacing ones tracked before.
+        """
+        from pystiebeleltron.derived import DerivedMetrics
+        self._derived = DerivedMetrics(window, max_gap, self._map)
+        return self._derived
+
+    def set_derived(self, derived):
+        """Compute derived values from every update in DerivedMetrics.
+
+        Args:
+            derived: DerivedMetrics of the register map of the API or None
+                to stop.
+        """
+        if derived is not None and derived.register_map is not self._map:
+            raise ValueError('DerivedMetrics are for register map {!r}'.format(
+                derived.register_map.name))
+        self._derived = derived
+
+    def get_derived(self):
+        """Return the DerivedMetrics fed by the updates or None."""
+        return self._derived
+
+    def start_capture(self, path):
+        """Append the raw words of every update to a capture file.
+
+        See pystiebeleltron.capture for the file format and the reader.
+
+        Args:
+            path: File name, an existing capture of the same register map
+                is appended to.
+
+        Returns:
+            The CaptureWriter, replacing (and closing) one started before.
+        """
+        from pystiebeleltron.capture import CaptureWriter
+        writer = CaptureWriter(path, self._map)
+        self.stop_capture()
+        self._capture = writer
+        return writer
+
+    def stop_capture(self):
+        """Stop capturing and close the capture file."""
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
+    def start_polling(self, interval=10.0, names=None, blocks=None,
+                      on_publish=None):
+        """Update the values in a background thread.
+
+        The thread owns the connection: getters and snapshot() return the
+        values of the last published snapshot without Modbus requests or
+        locks (also with update_on_read). Updates, probes and writes of
+        other threads are serialized with the poll cycles. See
+        pystiebeleltron.poller.Poller for the arguments.
+
+        Returns:
+            The started Poller.
+        """
+        from pystiebeleltron.poller import Poller
+        self.stop_polling()
+        poller = Poller(self, interval, names, blocks, on_publish)
+        self._io_lock = poller.lock
+        self._poller = poller
+        poller.start()
+        return poller
+
+    def stop_polling(self, timeout=None):
+        """Stop the background thread started by start_polling."""
+        poller = self._poller
+        if poller is not None:
+            poller.stop(timeout)
+            self._poller = None
+            self._io_lock = _NO_LOCK
+
+    def get_polled_snapshot(self):
+        """Return the PolledSnapshot of the poller thread or None."""
+        poller = self._poller
+        return None if poller is None else poller.polled
+
+    def snapshot(self, refresh=True):
+        """Return all register values decoded in one pass.
+
+        Registers which were not read yet are None. While polling, the
+        snapshot last published by the poller thread is returned.
+
+        Args:
+            refresh: Request current values from the heat pump first.
+
+        Returns:
+            Snapshot or None, if the refresh failed (or nothing was polled
+            yet).
+        """
+        poller = self._poller
+        if poller is not None:
+            return poller.polled.snapshot
+        if refresh and not self.update():
             return None
+        return self._decode_snapshot()
+
+    def _decode_snapshot(self):
+        """Return a Snapshot of the stored values."""
+        start = time.perf_counter()
+        words = array('H')
+        for block_values in self._values.values():
+            words.extend(block_values)
+        values = self._map.decode(words)
+        for index in self._absent_indexes:
+            values[index] = None
+        known = b''.join(self._known.values())
+        if 0 in known:
+            # Registers which were never read are not available
+            for index, position in enumerate(self._map.field_positions):
+                if not known[position]:
+                    values[index] = None
+        snapshot = Snapshot(time.time(), values, self._absent, self._map)
+        if self._observers:
+            self._notify_decode('snapshot', len(snapshot.values), start)
+        return snapshot
+
+    def write_values(self, values, skip_unchanged=True):
+        """Write several holding registers at once.
+
+        All values are encoded before anything is written. Registers at
+        adjacent addresses are written with a single request and writing
+        stops at the first failed request.
+
+        Args:
+            values: Dict of holding register name to value.
+            skip_unchanged: Do not write values equal to the values read.
+
+        Returns:
+            Dict of register name to WRITE_DONE, WRITE_UNCHANGED,
+            WRITE_FAILED or WRITE_ABORTED.
+        """
+        with self._io_lock:
+            return self._write_runs(*self._plan_writes(values,
+                                                       skip_unchanged))
+
+    def _write_runs(self, results, runs):
+        """Send planned write requests, see write_values."""
+        failed = False
+        for address, words, names in runs:
+            if failed:
+                results.update(dict.fromkeys(names, WRITE_ABORTED))
+                continue
+            try:
+                if len(words) == 1:
+                    response = self._conn.write_register(
+                        unit=self._slave, address=address, value=words[0])
+                else:
+                    response = self._conn.write_registers(
+                        unit=self._slave, address=address, values=words)
+            except ConnectionError:
+                response = None
+                failed = True
+            failed = failed or _is_error(response)
+            self._written(results, words, names, not failed)
+        return results
+
+    def _plan_writes(self, values, skip_unchanged):
+        """Encode values and coalesce them into write requests.
+
+        Returns:
+            Tuple of the results of skipped registers and a list of
+            (address, register words, names) write requests.
+        """
+        index = self._map.index
+        encoded = {}
+        for name, value in values.items():
+            address, word = self._map.encode_value(name, value)
+            encoded[address] = (word, name)
+
+        results = {}
+        runs = []
+        for address in sorted(encoded):
+            word, name = encoded[address]
+            block, offset, _ = index[name]
+            if (skip_unchanged and self._known[block][offset] and
+                    self._values[block][offset] == word):
+                results[name] = WRITE_UNCHANGED
+                continue
+            if runs and runs[-1][0] + len(runs[-1][1]) == address and \
+                    len(runs[-1][1]) < MAX_WRITE_COUNT and \
+                    index[runs[-1][2][0]][0] == block:
+                runs[-1][1].append(word)
+                runs[-1][2].append(name)
+            else:
+                runs.append((address, [word], [name]))
+        return results, runs
+
+    def _written(self, results, words, names, success):
+        """Record the result of a write request."""
+        results.update(dict.fromkeys(
+            names, WRITE_DONE if success else WRITE_FAILED))
+        block, offset, _ = self._map.index[names[0]]
+        if success:
+            self._values[block][offset:offset + len(words)] = \
+                array('H', words)
+        self.invalidate(block)
+
+    def _write(self, name, value):
+        """Write a single holding register.
+
+        Returns:
+            The written word, None if the write failed or was rejected.
+        """
+        address, word = self._map.encode_value(name, value)
+        with self._io_lock:
+            try:
+                failed = _is_error(self._conn.write_register(
+                    unit=self._slave, address=address, value=word))
+            except ConnectionError:
+                failed = True
+            self.invalidate(self._map.index[name][0])
+        return None if failed else word
+
+    def write_and_confirm(self, name, value, timeout=None):
+        """Write a holding register and wait until the heat pump applied it.
+
+        Only the written register is re-read, on a growing interval, until it
+        reports the written value or the timeout passed.
+
+        Args:
+            name: Name of the holding register.
+            value: Value to be written.
+            timeout: Timeout in seconds. None adapts to the apply latencies
+                observed on this heat pump.
+
+        Returns:
+            True if the value was confirmed, False right away if the write
+            failed or was rejected.
+        """
+        word = self._write(name, value)
+        if word is None:
+            return False
+
+        start = time.monotonic()
+        deadline = start + (timeout if timeout is not None
+                            else self.get_confirm_timeout())
+        interval = CONFIRM_INTERVAL
+        while True:
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            # Serialized with a poller by update()
+            confirmed = self.update(names=(name,)) and \
+                self._confirmed(name, word)
+            if confirmed:
+                self._record_apply_latency(time.monotonic() - start)
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            interval = min(interval * CONFIRM_BACKOFF, CONFIRM_MAX_INTERVAL)
 
-        if value_entry['type'] == 2:
-            return value_entry['value'] * 0.1
-        if value_entry['type'] == 7:
-            return value_entry['value'] * 0.01
+    def _confirmed(self, name, word):
+        """Check if a register holds the given word."""
+        block, offset, _ = self._map.index[name]
+        return self._values[block][offset] == word
 
-        return value_entry['value']
+    def _record_apply_latency(self, latency):
+        """Update the smoothed apply latency (as for TCP round-trip times)."""
+        if self._apply_latency is None:
+            self._apply_latency = latency
+            self._apply_latency_dev = latency / 2
+        else:
+            self._apply_latency_dev += \
+                (abs(latency - self._apply_latency) -
+                 self._apply_latency_dev) / 4
+            self._apply_latency += (latency - self._apply_latency) / 8
 
-#    def get_raw_input_register(self, name):
-#        """Get raw register value by name."""
-#        if self._update_on_read:
-#            self.update()
-#        return self._block_1_input_regs[name]
+    def get_confirm_timeout(self):
+        """Return the timeout for write_and_confirm.
 
-#    def get_raw_holding_register(self, name):
-#        """Get raw register value by name."""
-#        if self._update_on_read:
-#            self.update()
-#        return self._block_2_holding_regs[name]
+        Derived from the observed apply latencies (mean + 4 deviations),
+        bounded by CONFIRM_MIN_TIMEOUT and CONFIRM_MAX_TIMEOUT.
+        """
+        if self._apply_latency is None:
+            return CONFIRM_TIMEOUT
+        timeout = self._apply_latency + 4 * self._apply_latency_dev
+        return min(max(timeout, CONFIRM_MIN_TIMEOUT), CONFIRM_MAX_TIMEOUT)
 
-#    def set_raw_holding_register(self, name, value):
-#        """Write to register by name."""
-#        self._conn.write_register(
-#            unit=self._slave,
-#            address=(self._holding_regs[name]['addr']),
-#            value=value)
+    def get_apply_latency(self):
+        """Return the smoothed apply latency of writes in seconds or None."""
+        return self._apply_latency
 
     # Handle room temperature & humidity
 
     def get_current_temp(self):
         """Get the current room temperature."""
-        if self._update_on_read:
-            self.update()
+        self._refresh('ACTUAL_ROOM_TEMPERATURE_HC1')
         return self.get_conv_val('ACTUAL_ROOM_TEMPERATURE_HC1')
 
     def get_target_temp(self):
         """Get the target room temperature."""
-        if self._update_on_read:
-            self.update()
+        self._refresh('ROOM_TEMP_HEAT_DAY_HC1')
         return self.get_conv_val('ROOM_TEMP_HEAT_DAY_HC1')
 
     def set_target_temp(self, temp):
         """Set the target room temperature (day)(HC1)."""
-        self._conn.write_register(
-            unit=self._slave,
-            address=(
-                self._block_2_holding_regs['ROOM_TEMP_HEAT_DAY_HC1']['addr']),
-            value=round(temp * 10.0))
+        self._write('ROOM_TEMP_HEAT_DAY_HC1', temp)
 
     def get_current_humidity(self):
         """Get the current room humidity."""
-        if self._update_on_read:
-            self.update()
+        self._refresh('RELATIVE_HUMIDITY_HC1')
         return self.get_conv_val('RELATIVE_HUMIDITY_HC1')
 
     # Handle operation mode
 
     def get_operation(self):
         """Return the current mode of operation."""
-        if self._update_on_read:
-            self.update()
+        self._refresh('OPERATING_MODE')
 
         op_mode = self.get_conv_val('OPERATING_MODE')
         return B2_OPERATING_MODE_READ.get(op_mode, 'UNKNOWN')
 
     def set_operation(self, mode):
         """Set the operation mode."""
-        self._conn.write_register(
-            unit=self._slave,
-            address=(self._block_2_holding_regs['OPERATING_MODE']['addr']),
-            value=B2_OPERATING_MODE_WRITE.get(mode))
+        self._write('OPERATING_MODE', B2_OPERATING_MODE_WRITE.get(mode))
 
     # Handle device status
 
     def get_heating_status(self):
         """Return heater status."""
-        if self._update_on_read:
-            self.update()
-        return bool(self.get_conv_val('OPERATING_STATUS') &
+        self._refresh('OPERATING_STATUS')
+        return bool((self.get_conv_val('OPERATING_STATUS') or 0) &
                     B3_OPERATING_STATUS['HEATING'])
 
     def get_cooling_status(self):
         """Cooling status."""
-        if self._update_on_read:
-            self.update()
-        return bool(self.get_conv_val('OPERATING_STATUS') &
+        self._refresh('OPERATING_STATUS')
+        return bool((self.get_conv_val('OPERATING_STATUS') or 0) &
                     B3_OPERATING_STATUS['COOLING'])
 
     def get_filter_alarm_status(self):
         """Return filter alarm."""
-        if self._update_on_read:
-            self.update()
+        self._refresh('OPERATING_STATUS')
 
         filter_mask = (B3_OPERATING_STATUS['FILTER'] |
                        B3_OPERATING_STATUS['FILTER_EXTRACT_AIR'] |
                        B3_OPERATING_STATUS['FILTER_VENTILATION_AIR'])
-        return bool(self.get_conv_val('OPERATING_STATUS') & filter_mask)
+        return bool((self.get_conv_val('OPERATING_STATUS') or 0) &
+                    filter_mask)
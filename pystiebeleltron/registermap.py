@@ -0,0 +1,351 @@
+"""
+Register maps of ISG product families.
+
+A register map describes the Modbus register blocks of a device family. Maps
+are data files (JSON) shipped in pystiebeleltron/maps or supplied by the
+user, and are compiled at load time into an indexed form:
+
+- index: register name -> (block number, offset in block, codec)
+- block_ranges: block number -> ReadRanges covering all its registers
+- fields: register names ordered by block and offset (snapshot schema)
+
+so reading and decoding costs O(registers) regardless of the map size.
+
+File format:
+
+    {
+      "name": "isg",
+      "description": "...",
+      "blocks": [
+        {"block": 1, "kind": "input", "start": 0, "description": "...",
+         "registers": [{"name": "ACTUAL_ROOM_TEMPERATURE_HC1", "addr": 0,
+                        "type": 2}, ...]},
+        ...
+      ]
+    }
+
+kind is "input" (function code 4) or "holding" (function code 3, writable),
+type one of the ISG data types (see DATA_TYPES).
+"""
+import collections
+import functools
+import json
+import operator
+import os
+
+# Error - sensor lead is missing or disconnected.
+ERROR_NOTAVAILABLE = -60
+# Error - short circuit of the sensor lead.
+ERROR_SHORTCUT = -50
+# Error - object unavailable.
+ERROR_OBJ_UNAVAILBLE = 0x8000
+
+# Data type -> (signed, multiplier for writing, minimum, maximum raw value)
+DATA_TYPES = {
+    2: (True, 10, -32767, 32767),
+    6: (False, 1, 0, 65535),
+    7: (True, 100, -32767, 32767),
+    8: (False, 1, 0, 255)
+}
+
+
+class Codec():
+    """Conversion rules of a data type.
+
+    decode(raw) converts a register word into its value, or None for
+    unavailable objects, sensor errors and out of range values.
+    encode(value) converts a value into a register word and raises
+    ValueError if it is out of range.
+    """
+
+    __slots__ = ('data_type', 'signed', 'multiplier', 'minimum', 'maximum',
+                 'sentinels', 'decode', 'encode')
+
+    def __init__(self, data_type):
+        """Compile the decode and encode functions of a data type."""
+        signed, multiplier, minimum, maximum = DATA_TYPES[data_type]
+        self.data_type = data_type
+        self.signed = signed
+        self.multiplier = multiplier
+        self.minimum = minimum
+        self.maximum = maximum
+
+        sentinels = {ERROR_OBJ_UNAVAILBLE}
+        if data_type == 2:
+            # Sensor errors are reported as temperatures.
+            sentinels.add((ERROR_NOTAVAILABLE * multiplier) & 0xFFFF)
+            sentinels.add((ERROR_SHORTCUT * multiplier) & 0xFFFF)
+        self.sentinels = frozenset(sentinels)
+        self.decode = self._compile_decode()
+        self.encode = self._compile_encode()
+
+    def _compile_decode(self):
+        """Return the decode function."""
+        sentinels = self.sentinels
+        minimum = self.minimum
+        maximum = self.maximum
+        multiplier = self.multiplier
+
+        if self.signed:
+            def decode(raw):
+                if raw in sentinels:
+                    return None
+                if raw > 0x7FFF:
+                    raw -= 0x10000
+                return raw / multiplier
+            return decode
+
+        def decode_unsigned(raw):
+            if raw in sentinels or raw < minimum or raw > maximum:
+                return None
+            return raw
+        return decode_unsigned
+
+    def _compile_encode(self):
+        """Return the encode function."""
+        minimum = self.minimum
+        maximum = self.maximum
+        multiplier = self.multiplier
+
+        def encode(value):
+            raw = round(value * multiplier)
+            if raw < minimum or raw > maximum:
+                raise ValueError('Value {} out of range for data type {}'
+                                 .format(value, self.data_type))
+            return raw & 0xFFFF
+        return encode
+
+
+CODECS = {data_type: Codec(data_type) for data_type in DATA_TYPES}
+
+# Register block kind -> read call of the Modbus client
+READ_CALLS = {
+    'input': 'read_input_registers',
+    'holding': 'read_holding_registers'
+}
+
+# Register range to read: block number, offset in block, register count
+ReadRange = collections.namedtuple('ReadRange', 'block offset count')
+
+# Unused registers between two ranges, up to which they are read as one.
+# Each request costs a round-trip to the ISG, each extra register 2 bytes.
+MAX_READ_GAP = 16
+
+# Maximum number of registers of a single Modbus read request
+MAX_READ_COUNT = 125
+
+
+class RegisterMap():
+    """Compiled register map of a device family.
+
+    Attributes:
+        name: Name of the map.
+        blocks: Block number -> (start address, register map, read call),
+            the register map being a dict of name -> {'addr', 'type'}.
+        index: Register name -> (block number, offset in block, codec).
+        block_sizes: Block number -> number of register words (offsets).
+        block_ranges: Block number -> tuple of ReadRange covering it.
+        fields: Register names ordered by block and offset.
+        field_index: Register name -> position in fields.
+        decoders: Decode functions in fields order.
+        field_positions: Positions of the fields in the concatenated
+            register words of all blocks (in block order).
+    """
+
+    def __init__(self, name, blocks, description=''):
+        """Compile a register map.
+
+        Args:
+            name: Name of the map.
+            blocks: Dict of block number -> (start address, register map,
+                read call) as described above.
+            description: Free text.
+
+        Raises:
+            ValueError: Duplicate names or addresses, addresses before the
+                block start or unknown data types.
+        """
+        self.name = name
+        self.description = description
+        self.blocks = dict(sorted(blocks.items()))
+        self.index = {}
+        self.block_sizes = {}
+        for block, (start_addr, regmap, _) in self.blocks.items():
+            offsets = set()
+            for reg_name, entry in regmap.items():
+                offset = entry['addr'] - start_addr
+                if reg_name in self.index:
+                    raise ValueError('Duplicate register {}'.format(reg_name))
+                if offset < 0 or offset in offsets:
+                    raise ValueError('Invalid address {} of {}'.format(
+                        entry['addr'], reg_name))
+                if entry['type'] not in CODECS:
+                    raise ValueError('Unknown data type {} of {}'.format(
+                        entry['type'], reg_name))
+                offsets.add(offset)
+                self.index[reg_name] = (block, offset, CODECS[entry['type']])
+            self.block_sizes[block] = max(offsets) + 1 if offsets else 0
+
+        self.fields = tuple(sorted(
+            self.index, key=lambda reg_name: self.index[reg_name][:2]))
+        self.field_index = {reg_name: position
+                            for position, reg_name in enumerate(self.fields)}
+        self.decoders = tuple(
+            self.index[reg_name][2].decode for reg_name in self.fields)
+
+        bases = {}
+        base = 0
+        for block, size in self.block_sizes.items():
+            bases[block] = base
+            base += size
+        self.field_positions = tuple(
+            bases[self.index[reg_name][0]] + self.index[reg_name][1]
+            for reg_name in self.fields)
+        # Picks the fields from the concatenated words, None if they match
+        self.field_getter = None \
+            if self.field_positions == tuple(range(base)) else \
+            operator.itemgetter(*self.field_positions)
+
+        self._plan = functools.lru_cache(maxsize=128)(self._compile_plan)
+        self.block_ranges = {
+            block: self.plan_reads(regmap)
+            for block, (_, regmap, _) in self.blocks.items()}
+
+    def __repr__(self):
+        return 'RegisterMap({!r}, {} blocks, {} registers)'.format(
+            self.name, len(self.blocks), len(self.index))
+
+    def plan_reads(self, names, max_gap=MAX_READ_GAP):
+        """Compute the register ranges to read for the given registers.
+
+        Registers of a block are read in contiguous ranges. Ranges which are
+        separated by at most max_gap unused registers are merged.
+
+        Args:
+            names: Iterable of register names.
+            max_gap: Maximum number of unused registers read to merge ranges.
+
+        Returns:
+            Tuple of ReadRange.
+        """
+        return self._plan(frozenset(names), max_gap)
+
+    def _compile_plan(self, names, max_gap):
+        """Compute the register ranges for a frozenset of names."""
+        offsets = collections.defaultdict(set)
+        for reg_name in names:
+            entry = self.index.get(reg_name)
+            if entry is None:
+                raise ValueError('Unknown register {}'.format(reg_name))
+            offsets[entry[0]].add(entry[1])
+
+        ranges = []
+        for block in sorted(offsets):
+            start = end = None
+            for offset in sorted(offsets[block]):
+                if start is not None and (offset - end <= max_gap and
+                                          offset - start < MAX_READ_COUNT):
+                    end = offset + 1
+                    continue
+                if start is not None:
+                    ranges.append(ReadRange(block, start, end - start))
+                start, end = offset, offset + 1
+            ranges.append(ReadRange(block, start, end - start))
+        return tuple(ranges)
+
+    def decode(self, words):
+        """Decode the register words of all blocks.
+
+        Args:
+            words: Concatenated raw words of all blocks in block order.
+
+        Returns:
+            List of converted values in fields order.
+        """
+        if self.field_getter is not None:
+            words = self.field_getter(words)
+        return [decode(word) for decode, word in zip(self.decoders, words)]
+
+    def is_holding(self, block):
+        """Check if a block consists of writable holding registers."""
+        return self.blocks[block][2] == READ_CALLS['holding']
+
+    def encode_value(self, name, value):
+        """Encode a value for writing to a holding register.
+
+        Args:
+            name: Name of the holding register.
+            value: Value to be written.
+
+        Returns:
+            Tuple of register address and register word.
+        """
+        entry = self.index.get(name)
+        if entry is None or not self.is_holding(entry[0]):
+            raise ValueError('{} is not a holding register'.format(name))
+        if value is None:
+            raise ValueError('No value given for {}'.format(name))
+        block, offset, codec = entry
+        return self.blocks[block][0] + offset, codec.encode(value)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Compile a register map from its parsed data file.
+
+        Raises:
+            ValueError: The data is not a valid register map.
+        """
+        try:
+            blocks = {}
+            for block in data['blocks']:
+                number = block['block']
+                if number in blocks:
+                    raise ValueError('Duplicate block {}'.format(number))
+                regmap = collections.OrderedDict()
+                for entry in block['registers']:
+                    if entry['name'] in regmap:
+                        raise ValueError('Duplicate register {}'.format(
+                            entry['name']))
+                    regmap[entry['name']] = {'addr': entry['addr'],
+                                             'type': entry['type']}
+                blocks[number] = (block['start'], regmap,
+                                  READ_CALLS[block['kind']])
+            return cls(data['name'], blocks, data.get('description', ''))
+        except (KeyError, TypeError) as exc:
+            raise ValueError('Invalid register map: {!r}'.format(exc))
+
+    def to_dict(self):
+        """Return the map in the data file format of from_dict."""
+        kinds = {read_call: kind for kind, read_call in READ_CALLS.items()}
+        return {
+            'name': self.name,
+            'description': self.description,
+            'blocks': [
+                {'block': block, 'kind': kinds[read_call], 'start': start,
+                 'registers': [
+                     {'name': reg_name, 'addr': entry['addr'],
+                      'type': entry['type']}
+                     for reg_name, entry in regmap.items()]}
+                for block, (start, regmap, read_call) in self.blocks.items()]}
+
+    @classmethod
+    def load(cls, path):
+        """Load and compile a register map file."""
+        with open(path) as source:
+            return cls.from_dict(json.load(source))
+
+
+@functools.lru_cache(maxsize=None)
+def load_map(name):
+    """Return a register map shipped with the package, compiled once.
+
+    Args:
+        name: Name of the map, e.g. 'isg'.
+    """
+    # Same as pkgutil.get_data, which is slow to import
+    path = os.path.join(os.path.dirname(__file__), 'maps', name + '.json')
+    try:
+        data = __loader__.get_data(path)
+    except OSError:
+        raise ValueError('Unknown register map {}'.format(name))
+    return RegisterMap.from_dict(json.loads(data.decode('utf-8')))
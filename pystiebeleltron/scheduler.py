@@ -0,0 +1,322 @@
+"""
+Adaptive polling of registers by their observed change rate.
+
+Setpoints change a few times a day, while status bits and temperatures of a
+running compressor change within seconds. An AdaptiveScheduler learns the
+change rate of every register (or group of registers) and polls it at an
+interval in which it is expected to change target_changes times, bounded by
+min_interval and max_interval:
+
+    scheduler = AdaptiveScheduler(api, min_interval=10, max_interval=3600)
+    while True:
+        scheduler.tick()
+        time.sleep(scheduler.delay())
+
+Every tick reads only the registers which are due, merged into contiguous
+ranges (registers read along in a range count as polled). Transitions of the
+watched OPERATING_STATUS bits, e.g. the compressor starting, poll the input
+registers at min_interval for boost_duration seconds.
+"""
+import time
+
+from pystiebeleltron.pystiebeleltron import B3_OPERATING_STATUS, _check_sync
+
+# OPERATING_STATUS bits whose transitions boost the input registers
+DEFAULT_BOOST_FLAGS = ('COMPRESSOR', 'HEATING', 'COOLING', 'DHW',
+                       'ELECTRIC_REHEATING', 'EVAPORATOR_DEFROST')
+
+
+class _Group():
+    """Registers polled at the same interval."""
+
+    __slots__ = ('names', 'keys', 'present', 'watched', 'boosted', 'rate',
+                 'interval', 'last_read', 'next_due', 'words')
+
+    def __init__(self, names, keys, interval):
+        self.names = names
+        # (block, offset) of the registers
+        self.keys = keys
+        # Keys of the registers supported by the heat pump
+        self.present = keys
+        self.watched = False
+        self.boosted = False
+        # Smoothed changes per second
+        self.rate = None
+        self.interval = interval
+        self.last_read = None
+        self.next_due = 0.0
+        self.words = None
+
+
+class AdaptiveScheduler():
+    """Poll registers at intervals learnt from their change rates."""
+
+    def __init__(self, api, min_interval=10.0, max_interval=3600.0,
+                 target_changes=0.5, alpha=0.3, groups=None,
+                 watch=('OPERATING_STATUS',), boost_flags=DEFAULT_BOOST_FLAGS,
+                 boost_names=None, boost_duration=600.0, slack=0.25):
+        """Initialize the scheduler, all registers are due on the first tick.
+
+        If a History is recorded by the API, the change rates are seeded
+        from it.
+
+        Args:
+            api: StiebelEltronAPI to update.
+            min_interval: Shortest poll interval in seconds.
+            max_interval: Longest poll interval in seconds.
+            target_changes: Expected number of changes of a register within
+                its poll interval. Lower values poll more often.
+            alpha: Weight of a new observation in the change rate EWMA.
+            groups: Lists of register names sharing one interval (a change of
+                any of them counts), every register on its own if None.
+                Registers which are in no group are not polled.
+            watch: Registers always polled at min_interval.
+            boost_flags: OPERATING_STATUS bits whose transitions boost.
+            boost_names: Registers polled at min_interval during a boost, the
+                registers of the input blocks if None.
+            boost_duration: Seconds a boost lasts after the last transition.
+            slack: Fraction of its interval by which a register is read early
+                to share a tick with the registers which are due.
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('Invalid poll interval bounds')
+        if target_changes <= 0 or not 0 < alpha <= 1 or not 0 <= slack < 1:
+            raise ValueError('Invalid target_changes, alpha or slack')
+        register_map = api.get_register_map()
+        self._api = api
+        self._map = register_map
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_changes = target_changes
+        self.alpha = alpha
+        self.boost_duration = boost_duration
+        self.slack = slack
+        self._boost_until = None
+        self._capabilities = None
+
+        if groups is None:
+            groups = [[name] for name in register_map.fields]
+        self._groups = []
+        # (block, offset) -> group and name of the polled registers
+        self._group_at = {}
+        self._name_at = {}
+        for names in groups:
+            keys = tuple(register_map.index[name][:2] for name in names)
+            group = _Group(tuple(names), keys, min_interval)
+            self._groups.append(group)
+            for key, name in zip(keys, names):
+                self._group_at[key] = group
+                self._name_at[key] = name
+
+        self._status_key = None
+        self._boost_mask = 0
+        for name in watch:
+            if name in register_map.index:
+                group = self._group_at.get(register_map.index[name][:2])
+                if group is not None:
+                    group.watched = True
+        if 'OPERATING_STATUS' in watch and \
+                'OPERATING_STATUS' in self._name_at.values():
+            self._status_key = register_map.index['OPERATING_STATUS'][:2]
+            for flag in boost_flags:
+                self._boost_mask |= B3_OPERATING_STATUS[flag]
+        if boost_names is None:
+            boost_names = [name for name in register_map.fields
+                           if not register_map.is_holding(
+                               register_map.index[name][0])]
+        for name in boost_names:
+            group = self._group_at.get(register_map.index[name][:2])
+            if group is not None and not group.watched:
+                group.boosted = True
+
+        self._ticks = 0
+        self._requests = 0
+        self._words = 0
+        history = api.get_history()
+        if history is not None:
+            self._seed(history)
+
+    def _seed(self, history):
+        """Seed the change rates from the samples of a History."""
+        for group in self._groups:
+            changes = 0
+            first = last = None
+            for name in group.names:
+                if name not in history.names:
+                    break
+                samples = history.samples(name)
+                if len(samples) < 2:
+                    break
+                changes += sum(
+                    1 for previous, sample in zip(samples, samples[1:])
+                    if sample.value != previous.value)
+                first = samples[0].timestamp if first is None else \
+                    min(first, samples[0].timestamp)
+                last = samples[-1].timestamp if last is None else \
+                    max(last, samples[-1].timestamp)
+            else:
+                if last is not None and last > first:
+                    group.rate = changes / (last - first)
+                    group.interval = self._interval(group, None)
+
+    def _interval(self, group, now):
+        """Return the poll interval of a group."""
+        if group.watched or (group.boosted and self._boosting(now)):
+            return self.min_interval
+        if group.rate is None:
+            return group.interval
+        if group.rate <= 0:
+            return self.max_interval
+        return min(max(self.target_changes / group.rate, self.min_interval),
+                   self.max_interval)
+
+    def _apply_capabilities(self):
+        """Leave out the registers absent from the capabilities of the API.
+
+        Groups without supported registers are never due.
+        """
+        capabilities = self._api.get_capabilities()
+        if capabilities is self._capabilities:
+            return
+        self._capabilities = capabilities
+        absent = capabilities.absent if capabilities is not None else ()
+        for group in self._groups:
+            group.present = tuple(
+                key for key, name in zip(group.keys, group.names)
+                if name not in absent)
+            if not group.present:
+                group.next_due = float('inf')
+            elif group.next_due == float('inf'):
+                group.next_due = 0.0
+            # Words of other registers are not compared
+            group.words = group.last_read = None
+
+    def _boosting(self, now):
+        """Check if a boost is active."""
+        return self._boost_until is not None and now is not None and \
+            now < self._boost_until
+
+    def plan(self, now=None):
+        """Return the register names to read in a tick.
+
+        These are the registers which are due, the registers due within the
+        slack of their interval and the registers read along in the merged
+        ranges. Registers absent from the capabilities of the
+        heat pump are left out.
+
+        Args:
+            now: time.monotonic() of the tick.
+        """
+        now = time.monotonic() if now is None else now
+        self._apply_capabilities()
+        capabilities = self._capabilities
+        absent = capabilities.absent if capabilities is not None else ()
+        if all(group.next_due > now for group in self._groups):
+            return []
+        due = [name for group in self._groups
+               if group.next_due - now <= self.slack * group.interval
+               for name in group.names if name not in absent]
+        names = []
+        for block, offset, count in self._map.plan_reads(due):
+            for position in range(offset, offset + count):
+                name = self._name_at.get((block, position))
+                if name is not None and name not in absent:
+                    names.append(name)
+        return names
+
+    def observe(self, names, now=None):
+        """Learn from the values of registers read by an update.
+
+        Args:
+            names: Register names which were read.
+            now: time.monotonic() of the update.
+        """
+        now = time.monotonic() if now is None else now
+        read = set(self._map.index[name][:2] for name in names)
+        values = {block: self._api.get_raw_values(block)
+                  for block in set(block for block, _ in read)}
+
+        if self._status_key in read:
+            group = self._group_at[self._status_key]
+            status = values[self._status_key[0]][self._status_key[1]]
+            previous = group.words[group.present.index(self._status_key)] \
+                if group.words is not None else None
+            if previous is not None and \
+                    (status ^ previous) & self._boost_mask:
+                self._boost(now)
+
+        for group in self._groups:
+            if not group.present or not read.issuperset(group.present):
+                continue
+            words = tuple(values[block][offset]
+                          for block, offset in group.present)
+            if group.last_read is not None and now > group.last_read:
+                observed = (words != group.words) / (now - group.last_read)
+                if group.rate is None:
+                    # Assume a fast changing register until learnt otherwise
+                    group.rate = self.target_changes / self.min_interval
+                group.rate += self.alpha * (observed - group.rate)
+            group.words = words
+            group.last_read = now
+            group.interval = self._interval(group, now)
+            group.next_due = now + group.interval
+
+    def _boost(self, now):
+        """Poll the boosted registers at min_interval from now on."""
+        self._boost_until = now + self.boost_duration
+        for group in self._groups:
+            if group.boosted and group.present:
+                group.interval = self.min_interval
+                group.next_due = min(group.next_due, now)
+
+    def tick(self, now=None):
+        """Read the registers which are due and learn from their values.
+
+        With the asyncio API, await update(names=plan(now)) and call
+        observe() with the names instead.
+
+        Returns:
+            True if nothing was due or the update succeeded.
+
+        Raises:
+            TypeError: The API is an AsyncStiebelEltronAPI.
+        """
+        _check_sync(self._api, 'AdaptiveScheduler.tick')
+        now = time.monotonic() if now is None else now
+        names = self.plan(now)
+        if not names:
+            return True
+        self._ticks += 1
+        ranges = self._map.plan_reads(names)
+        self._requests += len(ranges)
+        self._words += sum(read_range.count for read_range in ranges)
+        if not self._api.update(names=names):
+            # Retry at the shortest interval
+            for group in self._groups:
+                if group.next_due <= now:
+                    group.next_due = now + self.min_interval
+            return False
+        self.observe(names, now)
+        return True
+
+    def delay(self, now=None):
+        """Return the seconds until the next register is due.
+
+        max_interval if no register is supported by the heat pump.
+        """
+        now = time.monotonic() if now is None else now
+        self._apply_capabilities()
+        next_due = min(group.next_due for group in self._groups)
+        if next_due == float('inf'):
+            return self.max_interval
+        return max(0.0, next_due - now)
+
+    def get_intervals(self):
+        """Return the current poll interval of every register."""
+        return {name: group.interval
+                for group in self._groups for name in group.names}
+
+    def get_stats(self):
+        """Return the number of ticks, read requests and registers read."""
+        return {'ticks': self._ticks, 'requests': self._requests,
+                'registers': self._words}
@@ -0,0 +1,110 @@
+"""
+Single-flight execution of concurrent identical requests.
+
+While a call for a key is in flight, further calls for the same key do not
+run the function again but wait for the result of the running call (or its
+exception). StiebelEltronAPI(single_flight=True) uses this for concurrent
+updates and register range reads, so threads or coroutines refreshing the
+same registers at the same time share one Modbus transaction.
+"""
+import asyncio
+import threading
+
+
+class _Call():
+    """Call in flight."""
+
+    __slots__ = ('done', 'result', 'exc')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight():
+    """Share calls in flight between threads.
+
+    Attributes:
+        executed: Number of calls which ran the function.
+        shared: Number of calls which joined a call in flight.
+        saved: Cost of the shared calls, e.g. Modbus requests not sent.
+    """
+
+    def __init__(self, on_shared=None):
+        """Initialize the group.
+
+        Args:
+            on_shared: Function called with the cost of every shared call.
+        """
+        self.executed = 0
+        self.shared = 0
+        self.saved = 0
+        self._on_shared = on_shared
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, cost=1):
+        """Return function(*args), shared with a call for key in flight.
+
+        Args:
+            key: Hashable identity of the call.
+            function: Function to run.
+            args: Arguments of the function.
+            cost: Cost saved if the call is shared.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+                self.saved += cost
+
+        if not leader:
+            if self._on_shared is not None:
+                self._on_shared(cost)
+            call.done.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except BaseException as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight(SingleFlight):
+    """Share calls in flight between coroutines of one event loop."""
+
+    def do(self, key, function, *args, cost=1):
+        """Return an awaitable of function(*args), shared for key in flight.
+
+        The shared call is not cancelled if one of its callers is.
+
+        Args:
+            key: Hashable identity of the call.
+            function: Coroutine function to run.
+            args: Arguments of the function.
+            cost: Cost saved if the call is shared.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(function(*args))
+            future.add_done_callback(lambda _: self._calls.pop(key))
+            self.executed += 1
+        else:
+            self.shared += 1
+            self.saved += cost
+            if self._on_shared is not None:
+                self._on_shared(cost)
+        return asyncio.shield(future)
@@ -0,0 +1,253 @@
+"""
+Minimal Modbus TCP transport.
+
+A dependency-free client for the four function codes the API uses: read
+holding registers (3), read input registers (4), write single register (6)
+and write multiple registers (16). It mirrors the subset of the pymodbus
+client interface used by StiebelEltronAPI, so it can be passed as `conn`
+instead of a pymodbus client (or as client_factory of a ManagedConnection):
+
+    conn = ModbusTcpTransport('192.168.1.20')
+    api = StiebelEltronAPI(conn, 1)
+
+Responses are received into a preallocated buffer and the register payload
+is converted with a single array.frombytes (plus byteswap on little endian
+hosts) instead of building request/response objects per register.
+
+The asyncio variant is pystiebeleltron.aio.AsyncModbusTcpTransport.
+"""
+import socket
+import struct
+import sys
+from array import array
+
+# MBAP header: transaction id, protocol id, length, unit id
+_MBAP = struct.Struct('>HHHB')
+# Address and count (or value) of requests and write responses
+_ADDRESS_VALUE = struct.Struct('>HH')
+
+# Maximum size of a Modbus TCP frame (MBAP header and PDU)
+MAX_ADU_SIZE = 260
+# Bounds of the MBAP length field (unit id and PDU)
+_MIN_LENGTH = 3
+_MAX_LENGTH = MAX_ADU_SIZE - _MBAP.size + 1
+# Maximum number of registers per read and write request
+MAX_READ_COUNT = 125
+MAX_WRITE_COUNT = 123
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+
+# Registers are big endian on the wire
+_SWAP = sys.byteorder == 'little'
+
+
+class ReadRegistersResponse():
+    """Response of a read request."""
+
+    __slots__ = ('registers',)
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):  # pylint: disable=invalid-name
+        """Read responses are no errors."""
+        return False
+
+
+class WriteResponse():
+    """Response of a write request: address and value (or count)."""
+
+    __slots__ = ('address', 'value')
+
+    def __init__(self, address, value):
+        self.address = address
+        self.value = value
+
+    def isError(self):  # pylint: disable=invalid-name
+        """Write responses are no errors."""
+        return False
+
+
+class ExceptionResponse():
+    """Modbus exception response, e.g. for an illegal data address."""
+
+    __slots__ = ('function_code', 'exception_code')
+
+    def __init__(self, function_code, exception_code):
+        self.function_code = function_code
+        self.exception_code = exception_code
+
+    def isError(self):  # pylint: disable=invalid-name
+        """Exception responses are errors."""
+        return True
+
+    def __repr__(self):
+        return 'ExceptionResponse(function_code={}, exception_code={})'.format(
+            self.function_code, self.exception_code)
+
+
+def _decode_registers(payload):
+    """Convert a big endian register payload into an array('H')."""
+    registers = array('H')
+    registers.frombytes(payload)
+    if _SWAP:
+        registers.byteswap()
+    return registers
+
+
+def _parse_pdu(function, pdu):
+    """Parse a response PDU (a memoryview starting at the function code).
+
+    Raises:
+        ConnectionError: The response does not match the request.
+    """
+    code = pdu[0]
+    if code == function | 0x80:
+        return ExceptionResponse(function, pdu[1])
+    if code != function:
+        raise ConnectionError('Unexpected function code {}'.format(code))
+    if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+        byte_count = pdu[1]
+        if byte_count % 2 or byte_count > len(pdu) - 2:
+            raise ConnectionError('Invalid byte count {}'.format(byte_count))
+        return ReadRegistersResponse(_decode_registers(pdu[2:2 + byte_count]))
+    return WriteResponse(*_ADDRESS_VALUE.unpack_from(pdu, 1))
+
+
+def _read_body(address, count):
+    """Return the request body of a read request."""
+    if not 1 <= count <= MAX_READ_COUNT:
+        raise ValueError('Cannot read {} registers'.format(count))
+    return _ADDRESS_VALUE.pack(address, count)
+
+
+def _write_multiple_body(address, values):
+    """Return the request body of a write multiple registers request."""
+    count = len(values)
+    if not 1 <= count <= MAX_WRITE_COUNT:
+        raise ValueError('Cannot write {} registers'.format(count))
+    return struct.pack('>HHB{}H'.format(count), address, count, 2 * count,
+                       *values)
+
+
+class _Requests():
+    """Request methods shared by the sync and the asyncio transport.
+
+    Subclasses implement _execute(unit, function, body), which returns the
+    response (or an awaitable of it), and set _tid.
+    """
+
+    def read_holding_registers(self, address, count=1, unit=0):
+        """Read holding registers (function code 3)."""
+        return self._execute(unit, READ_HOLDING_REGISTERS,
+                             _read_body(address, count))
+
+    def read_input_registers(self, address, count=1, unit=0):
+        """Read input registers (function code 4)."""
+        return self._execute(unit, READ_INPUT_REGISTERS,
+                             _read_body(address, count))
+
+    def write_register(self, address, value, unit=0):
+        """Write a single holding register (function code 6)."""
+        return self._execute(unit, WRITE_SINGLE_REGISTER,
+                             _ADDRESS_VALUE.pack(address, value))
+
+    def write_registers(self, address, values, unit=0):
+        """Write multiple holding registers (function code 16)."""
+        return self._execute(unit, WRITE_MULTIPLE_REGISTERS,
+                             _write_multiple_body(address, values))
+
+    def _next_tid(self):
+        """Return the next transaction id."""
+        self._tid = (self._tid + 1) & 0xFFFF
+        return self._tid
+
+
+class ModbusTcpTransport(_Requests):
+    """Blocking Modbus TCP client."""
+
+    def __init__(self, host, port=502, timeout=3.0):
+        """Initialize the transport, it connects on first use.
+
+        Args:
+            host: Host name or IP address of the ISG.
+            port: Modbus TCP port.
+            timeout: Connect and request timeout in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._tid = 0
+        self._buffer = bytearray(MAX_ADU_SIZE)
+        self._view = memoryview(self._buffer)
+
+    def connect(self):
+        """Open the connection.
+
+        Returns:
+            True if connected.
+        """
+        if self._sock is not None:
+            return True
+        try:
+            sock = socket.create_connection((self.host, self.port),
+                                            self.timeout)
+        except OSError:
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        return True
+
+    def is_socket_open(self):
+        """Check if the connection is open."""
+        return self._sock is not None
+
+    def close(self):
+        """Close the connection."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _receive(self, start, size):
+        """Receive exactly size bytes into the buffer at start."""
+        view = self._view[start:start + size]
+        while view:
+            received = self._sock.recv_into(view)
+            if not received:
+                raise ConnectionError('Connection closed by the ISG')
+            view = view[received:]
+
+    def _execute(self, unit, function, body):
+        """Send a request and return its response.
+
+        Responses of earlier requests which timed out are skipped.
+
+        Raises:
+            ConnectionError: Connecting, sending or receiving failed.
+        """
+        if self._sock is None and not self.connect():
+            raise ConnectionError('Connecting to {}:{} failed'.format(
+                self.host, self.port))
+        tid = self._next_tid()
+        request = _MBAP.pack(tid, 0, len(body) + 2, unit) + \
+            bytes((function,)) + body
+        try:
+            self._sock.sendall(request)
+            while True:
+                self._receive(0, _MBAP.size)
+                response_tid, _, length, _ = _MBAP.unpack_from(self._buffer)
+                if not _MIN_LENGTH <= length <= _MAX_LENGTH:
+                    raise ConnectionError('Invalid response length')
+                self._receive(_MBAP.size, length - 1)
+                if response_tid == tid:
+                    break
+        except OSError as exc:
+            self.close()
+            raise ConnectionError('Request to {}:{} failed: {!r}'.format(
+                self.host, self.port, exc)) from exc
+        return _parse_pdu(function,
+                          self._view[_MBAP.size:_MBAP.size + length - 1])
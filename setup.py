@@ -44,11 +44,13 @@ setup(
     url='https://github.com/fucm/python-stiebel-eltron',
     author='Martin Fuchs',
     license='MIT',
-    python_requires='>=3.4',
+    python_requires='>=3.5',
     install_requires=['pymodbus>=2.1.0'],
+    extras_require={'numpy': ['numpy']},
     tests_require=['tox'],
     cmdclass={'test': Tox},
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
+    package_data={'pystiebeleltron': ['maps/*.json']},
     zip_safe=True,
     include_package_data=True,
     # https://pypi.org/classifiers/
@@ -56,7 +58,6 @@ setup(
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Topic :: Utilities',
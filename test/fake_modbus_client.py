@@ -0,0 +1,113 @@
+"""
+In-memory stand-in for a connected pymodbus client.
+
+Mirrors the subset of the pymodbus client interface used by
+pystiebeleltron, so the API can be tested without a running server. Also
+holds the helpers shared by the tests of threads and coroutines.
+"""
+import asyncio
+import time
+
+
+def run(coro):
+    """Run a coroutine in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def wait_for(condition, timeout=2.0):
+    """Wait until a condition of other threads holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out'
+        time.sleep(0.001)
+
+
+class FakeResponse(object):
+    """Modbus read response carrying the register values."""
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+class FakeErrorResponse(object):
+    """Modbus exception response, an illegal data address by default."""
+
+    def __init__(self, exception_code=2):
+        self.exception_code = exception_code
+
+    def isError(self):
+        return True
+
+
+class FakeModbusClient(object):
+
+    def __init__(self, size=3000):
+        # Registers per unit id: {unit: {3: holding, 4: input}}
+        self.size = size
+        self.units = {}
+        self.requests = []
+
+    def _store(self, unit, register):
+        if unit not in self.units:
+            self.units[unit] = {3: [0] * self.size, 4: [0] * self.size}
+        return self.units[unit][register]
+
+    def set_input_register(self, address, value, unit=1):
+        self._store(unit, 4)[address] = int(value) & 0xFFFF
+
+    def set_holding_register(self, address, value, unit=1):
+        self._store(unit, 3)[address] = int(value) & 0xFFFF
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        unit = kwargs.get('unit', 0)
+        self.requests.append(('read_input_registers', unit, address, count))
+        return FakeResponse(self._store(unit, 4)[address:address + count])
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        unit = kwargs.get('unit', 0)
+        self.requests.append(('read_holding_registers', unit, address, count))
+        return FakeResponse(self._store(unit, 3)[address:address + count])
+
+    def write_register(self, address, value, **kwargs):
+        unit = kwargs.get('unit', 0)
+        self.requests.append(('write_register', unit, address, 1))
+        self._store(unit, 3)[address] = value
+
+    def write_registers(self, address, values, **kwargs):
+        unit = kwargs.get('unit', 0)
+        self.requests.append(('write_registers', unit, address, len(values)))
+        self._store(unit, 3)[address:address + len(values)] = values
+
+    def close(self):
+        pass
+
+
+class FakeAsyncModbusClient(object):
+    """Asyncio variant answering each request after a delay."""
+
+    def __init__(self, client=None, delay=0.0):
+        self.client = client or FakeModbusClient()
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+                return method(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+
+        return call
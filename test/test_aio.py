@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeErrorResponse,
+                                     FakeModbusClient, run)
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+
+slave = 1
+
+
+class TestAsyncStiebelEltronApi:
+
+    def test_update_pipelines_blocks(self):
+        conn = FakeAsyncModbusClient(delay=0.01)
+        api = AsyncStiebelEltronAPI(conn, slave)
+        assert run(api.update()) is True
+        assert conn.max_in_flight == 3
+
+    def test_getters_and_setters(self):
+        conn = FakeAsyncModbusClient()
+        api = AsyncStiebelEltronAPI(conn, slave, update_on_read=True)
+        conn.client.set_input_register(0, 21.5 * 10)
+        conn.client.set_input_register(2000, 0x0004)
+
+        async def scenario():
+            assert await api.get_current_temp() == 21.5
+            await api.set_target_temp(22.5)
+            assert await api.get_target_temp() == 22.5
+            await api.set_operation('DHW')
+            assert await api.get_operation() == 'DHW'
+            assert await api.get_heating_status() is True
+            assert await api.get_cooling_status() is False
+
+        run(scenario())
+
+    def test_cache_reads_single_block(self):
+        conn = FakeAsyncModbusClient()
+        api = AsyncStiebelEltronAPI(conn, slave, update_on_read=True,
+                                    cache_ttl=60)
+        run(api.get_heating_status())
+        run(api.get_cooling_status())
+        assert conn.client.requests == [
+            ('read_input_registers', slave, 2000, 3)]
+
+    def test_write_values(self):
+        conn = FakeAsyncModbusClient()
+        api = AsyncStiebelEltronAPI(conn, slave)
+        results = run(api.write_values({'DAY_STAGE': 1, 'NIGHT_STAGE': 2}))
+        assert set(results.values()) == {'written'}
+        assert conn.client.requests == [('write_registers', slave, 1017, 2)]
+
+    def test_rejected_write_not_confirmed(self):
+        class RejectingClient(FakeModbusClient):
+            def write_register(self, address, value, **kwargs):
+                super().write_register(address, value, **kwargs)
+                return FakeErrorResponse()
+
+        conn = FakeAsyncModbusClient(RejectingClient())
+        api = AsyncStiebelEltronAPI(conn, slave)
+        assert run(api.write_and_confirm('OPERATING_MODE', 5)) is False
+        assert conn.client.requests == [('write_register', slave, 1000, 1)]
+
+    def test_zero_timeout(self):
+        conn = FakeAsyncModbusClient()
+        api = AsyncStiebelEltronAPI(conn, slave)
+        # The write is applied, the single re-read confirms it
+        assert run(api.write_and_confirm('OPERATING_MODE', 5, timeout=0))
+        assert conn.client.requests[1:] == [
+            ('read_holding_registers', slave, 1000, 1)]
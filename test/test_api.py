@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+import threading
+import time
+
+import pytest
+
+from test.fake_modbus_client import FakeErrorResponse, FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+
+slave = 1
+
+
+class TestRegisterCache:
+
+    @pytest.fixture
+    def client(self):
+        return FakeModbusClient()
+
+    def test_no_cache_reads_all_blocks(self, client):
+        api = pyse.StiebelEltronAPI(client, slave, update_on_read=True)
+        api.get_current_temp()
+        api.get_target_temp()
+        assert len(client.requests) == 6
+
+    def test_cache_hit_within_ttl(self, client):
+        api = pyse.StiebelEltronAPI(client, slave, update_on_read=True,
+                                    cache_ttl=60)
+        client.set_input_register(0, 215)
+        assert api.get_current_temp() == 21.5
+        client.set_input_register(0, 225)
+        assert api.get_current_temp() == 21.5
+        assert api.get_current_humidity() == 0
+        # Only block 1 was read, once
+        assert client.requests == [('read_input_registers', slave, 0, 33)]
+        assert api.get_cache_stats() == {'hits': 2, 'misses': 1}
+
+    def test_expired_block_is_reread(self, client):
+        api = pyse.StiebelEltronAPI(client, slave, update_on_read=True,
+                                    cache_ttl={1: 0, 2: 60, 3: 60})
+        client.set_input_register(0, 215)
+        assert api.get_current_temp() == 21.5
+        client.set_input_register(0, 225)
+        assert api.get_current_temp() == 22.5
+
+    def test_cache_other_block_numbers(self, client):
+        data = pyse.DEFAULT_MAP.to_dict()
+        for entry in data['blocks']:
+            entry['block'] += 10
+        api = pyse.StiebelEltronAPI(
+            client, slave, update_on_read=True, cache_ttl=60,
+            register_map=pyse.RegisterMap.from_dict(data))
+        client.set_input_register(0, 215)
+        assert api.get_current_temp() == 21.5
+        assert api.get_heating_status() is False
+        assert client.requests == [('read_input_registers', slave, 0, 33),
+                                   ('read_input_registers', slave, 2000, 3)]
+
+    def test_write_invalidates_holding_block(self, client):
+        api = pyse.StiebelEltronAPI(client, slave, update_on_read=True,
+                                    cache_ttl=60)
+        api.get_target_temp()
+        api.get_heating_status()
+        api.set_target_temp(22.5)
+        assert api.get_target_temp() == 22.5
+        api.get_heating_status()
+        assert api.get_cache_stats() == {'hits': 1, 'misses': 3}
+
+
+class TestRegisterState:
+
+    def test_instances_do_not_share_values(self):
+        client = FakeModbusClient()
+        client.set_input_register(0, 215, unit=1)
+        client.set_input_register(0, 195, unit=2)
+        api_1 = pyse.StiebelEltronAPI(client, 1)
+        api_2 = pyse.StiebelEltronAPI(client, 2)
+
+        assert api_1.update()
+        assert api_2.update()
+        assert api_1.get_current_temp() == 21.5
+        assert api_2.get_current_temp() == 19.5
+        assert 'value' not in pyse.B1_REGMAP_INPUT['OUTSIDE_TEMPERATURE']
+
+    def test_concurrent_instances_in_threads(self):
+        client = FakeModbusClient()
+        apis = []
+        for unit in range(1, 5):
+            client.set_holding_register(1001, 200 + unit, unit=unit)
+            apis.append(pyse.StiebelEltronAPI(client, unit))
+        errors = []
+
+        def poll(api, expected):
+            for _ in range(200):
+                api.update()
+                if api.get_target_temp() != pytest.approx(expected):
+                    errors.append((expected, api.get_target_temp()))
+
+        threads = [threading.Thread(target=poll, args=(api, 20 + unit / 10))
+                   for unit, api in enumerate(apis, 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_incomplete_response_fails(self, caplog, capsys):
+        client = FakeModbusClient(size=1010)
+        api = pyse.StiebelEltronAPI(client, slave)
+        assert api.update() is False
+        assert 'Modbus read failed' in caplog.text
+        assert capsys.readouterr().out == ''
+
+
+class TestSnapshot:
+
+    def test_snapshot_decodes_all_blocks(self):
+        client = FakeModbusClient()
+        client.set_input_register(11, 352)
+        client.set_input_register(30, 1234)
+        client.set_input_register(2000, 0x0006)
+        client.set_holding_register(1000, 5)
+        client.set_holding_register(1007, 45)
+        api = pyse.StiebelEltronAPI(client, slave)
+
+        snapshot = api.snapshot()
+        assert len(client.requests) == 3
+        assert len(snapshot.values) == len(pyse.SNAPSHOT_FIELDS) == 63
+        assert snapshot['FLOW_TEMPERATURE'] == pytest.approx(35.2)
+        assert snapshot['COMPRESSOR_STARTS'] == 1234
+        assert snapshot['GRADIENT_HC1'] == pytest.approx(0.45)
+        assert snapshot.get('UNKNOWN_REGISTER') is None
+        assert snapshot.operating_mode == 'DHW'
+        assert snapshot.operating_status == {'COMPRESSOR', 'HEATING'}
+        assert snapshot.as_dict()['OPERATING_MODE'] == 5
+
+    def test_snapshot_is_immutable(self):
+        snapshot = pyse.StiebelEltronAPI(FakeModbusClient(), slave).snapshot()
+        with pytest.raises(AttributeError):
+            snapshot.operating_mode = 'STANDBY'
+
+    def test_snapshot_without_refresh(self):
+        client = FakeModbusClient()
+        snapshot = pyse.StiebelEltronAPI(client, slave).snapshot(refresh=False)
+        assert client.requests == []
+        # Nothing was read yet
+        assert snapshot['OUTSIDE_TEMPERATURE'] is None
+        assert snapshot.operating_mode == 'UNKNOWN'
+
+
+class TestCodec:
+
+    def test_signed_values(self):
+        client = FakeModbusClient()
+        client.set_input_register(6, -50)
+        client.set_input_register(29, -125)
+        api = pyse.StiebelEltronAPI(client, slave)
+        api.update()
+        assert api.get_conv_val('OUTSIDE_TEMPERATURE') == -5.0
+        assert api.get_conv_val('LOW_PRESSURE') == -1.25
+
+    def test_sentinels_decode_to_none(self):
+        client = FakeModbusClient()
+        client.set_input_register(0, pyse.ERROR_OBJ_UNAVAILBLE)
+        client.set_input_register(6, pyse.ERROR_NOTAVAILABLE * 10)
+        client.set_input_register(11, pyse.ERROR_SHORTCUT * 10)
+        client.set_input_register(17, pyse.ERROR_OBJ_UNAVAILBLE)
+        client.set_input_register(2000, pyse.ERROR_OBJ_UNAVAILBLE)
+        api = pyse.StiebelEltronAPI(client, slave)
+
+        snapshot = api.snapshot()
+        assert api.get_current_temp() is None
+        assert snapshot['OUTSIDE_TEMPERATURE'] is None
+        assert snapshot['FLOW_TEMPERATURE'] is None
+        assert snapshot['VENTILATION_AIR_ACTUAL_FAN_SPEED'] is None
+        assert snapshot.operating_status == frozenset()
+        assert api.get_heating_status() is False
+
+    def test_out_of_range_byte(self):
+        assert pyse.CODECS[8].decode(300) is None
+        assert pyse.CODECS[8].decode(14) == 14
+
+    def test_encode(self):
+        assert pyse.encode_value('ROOM_TEMP_HEAT_DAY_HC1', 21.5) == (1001, 215)
+        assert pyse.encode_value('LOW_END_HC1', -5.0) == (1008, 0x10000 - 50)
+        assert pyse.encode_value('GRADIENT_HC1', 0.45) == (1007, 45)
+        with pytest.raises(ValueError):
+            pyse.encode_value('OPERATING_MODE', 256)
+        with pytest.raises(ValueError):
+            pyse.encode_value('OUTSIDE_TEMPERATURE', 5.0)
+
+    def test_write_and_read_share_codec(self):
+        client = FakeModbusClient()
+        api = pyse.StiebelEltronAPI(client, slave, update_on_read=True)
+        api.set_target_temp(-2.5)
+        assert api.get_target_temp() == -2.5
+        with pytest.raises(ValueError):
+            api.set_operation('UNKNOWN MODE')
+
+
+class TestSelectiveUpdate:
+
+    def test_plan_reads_merges_nearby_registers(self):
+        ranges = pyse.plan_reads(['OUTSIDE_TEMPERATURE', 'FLOW_TEMPERATURE',
+                                  'RETURN_TEMPERATURE', 'OPERATING_STATUS'])
+        assert ranges == (pyse.ReadRange(1, 6, 7), pyse.ReadRange(3, 0, 1))
+
+    def test_plan_reads_splits_distant_registers(self):
+        ranges = pyse.plan_reads(['ACTUAL_ROOM_TEMPERATURE_HC1',
+                                  'MIXED_WATER_AMOUNT'], max_gap=4)
+        assert ranges == (pyse.ReadRange(1, 0, 1), pyse.ReadRange(1, 32, 1))
+
+    def test_plan_reads_unknown_register(self):
+        with pytest.raises(ValueError):
+            pyse.plan_reads(['NO_SUCH_REGISTER'])
+
+    def test_update_selected_registers(self):
+        client = FakeModbusClient()
+        client.set_input_register(2000, 0x0004)
+        client.set_input_register(0, 215)
+        api = pyse.StiebelEltronAPI(client, slave)
+
+        assert api.update(names=['OPERATING_STATUS'])
+        assert client.requests == [('read_input_registers', slave, 2000, 1)]
+        assert api.get_heating_status() is True
+        assert api.get_current_temp() == 0
+
+    def test_update_selected_blocks(self):
+        client = FakeModbusClient()
+        api = pyse.StiebelEltronAPI(client, slave)
+        assert api.update(names=['OPERATING_STATUS'], blocks=[2])
+        assert client.requests == [
+            ('read_holding_registers', slave, 1000, 27),
+            ('read_input_registers', slave, 2000, 1)]
+
+
+class TestWriteValues:
+
+    def test_adjacent_registers_are_coalesced(self):
+        client = FakeModbusClient()
+        api = pyse.StiebelEltronAPI(client, slave)
+        results = api.write_values({
+            'ROOM_TEMP_HEAT_DAY_HC1': 21.5,
+            'ROOM_TEMP_HEAT_NIGHT_HC1': 18.0,
+            'ROOM_TEMP_HEAT_DAY_HC2': 20.0,
+            'DHW_TEMP_SET_DAY': 50.0})
+
+        assert results == dict.fromkeys(
+            ['ROOM_TEMP_HEAT_DAY_HC1', 'ROOM_TEMP_HEAT_NIGHT_HC1',
+             'ROOM_TEMP_HEAT_DAY_HC2', 'DHW_TEMP_SET_DAY'], pyse.WRITE_DONE)
+        assert client.requests == [
+            ('write_registers', slave, 1001, 2),
+            ('write_register', slave, 1004, 1),
+            ('write_register', slave, 1011, 1)]
+        api.update()
+        assert api.get_conv_val('ROOM_TEMP_HEAT_NIGHT_HC1') == 18.0
+
+    def test_unchanged_values_are_skipped(self):
+        client = FakeModbusClient()
+        client.set_holding_register(1017, 2)
+        api = pyse.StiebelEltronAPI(client, slave)
+        # Values not read yet are always written
+        assert api.write_values({'DAY_STAGE': 2}) == {
+            'DAY_STAGE': pyse.WRITE_DONE}
+        api.update(blocks=[2])
+        client.requests = []
+
+        results = api.write_values({'DAY_STAGE': 2, 'NIGHT_STAGE': 1})
+        assert results == {'DAY_STAGE': pyse.WRITE_UNCHANGED,
+                           'NIGHT_STAGE': pyse.WRITE_DONE}
+        assert client.requests == [('write_register', slave, 1018, 1)]
+
+    def test_invalid_value_writes_nothing(self):
+        client = FakeModbusClient()
+        api = pyse.StiebelEltronAPI(client, slave)
+        with pytest.raises(ValueError):
+            api.write_values({'DAY_STAGE': 1, 'OPERATING_MODE': 1000})
+        with pytest.raises(ValueError):
+            api.write_values({'DAY_STAGE': 1, 'OUTSIDE_TEMPERATURE': 5})
+        assert client.requests == []
+
+    def test_failure_aborts_remaining_writes(self):
+        class FailingClient(FakeModbusClient):
+            def write_registers(self, address, values, **kwargs):
+                raise ConnectionError('gateway down')
+
+        client = FailingClient()
+        api = pyse.StiebelEltronAPI(client, slave)
+        results = api.write_values({
+            'MWM_SET_DAY': 1, 'MWM_SET_NIGHT': 2, 'RESET': 0})
+        assert results == {'MWM_SET_DAY': pyse.WRITE_FAILED,
+                           'MWM_SET_NIGHT': pyse.WRITE_FAILED,
+                           'RESET': pyse.WRITE_ABORTED}
+
+
+class TestWriteAndConfirm:
+
+    class DelayedClient(FakeModbusClient):
+        """Applies writes after a number of reads."""
+
+        def __init__(self, delay_reads):
+            super().__init__()
+            self.delay_reads = delay_reads
+            self.pending = None
+
+        def write_register(self, address, value, **kwargs):
+            self.pending = [self.delay_reads, address, value]
+
+        def read_holding_registers(self, address, count=1, **kwargs):
+            if self.pending is not None:
+                self.pending[0] -= 1
+                if self.pending[0] < 0:
+                    self.set_holding_register(*self.pending[1:])
+                    self.pending = None
+            return super().read_holding_registers(address, count, **kwargs)
+
+    def test_confirmed_after_reread(self):
+        client = self.DelayedClient(delay_reads=2)
+        api = pyse.StiebelEltronAPI(client, slave)
+        assert api.get_confirm_timeout() == pyse.CONFIRM_TIMEOUT
+        assert api.write_and_confirm('ROOM_TEMP_HEAT_DAY_HC1', 22.5)
+        # Only the written register is re-read
+        assert client.requests[-1] == ('read_holding_registers', slave,
+                                       1001, 1)
+        assert api.get_conv_val('ROOM_TEMP_HEAT_DAY_HC1') == 22.5
+        assert api.get_apply_latency() > 0
+        assert api.get_confirm_timeout() < pyse.CONFIRM_TIMEOUT
+
+    def test_timeout(self):
+        client = self.DelayedClient(delay_reads=100)
+        api = pyse.StiebelEltronAPI(client, slave)
+        assert not api.write_and_confirm('OPERATING_MODE', 5, timeout=0.3)
+        assert api.get_apply_latency() is None
+
+    def test_zero_timeout(self):
+        client = self.DelayedClient(delay_reads=100)
+        api = pyse.StiebelEltronAPI(client, slave)
+        start = time.monotonic()
+        assert not api.write_and_confirm('OPERATING_MODE', 5, timeout=0)
+        assert time.monotonic() - start < pyse.CONFIRM_TIMEOUT / 2
+        # Read once
+        assert client.requests == [
+            ('read_holding_registers', slave, 1000, 1)]
+
+    def test_rejected_write(self):
+        class RejectingClient(FakeModbusClient):
+            def write_register(self, address, value, **kwargs):
+                super().write_register(address, value, **kwargs)
+                return FakeErrorResponse()
+
+        class OfflineClient(FakeModbusClient):
+            def write_register(self, address, value, **kwargs):
+                raise ConnectionError('gateway down')
+
+        for client in (RejectingClient(), OfflineClient()):
+            api = pyse.StiebelEltronAPI(client, slave)
+            start = time.monotonic()
+            assert not api.write_and_confirm('OPERATING_MODE', 5)
+            assert time.monotonic() - start < pyse.CONFIRM_INTERVAL
+            # Nothing is re-read
+            assert not any(request[0] == 'read_holding_registers'
+                           for request in client.requests)
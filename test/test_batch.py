@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import pytest
+
+from pystiebeleltron import pystiebeleltron as pyse
+
+np = pytest.importorskip('numpy')
+batch = pytest.importorskip('pystiebeleltron.batch')
+
+
+class TestBatchDecode:
+
+    def test_decode_block_scaling_and_sign(self):
+        raw = np.zeros((2, 33), dtype=np.uint16)
+        raw[0, 6] = 0x10000 - 50       # OUTSIDE_TEMPERATURE -5.0
+        raw[1, 6] = 215
+        raw[0, 28] = 1234              # HIGH_PRESSURE 12.34
+        raw[0, 30] = 40000             # COMPRESSOR_STARTS unsigned
+
+        values = batch.decode_block(raw, 1)
+        assert values.shape == (2, 33)
+        assert values[0, 6] == pytest.approx(-5.0)
+        assert values[1, 6] == pytest.approx(21.5)
+        assert values[0, 28] == pytest.approx(12.34)
+        assert values[0, 30] == 40000
+
+    def test_sentinels_are_nan(self):
+        raw = np.zeros(33, dtype=np.uint16)
+        raw[0] = 0x8000
+        raw[1] = 0x10000 - 600
+        raw[2] = 0x10000 - 500
+        raw[17] = 0x8000
+
+        values = batch.decode_block(raw, 1)
+        assert np.isnan(values[[0, 1, 2, 17]]).all()
+        assert not np.isnan(values[3:17]).any()
+
+    def test_decode_blocks_schema(self):
+        samples = 5
+        values = batch.decode_blocks(
+            np.zeros((samples, 33)), np.full((samples, 27), 5),
+            np.zeros((samples, 3)))
+        assert values.shape == (samples, len(pyse.SNAPSHOT_FIELDS))
+        column = pyse.SNAPSHOT_INDEX['OPERATING_MODE']
+        assert (values[:, column] == 5).all()
+
+    def test_wrong_block_length(self):
+        with pytest.raises(ValueError):
+            batch.decode_block(np.zeros((1, 30)), 1)
+
+    def test_register_map_with_gaps(self):
+        from pystiebeleltron.registermap import RegisterMap
+        register_map = RegisterMap('gaps', {
+            1: (0, {'A': {'addr': 0, 'type': 2}, 'B': {'addr': 2, 'type': 6}},
+                'read_input_registers')})
+        raw = np.array([[215, 7, 3]])
+        assert np.isnan(batch.decode_block(raw, 1, register_map)[0, 1])
+        values = batch.decode_blocks(raw, register_map=register_map)
+        assert values.tolist() == [[21.5, 3.0]]
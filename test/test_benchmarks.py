@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import pytest
+
+from benchmarks import bench
+from benchmarks.simulator import Simulator
+from pystiebeleltron import pystiebeleltron as pyse
+
+
+@pytest.fixture
+def simulator():
+    sim = Simulator(rtt=0.001)
+    yield sim
+    sim.stop()
+
+
+class TestSimulator:
+
+    def test_pymodbus_client(self, simulator):
+        sync = pytest.importorskip('pymodbus.client.sync')
+        host, port = simulator.start()
+        simulator.set_input_register(0, 215, unit=7)
+        client = sync.ModbusTcpClient(host=host, port=port, timeout=2)
+        assert client.connect()
+        try:
+            api = pyse.StiebelEltronAPI(client, 7)
+            assert api.update()
+            assert api.get_current_temp() == 21.5
+            api.write_values({'DAY_STAGE': 3, 'NIGHT_STAGE': 2})
+            assert simulator.get_holding_register(1018, unit=7) == 2
+            assert simulator.requests == 4
+        finally:
+            client.close()
+
+
+class TestBench:
+
+    def test_compare_reports_regressions(self):
+        baseline = {'results': {'update_sync': {
+            'ops_per_sec': 100.0, 'p99_ms': 10.0}}}
+        results = {'results': {
+            'update_sync': {'ops_per_sec': 70.0, 'p99_ms': 11.0},
+            'update_async': {'skipped': 'no client'}}}
+        assert len(bench.compare(results, baseline, 0.2)) == 1
+        assert bench.compare(results, baseline, 0.5) == []
+
+    def test_run_writes_json(self, tmpdir):
+        output = str(tmpdir.join('results.json'))
+        assert bench.main(['--only', 'decode_snapshot', '--iterations', '2',
+                           '--output', output]) == 0
+        assert bench.main(['--only', 'decode_snapshot', '--iterations', '2',
+                           '--compare', output, '--tolerance', '1000']) == 0
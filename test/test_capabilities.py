@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+import asyncio
+
+import pytest
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeErrorResponse,
+                                     FakeModbusClient, run)
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.capabilities import Capabilities
+
+slave = 1
+
+# Registers the simulated unit does not have: ventilation, dew points,
+# solar collector and compressor values
+UNAVAILABLE = range(17, 33)
+
+
+class FailingBlockClient(FakeModbusClient):
+    """Client without holding registers."""
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        return FakeErrorResponse()
+
+
+class TestCapabilities:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        for address in UNAVAILABLE:
+            self.client.set_input_register(address, 0x8000)
+        self.client.set_input_register(11, 352)
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+
+    def test_probe(self):
+        caps = self.api.probe_capabilities()
+        assert 'FLOW_TEMPERATURE' in caps.supported
+        assert 'COLLECTOR_TEMPERATURE' in caps.absent
+        assert len(caps.absent) == len(UNAVAILABLE)
+        assert caps.block_ranges[1] == (pyse.ReadRange(1, 0, 17),)
+        assert self.api.get_capabilities() is caps
+
+    def test_probe_samples(self):
+        self.api.probe_capabilities(samples=2)
+        assert self.client.requests.count(
+            ('read_input_registers', slave, 0, 33)) == 2
+
+    def test_update_reads_supported_ranges(self):
+        self.api.probe_capabilities()
+        self.client.requests.clear()
+        assert self.api.update() is True
+        assert self.client.requests == [
+            ('read_input_registers', slave, 0, 17),
+            ('read_holding_registers', slave, 1000, 27),
+            ('read_input_registers', slave, 2000, 3)]
+
+    def test_selective_update_skips_absent(self):
+        self.api.probe_capabilities()
+        self.client.requests.clear()
+        self.api.update(names=['FLOW_TEMPERATURE', 'COMPRESSOR_STARTS'])
+        assert self.client.requests == [
+            ('read_input_registers', slave, 11, 1)]
+
+    def test_absent_values(self):
+        self.api.probe_capabilities()
+        self.api.update()
+        assert self.api.get_conv_val('FLOW_TEMPERATURE') == 35.2
+        assert self.api.get_conv_val('COMPRESSOR_STARTS') is None
+
+        snapshot = self.api.snapshot()
+        assert snapshot['FLOW_TEMPERATURE'] == 35.2
+        with pytest.raises(KeyError):
+            snapshot['COMPRESSOR_STARTS']
+        assert snapshot.get('COMPRESSOR_STARTS', 'n/a') == 'n/a'
+        assert 'COMPRESSOR_STARTS' not in snapshot.as_dict()
+        assert snapshot.values[
+            pyse.SNAPSHOT_INDEX['COMPRESSOR_STARTS']] is None
+
+    def test_cached_block_refresh(self):
+        api = pyse.StiebelEltronAPI(self.client, slave, update_on_read=True,
+                                    cache_ttl=60)
+        api.probe_capabilities()
+        self.client.requests.clear()
+        api.get_current_temp()
+        api.get_current_humidity()
+        assert self.client.requests == [
+            ('read_input_registers', slave, 0, 17)]
+
+    def test_unreadable_block(self):
+        api = pyse.StiebelEltronAPI(FailingBlockClient(), slave)
+        caps = api.probe_capabilities()
+        assert not caps.supports_block(2)
+        assert caps.supports_block(1)
+        assert 'OPERATING_MODE' in caps.absent
+
+    def test_transient_failure(self):
+        class TimeoutClient(FakeModbusClient):
+            def read_holding_registers(self, address, count=1, **kwargs):
+                raise ConnectionError('timed out')
+
+        class NoResponseClient(FakeModbusClient):
+            def read_holding_registers(self, address, count=1, **kwargs):
+                return object()
+
+        for client in (TimeoutClient(), NoResponseClient()):
+            api = pyse.StiebelEltronAPI(client, slave)
+            with pytest.raises(ConnectionError):
+                api.probe_capabilities()
+            assert api.get_capabilities() is None
+
+    def test_offline_unit(self):
+        class Offline(object):
+            def read_input_registers(self, address, count=1, **kwargs):
+                raise ConnectionError('offline')
+            read_holding_registers = read_input_registers
+
+        with pytest.raises(ConnectionError):
+            pyse.StiebelEltronAPI(Offline(), slave).probe_capabilities()
+
+    def test_reset(self):
+        self.api.probe_capabilities()
+        self.api.set_capabilities(None)
+        self.client.requests.clear()
+        self.api.update()
+        assert ('read_input_registers', slave, 0, 33) in self.client.requests
+
+    def test_changes_skip_absent(self):
+        self.api.probe_capabilities()
+        changes = list(self.api.track_changes().poll())
+        names = {change.name for change in changes}
+        assert 'FLOW_TEMPERATURE' in names
+        assert 'COMPRESSOR_STARTS' not in names
+
+    def test_save_and_load(self, tmp_path):
+        caps = self.api.probe_capabilities()
+        path = str(tmp_path / 'unit1.json')
+        caps.save(path)
+        assert Capabilities.load(path) == caps
+
+    def test_invalid_data(self):
+        with pytest.raises(ValueError):
+            Capabilities(['NO_SUCH_REGISTER'])
+        with pytest.raises(ValueError):
+            Capabilities.from_dict({'version': 99, 'supported': []})
+
+    def test_async_probe(self):
+        conn = FakeAsyncModbusClient(self.client)
+        api = AsyncStiebelEltronAPI(conn, slave)
+        loop = asyncio.new_event_loop()
+        try:
+            caps = loop.run_until_complete(api.probe_capabilities())
+            self.client.requests.clear()
+            loop.run_until_complete(api.update(blocks=[1]))
+        finally:
+            loop.close()
+        assert 'COLLECTOR_TEMPERATURE' in caps.absent
+        assert self.client.requests == [
+            ('read_input_registers', slave, 0, 17)]
+
+    def test_async_unreadable_block(self):
+        class TimeoutClient(FakeModbusClient):
+            def read_input_registers(self, address, count=1, **kwargs):
+                raise ConnectionError('timed out')
+
+        api = AsyncStiebelEltronAPI(
+            FakeAsyncModbusClient(FailingBlockClient()), slave)
+        assert not run(api.probe_capabilities()).supports_block(2)
+        api = AsyncStiebelEltronAPI(
+            FakeAsyncModbusClient(TimeoutClient()), slave)
+        with pytest.raises(ConnectionError):
+            run(api.probe_capabilities())
+        assert api.get_capabilities() is None
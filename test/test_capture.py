@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import json
+import math
+from array import array
+
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient
+from test.test_registermap import large_map_data
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.capture import CaptureReader, CaptureWriter
+from pystiebeleltron.registermap import RegisterMap
+
+slave = 1
+
+
+class TestCapture:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+
+    def capture(self, path, temperatures):
+        self.api.start_capture(path)
+        for temperature in temperatures:
+            self.client.set_input_register(11, temperature)
+            self.api.update()
+        self.api.stop_capture()
+
+    def test_replay_snapshots(self, tmp_path):
+        path = str(tmp_path / 'unit.cap')
+        self.client.set_holding_register(1001, 215)
+        self.capture(path, [350, 0xFF9C, 0x8000])
+        self.api.start_capture(path)
+        self.api.update(names=['FLOW_TEMPERATURE'])
+        self.api.stop_capture()
+
+        with CaptureReader(path) as reader:
+            assert reader.register_map is pyse.DEFAULT_MAP
+            assert len(reader) == 4
+            assert reader[0].blocks == (1, 2, 3)
+            assert reader[-1].blocks == (1,)
+            assert reader.words(1)[11] == 0xFF9C
+            values = [snapshot['FLOW_TEMPERATURE']
+                      for snapshot in reader.snapshots()]
+            assert values == [35.0, -10.0, None, None]
+            snapshot = reader.snapshot(0)
+            assert snapshot['ROOM_TEMP_HEAT_DAY_HC1'] == 21.5
+            assert snapshot.as_dict() == dict(zip(
+                pyse.SNAPSHOT_FIELDS, snapshot.values))
+
+    def test_replay_unread_blocks(self, tmp_path):
+        path = str(tmp_path / 'unit.cap')
+        self.client.set_input_register(6, 52)
+        self.client.set_input_register(2000, 1)
+        self.api.start_capture(path)
+        self.api.update(blocks=[3])
+        self.api.update(blocks=[1])
+        self.api.stop_capture()
+
+        with CaptureReader(path) as reader:
+            first, second = reader.snapshots()
+        assert first['OUTSIDE_TEMPERATURE'] is None
+        assert first['OPERATING_STATUS'] == 1
+        assert second['OUTSIDE_TEMPERATURE'] == 5.2
+        assert second['OPERATING_MODE'] is None
+        assert second.values == self.api.snapshot(refresh=False).values
+
+    def test_random_access_by_time(self, tmp_path):
+        path = str(tmp_path / 'unit.cap')
+        with CaptureWriter(path) as writer:
+            for second in range(100):
+                writer.write(self.api._values, timestamp=1000.0 + second)
+        with CaptureReader(path) as reader:
+            assert reader.bisect(1050.5) == 51
+            assert reader.bisect(0) == 0
+            assert reader.bisect(2000) == 100
+            assert reader.timestamp(-1) == 1099.0
+            with pytest.raises(IndexError):
+                reader[100]
+
+    def test_append_and_truncated_record(self, tmp_path):
+        path = tmp_path / 'unit.cap'
+        self.capture(str(path), [350])
+        with open(str(path), 'ab') as target:
+            target.write(b'\x00' * 7)
+        with CaptureReader(str(path)) as reader:
+            assert len(reader) == 1
+        self.capture(str(path), [360])
+        with CaptureReader(str(path)) as reader:
+            assert [snapshot['FLOW_TEMPERATURE']
+                    for snapshot in reader.snapshots()] == [35.0, 36.0]
+
+    def test_other_register_map(self, tmp_path):
+        path = str(tmp_path / 'unit.cap')
+        self.capture(path, [350])
+        large = RegisterMap.from_dict(large_map_data())
+        with pytest.raises(ValueError):
+            CaptureWriter(path, large)
+        with pytest.raises(ValueError):
+            CaptureReader(path, large)
+
+        # Same layout, changed codec: replayed with the new rules
+        data = pyse.DEFAULT_MAP.to_dict()
+        for entry in data['blocks'][0]['registers']:
+            if entry['name'] == 'FLOW_TEMPERATURE':
+                entry['type'] = 6
+        changed = RegisterMap.from_dict(data)
+        with CaptureReader(path, changed) as reader:
+            assert reader.snapshot(0)['FLOW_TEMPERATURE'] == 350
+
+    def test_captured_map(self, tmp_path):
+        path = str(tmp_path / 'large.cap')
+        large = RegisterMap.from_dict(large_map_data())
+        api = pyse.StiebelEltronAPI(FakeModbusClient(size=6000), slave,
+                                    register_map=large)
+        api.start_capture(path)
+        api.update()
+        api.stop_capture()
+        with CaptureReader(path) as reader:
+            assert reader.register_map.to_dict() == large.to_dict()
+            assert len(reader.snapshot(0).values) == 600
+
+    def test_many_blocks(self, tmp_path):
+        path = str(tmp_path / 'many.cap')
+        many = RegisterMap.from_dict({'name': 'many', 'blocks': [
+            {'block': number, 'kind': 'input', 'start': number * 100,
+             'registers': [{'name': 'B{}'.format(number),
+                            'addr': number * 100, 'type': 6}]}
+            for number in range(1, 19)]})
+        values = {block: array('H', [block]) for block in many.blocks}
+        with CaptureWriter(path, many) as writer:
+            writer.write(values, blocks=[1, 17, 18], timestamp=1.0)
+            writer.write(values, timestamp=2.0)
+        with CaptureReader(path) as reader:
+            assert reader[0].blocks == (1, 17, 18)
+            assert reader[1].blocks == tuple(range(1, 19))
+            assert reader.snapshot(0)['B18'] == 18
+
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / 'other.json'
+        path.write_text(json.dumps({'name': 'isg'}))
+        with pytest.raises(ValueError):
+            CaptureReader(str(path))
+        with pytest.raises(ValueError):
+            CaptureWriter(str(path))
+
+    def test_arrays(self, tmp_path):
+        np = pytest.importorskip('numpy')
+        batch = pytest.importorskip('pystiebeleltron.batch')
+        path = str(tmp_path / 'unit.cap')
+        self.capture(path, [350, 360, 0x8000])
+
+        reader = CaptureReader(path)
+        timestamps, blocks = reader.arrays(start=1)
+        assert timestamps.shape == (2,)
+        assert [raw.shape for raw in blocks] == [(2, 33), (2, 27), (2, 3)]
+        values = batch.decode_blocks(*blocks,
+                                     register_map=reader.register_map)
+        column = pyse.SNAPSHOT_INDEX['FLOW_TEMPERATURE']
+        assert values[0, column] == 36.0
+        assert np.isnan(values[1, column])
+        assert math.isclose(timestamps[0], reader.timestamp(1))
+        del timestamps, blocks
+        reader.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import pytest
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeModbusClient,
+                                     run)
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.changes import Change
+
+slave = 1
+
+
+class TestChangeTracker:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+
+    def test_first_poll_reports_everything(self):
+        tracker = self.api.track_changes()
+        changes = list(tracker.poll())
+        assert len(changes) == len(pyse.SNAPSHOT_FIELDS)
+        assert list(tracker.poll()) == []
+
+    def test_first_poll_of_one_block(self):
+        self.client.set_input_register(2000, 0x0004)
+        tracker = self.api.track_changes()
+        assert list(tracker.poll(blocks=[3])) == [
+            Change('OPERATING_STATUS', 4, None),
+            Change('FAULT_STATUS', 0, None),
+            Change('BUS_STATUS', 0, None)]
+        # Registers of other blocks are reported once they are read
+        self.client.set_input_register(11, 352)
+        changes = list(tracker.poll(names=['FLOW_TEMPERATURE']))
+        assert changes == [Change('FLOW_TEMPERATURE', 35.2, None)]
+        assert len(list(tracker.poll())) == len(pyse.SNAPSHOT_FIELDS) - 4
+
+    def test_only_changed_registers(self):
+        tracker = self.api.track_changes()
+        list(tracker.poll())
+        self.client.set_input_register(11, 352)
+        self.client.set_holding_register(1001, 215)
+        assert list(tracker.poll()) == [
+            Change('FLOW_TEMPERATURE', 35.2, 0.0),
+            Change('ROOM_TEMP_HEAT_DAY_HC1', 21.5, 0.0)]
+
+    def test_deadband(self):
+        tracker = self.api.track_changes(deadbands={'FLOW_TEMPERATURE': 0.2})
+        self.client.set_input_register(11, 350)
+        list(tracker.poll())
+
+        self.client.set_input_register(11, 351)
+        assert list(tracker.poll()) == []
+        # Drift is measured against the last reported value
+        self.client.set_input_register(11, 352)
+        assert list(tracker.poll()) == [
+            Change('FLOW_TEMPERATURE', 35.2, 35.0)]
+
+    def test_status_bits(self):
+        tracker = self.api.track_changes(status_bits=True)
+        self.client.set_input_register(2000, 0x0004)
+        list(tracker.poll(blocks=[3]))
+
+        self.client.set_input_register(2000, 0x0006)
+        assert list(tracker.poll(blocks=[3])) == [
+            Change('OPERATING_STATUS.COMPRESSOR', True, False)]
+
+    def test_asyncio(self):
+        api = AsyncStiebelEltronAPI(FakeAsyncModbusClient(self.client), slave)
+        tracker = api.track_changes()
+        with pytest.raises(TypeError):
+            list(tracker.poll())
+        self.client.set_input_register(11, 352)
+        run(api.update())
+        assert Change('FLOW_TEMPERATURE', 35.2, None) in tracker.changes()
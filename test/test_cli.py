@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import json
+import subprocess
+import sys
+
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient
+from pystiebeleltron import cli
+
+slave = 1
+
+
+class TestCli:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+
+    def run(self, *argv):
+        return cli.main(list(argv),
+                        connect=lambda host, port, timeout: self.client)
+
+    def test_read_block(self, capsys):
+        self.client.set_input_register(2000, 0x0004)
+        assert self.run('read', 'isg', '--block', '3') == 0
+        assert self.client.requests == [
+            ('read_input_registers', slave, 2000, 3)]
+        assert capsys.readouterr().out.splitlines() == [
+            'OPERATING_STATUS=4', 'FAULT_STATUS=0', 'BUS_STATUS=0']
+
+    def test_read_names_json(self, capsys):
+        self.client.set_input_register(11, 352)
+        self.client.set_input_register(26, 0x8000)
+        assert self.run('read', 'isg', 'FLOW_TEMPERATURE',
+                        'COLLECTOR_TEMPERATURE', '--json') == 0
+        assert json.loads(capsys.readouterr().out) == {
+            'FLOW_TEMPERATURE': 35.2, 'COLLECTOR_TEMPERATURE': None}
+
+    def test_unknown_register(self):
+        with pytest.raises(SystemExit):
+            self.run('read', 'isg', 'NO_SUCH_REGISTER')
+        assert self.client.requests == []
+
+    def test_write(self):
+        assert self.run('--unit', '2', 'write', 'isg',
+                        'ROOM_TEMP_HEAT_DAY_HC1', '21.5') == 0
+        assert self.client.requests == [('write_register', 2, 1001, 1)]
+        assert self.client.units[2][3][1001] == 215
+
+    def test_write_operating_mode_by_name(self):
+        assert self.run('write', 'isg', 'OPERATING_MODE', 'DHW') == 0
+        assert self.client.units[slave][3][1000] == 5
+
+    def test_write_invalid(self):
+        with pytest.raises(SystemExit):
+            self.run('write', 'isg', 'FLOW_TEMPERATURE', '20')
+        with pytest.raises(SystemExit):
+            self.run('write', 'isg', 'ROOM_TEMP_HEAT_DAY_HC1', 'warm')
+
+    def test_connect_failure(self, capsys):
+        def connect(host, port, timeout):
+            raise ConnectionError('Connecting to isg:502 failed')
+        assert cli.main(['read', 'isg'], connect=connect) == 1
+        assert 'failed' in capsys.readouterr().err
+
+    def test_minimal_imports(self):
+        code = ('import sys, pystiebeleltron.cli; '
+                'print(" ".join(sorted(sys.modules)))')
+        modules = subprocess.run(
+            [sys.executable, '-c', code], check=True,
+            stdout=subprocess.PIPE).stdout.decode().split()
+        for module in ('pymodbus', 'asyncio', 'threading',
+                       'pystiebeleltron.instrumentation'):
+            assert module not in modules
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import time
+
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.connection import ConnectionPool, ManagedConnection
+
+
+class FlakyClient(FakeModbusClient):
+    """Fake client of a gateway which can go down."""
+
+    def __init__(self, gateway):
+        super().__init__()
+        self.gateway = gateway
+        self.connected = False
+
+    def connect(self):
+        self.connected = self.gateway['up']
+        self.gateway['connects'] += 1
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+    def is_socket_open(self):
+        return self.connected
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        if not self.gateway['up']:
+            raise OSError('Connection reset by peer')
+        return super().read_input_registers(address, count, **kwargs)
+
+
+class TestManagedConnection:
+
+    def setup_method(self):
+        self.gateway = {'up': True, 'connects': 0}
+
+    def factory(self, host, port, timeout):
+        return FlakyClient(self.gateway)
+
+    def test_reconnect_with_backoff(self):
+        conn = ManagedConnection('isg', backoff=60,
+                                 client_factory=self.factory)
+        api = pyse.StiebelEltronAPI(conn, 1)
+        assert api.update(blocks=[3])
+        assert conn.get_health().consecutive_failures == 0
+        assert conn.get_health().rtt_ewma is not None
+
+        self.gateway['up'] = False
+        assert api.update(blocks=[3]) is False
+        assert api.update(blocks=[3]) is False
+        # The failed request delays the reconnect by the backoff
+        assert self.gateway['connects'] == 1
+        health = conn.get_health()
+        assert health.consecutive_failures == 2
+        assert not health.connected
+
+        conn._next_attempt = 0
+        assert api.update(blocks=[3]) is False
+        # Reconnect failed once, the next attempt waits for the backoff
+        assert api.update(blocks=[3]) is False
+        assert self.gateway['connects'] == 2
+
+        conn._next_attempt = 0
+        self.gateway['up'] = True
+        assert api.update(blocks=[3])
+        health = conn.get_health()
+        assert health.consecutive_failures == 0
+        assert health.reconnects == 1
+        assert health.failures == 4
+
+    def test_backoff_after_request_failures(self):
+        class ResettingClient(FlakyClient):
+            """Gateway accepting connections but resetting every request."""
+
+            def read_input_registers(self, address, count=1, **kwargs):
+                raise OSError('Connection reset by peer')
+
+        conn = ManagedConnection(
+            'isg', backoff=1, max_backoff=3600,
+            client_factory=lambda host, port, timeout:
+            ResettingClient(self.gateway))
+        api = pyse.StiebelEltronAPI(conn, 1)
+        for _ in range(10):
+            assert api.update(blocks=[3]) is False
+        assert self.gateway['connects'] == 1
+
+        conn._next_attempt = 0
+        assert api.update(blocks=[3]) is False
+        assert self.gateway['connects'] == 2
+        # The backoff grows with the consecutive failures
+        delay = conn._next_attempt - time.monotonic()
+        assert 2 ** 10 * 0.79 <= delay <= 2 ** 10 * 1.2
+
+    def test_error_raised_as_connection_error(self):
+        self.gateway['up'] = False
+        conn = ManagedConnection('isg', client_factory=self.factory)
+        with pytest.raises(ConnectionError):
+            conn.read_input_registers(0, 1, unit=1)
+
+
+class TestConnectionPool:
+
+    def test_units_share_gateway_connection(self):
+        created = []
+
+        def factory(host, port, timeout):
+            created.append((host, port))
+            return FlakyClient({'up': True, 'connects': 0})
+
+        pool = ConnectionPool(client_factory=factory)
+        api_1 = pool.api('isg-1', slave=1)
+        api_2 = pool.api('isg-1', slave=2)
+        api_3 = pool.api('isg-2', slave=1)
+        for api in (api_1, api_2, api_3):
+            assert api.update()
+
+        assert created == [('isg-1', 502), ('isg-2', 502)]
+        health = pool.get_health()
+        assert health[('isg-1', 502)].requests == 6
+        pool.close()
+        assert not pool.get_health()
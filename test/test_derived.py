@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.derived import (DerivedMetrics, EventWindow,
+                                     TimeWeightedWindow)
+from pystiebeleltron.registermap import RegisterMap
+from test.test_registermap import large_map_data
+
+slave = 1
+
+COMPRESSOR = pyse.B3_OPERATING_STATUS['COMPRESSOR']
+DEFROST = pyse.B3_OPERATING_STATUS['EVAPORATOR_DEFROST']
+
+
+class TestWindows:
+
+    def test_time_weighted(self):
+        window = TimeWeightedWindow(100, max_gap=30)
+        assert window.mean() is None
+        for timestamp, value in ((0, 1), (10, 0), (40, 1), (50, None),
+                                 (60, 1), (90, 0)):
+            window.add(timestamp, value)
+        # 1 for 10 s, 0 for 30 s, 1 for 10 s, unknown, 1 for 30 s
+        assert window.duration == 80
+        assert window.mean() == pytest.approx(50 / 80)
+        # Windows ending later drop the oldest periods, partially
+        assert window.mean(now=125) == pytest.approx(40 / 55)
+        window.add(300, 1)
+        # The gap of 200 s is not held
+        assert window.mean() is None
+
+    def test_events(self):
+        window = EventWindow(3600)
+        assert window.count() is None and window.rate() is None
+        window.observe(0)
+        window.observe(900, 2)
+        window.observe(1800, 1)
+        assert window.count() == 3
+        assert window.rate() == pytest.approx(6.0)
+        assert window.count(now=4500) == 1
+        assert window.rate(now=4500) == pytest.approx(1.0)
+
+
+class TestDerivedMetrics:
+
+    def feed(self, derived, hours=2):
+        """Compressor cycles of 30 minutes, 15 running, every 60 s."""
+        starts = 100
+        for minute in range(hours * 60):
+            running = minute % 30 < 15
+            if minute % 30 == 0:
+                starts += 1
+            status = (COMPRESSOR if running else 0) | \
+                (DEFROST if minute % 60 == 20 else 0)
+            derived.add({
+                'OPERATING_STATUS': status, 'COMPRESSOR_STARTS': starts,
+                'FLOW_TEMPERATURE': 35.0 if running else 30.0,
+                'RETURN_TEMPERATURE': 30.0, 'FLOW_RATE': 12.0},
+                minute * 60.0)
+
+    def test_values(self):
+        derived = DerivedMetrics(window=3600)
+        self.feed(derived)
+        values = derived.values()
+        assert values.compressor_duty_cycle == pytest.approx(0.5)
+        assert values.compressor_starts == 2
+        assert values.compressor_starts_per_hour == pytest.approx(2.0)
+        assert values.defrosts == 1
+        assert values.defrosts_per_hour == pytest.approx(1.0)
+        assert values.defrost_duty_cycle == pytest.approx(1 / 60)
+        assert values.delta_t == pytest.approx(2.5)
+        # 12 l/min * 4.19 kJ/(l K) * 5 K for half of the time
+        assert values.heat_output == pytest.approx(
+            12 / 60 * 4.19 * 5 / 2)
+
+    def test_partial_updates(self):
+        derived = DerivedMetrics()
+        assert derived.values().compressor_duty_cycle is None
+        derived.add({'OPERATING_STATUS': COMPRESSOR}, 0.0)
+        derived.add({'OPERATING_STATUS': COMPRESSOR}, 60.0)
+        derived.add({'COMPRESSOR_STARTS': 7}, 60.0)
+        values = derived.values()
+        assert values.compressor_duty_cycle == 1.0
+        assert values.compressor_starts == 0
+        assert values.delta_t is None and values.heat_output is None
+        # A reset counter does not count as starts
+        derived.add({'COMPRESSOR_STARTS': 0}, 120.0)
+        derived.add({'COMPRESSOR_STARTS': 1}, 180.0)
+        assert derived.values().compressor_starts == 1
+
+    def test_map_without_ingredients(self):
+        register_map = RegisterMap.from_dict({
+            'name': 'small', 'blocks': [
+                {'block': 1, 'kind': 'input', 'start': 0, 'registers': [
+                    {'name': 'FLOW_TEMPERATURE', 'addr': 0, 'type': 2}]}]})
+        derived = DerivedMetrics(register_map=register_map)
+        derived.record([((1, 0, 1), [350])], timestamp=0.0)
+        derived.record([((1, 0, 1), [360])], timestamp=10.0)
+        values = derived.values()
+        assert values.compressor_duty_cycle is None
+        assert values.compressor_starts is None
+        assert values.delta_t is None
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            DerivedMetrics(window=0)
+
+
+class TestApiDerived:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+
+    def test_fed_by_updates(self):
+        derived = self.api.track_derived(window=600)
+        assert self.api.get_derived() is derived
+        self.client.set_input_register(11, 352)
+        self.client.set_input_register(12, 302)
+        self.client.set_input_register(30, 10)
+        self.client.set_input_register(2000, COMPRESSOR)
+        self.api.update()
+        self.client.set_input_register(30, 12)
+        self.api.update()
+        self.api.update(blocks=[2])
+
+        values = derived.values()
+        assert values.compressor_starts == 2
+        assert values.compressor_duty_cycle == 1.0
+        assert values.delta_t == pytest.approx(5.0)
+
+        self.api.set_derived(None)
+        self.api.update()
+        assert derived.values().compressor_starts == 2
+
+    def test_set_derived_other_map(self):
+        with pytest.raises(ValueError):
+            self.api.set_derived(DerivedMetrics(
+                register_map=RegisterMap.from_dict(large_map_data())))
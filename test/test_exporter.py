@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import urllib.request
+
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient, wait_for
+from pystiebeleltron import cli
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.exporter import Exporter
+from pystiebeleltron.poller import Poller
+
+slave = 1
+
+
+class OfflineClient(FakeModbusClient):
+
+    def __init__(self):
+        super().__init__()
+        self.offline = False
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        if self.offline:
+            raise ConnectionError('offline')
+        return super().read_input_registers(address, count, **kwargs)
+
+
+class TestExporter:
+
+    def setup_method(self):
+        self.client = OfflineClient()
+        self.client.set_input_register(11, 352)
+        self.client.set_input_register(26, 0x8000)
+        self.client.set_input_register(2000, pyse.B3_OPERATING_STATUS[
+            'COMPRESSOR'] | pyse.B3_OPERATING_STATUS['HEATING'])
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+        self.exporter = Exporter(interval=60)
+        self.exporter.add_unit(self.api, host='isg', slave=slave)
+        unit = self.exporter._units[0]
+        self.poller = Poller(self.api, on_publish=lambda polled: (
+            self.exporter._publish(unit, polled)))
+
+    def teardown_method(self):
+        self.exporter.stop()
+
+    def lines(self):
+        return self.exporter.render().decode().splitlines()
+
+    def test_render(self):
+        assert self.exporter.render() == b''
+        self.poller.poll()
+        lines = self.lines()
+        assert lines[:3] == [
+            '# HELP stiebeleltron_up Whether the last poll of the unit '
+            'succeeded.',
+            '# TYPE stiebeleltron_up gauge',
+            'stiebeleltron_up{host="isg",slave="1"} 1']
+        assert '# TYPE stiebeleltron_flow_temperature gauge' in lines
+        assert 'stiebeleltron_flow_temperature{host="isg",slave="1"} 35.2' \
+            in lines
+        assert 'stiebeleltron_day_stage{host="isg",slave="1"} 0.0' in lines
+        flags = [line for line in lines
+                 if line.startswith('stiebeleltron_operating_status_flag{')]
+        assert len(flags) == len(pyse.B3_OPERATING_STATUS)
+        assert 'stiebeleltron_operating_status_flag{host="isg",slave="1",' \
+            'flag="COMPRESSOR"} 1' in flags
+        assert 'stiebeleltron_operating_status_flag{host="isg",slave="1",' \
+            'flag="COOLING"} 0' in flags
+        # Unavailable values are left out
+        assert not any(line.startswith('stiebeleltron_collector_temperature')
+                       for line in lines)
+        assert self.exporter.render(openmetrics=True) == \
+            self.exporter.render() + b'# EOF\n'
+
+    def test_renders_on_change_only(self):
+        self.poller.poll()
+        renders = self.exporter.renders
+        body = self.exporter.render()
+        self.poller.poll()
+        assert self.exporter.renders == renders
+        assert self.exporter.render() is body
+
+        self.client.set_input_register(11, 360)
+        self.poller.poll()
+        assert self.exporter.renders == renders + 1
+        assert 'stiebeleltron_flow_temperature{host="isg",slave="1"} 36.0' \
+            in self.lines()
+
+    def test_failures(self):
+        self.poller.poll()
+        self.client.offline = True
+        self.poller.poll()
+        self.poller.poll()
+        lines = self.lines()
+        assert 'stiebeleltron_up{host="isg",slave="1"} 0' in lines
+        # The last values stay exported
+        assert 'stiebeleltron_flow_temperature{host="isg",slave="1"} 35.2' \
+            in lines
+        assert self.exporter.renders == 3
+
+    def test_many_units(self):
+        other = FakeModbusClient()
+        other.set_input_register(11, 250, unit=2)
+        exporter = Exporter()
+        exporter.add_unit(self.api, host='isg', slave=1)
+        exporter.add_unit(pyse.StiebelEltronAPI(other, 2), host='isg',
+                          slave=2)
+        for unit in exporter._units:
+            exporter._publish(unit, Poller(unit.api).poll())
+        lines = exporter.render().decode().splitlines()
+        assert lines.count('# TYPE stiebeleltron_flow_temperature gauge') == 1
+        index = lines.index('# TYPE stiebeleltron_flow_temperature gauge')
+        assert lines[index + 1:index + 3] == [
+            'stiebeleltron_flow_temperature{host="isg",slave="1"} 35.2',
+            'stiebeleltron_flow_temperature{host="isg",slave="2"} 25.0']
+
+    def test_server(self):
+        self.exporter.start()
+        host, port = self.exporter.start_server('127.0.0.1', 0)
+        wait_for(lambda: self.exporter.render())
+        url = 'http://127.0.0.1:{}/metrics'.format(port)
+        requests = len(self.client.requests)
+        for _ in range(3):
+            with urllib.request.urlopen(url) as response:
+                assert response.headers['Content-Type'].startswith(
+                    'text/plain; version=0.0.4')
+                assert response.read() == self.exporter.render()
+        # Scrapes are served without Modbus requests
+        assert len(self.client.requests) == requests
+
+        request = urllib.request.Request(
+            url, headers={'Accept': 'application/openmetrics-text'})
+        with urllib.request.urlopen(request) as response:
+            assert response.read().endswith(b'# EOF\n')
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(
+                'http://127.0.0.1:{}/other'.format(port))
+
+    def test_cli_arguments(self):
+        assert cli._parse_target('isg', 1) == ('isg', 1)
+        assert cli._parse_target('isg/3', 1) == ('isg', 3)
+        with pytest.raises(SystemExit):
+            cli.main(['export', 'isg/x'])
+        with pytest.raises(SystemExit):
+            cli.main(['export', 'isg', '--interval', '0'])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import asyncio
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeModbusClient,
+                                     run)
+from pystiebeleltron.fleet import FleetPoller, Target
+
+
+class TestFleetPoller:
+
+    def test_sweep_bounded_concurrency(self):
+        backend = FakeModbusClient()
+        backend.set_input_register(0, 215, unit=3)
+        conn = FakeAsyncModbusClient(backend, delay=0.01)
+        gateways = []
+
+        async def factory(host, port):
+            gateways.append((host, port))
+            return conn
+
+        targets = [('10.0.0.%d' % (i % 20), 502, i) for i in range(100)]
+        poller = FleetPoller(targets, concurrency=10, client_factory=factory)
+        snapshots = run(poller.sweep())
+
+        assert len(snapshots) == 100
+        assert all(snapshot.ok for snapshot in snapshots)
+        assert snapshots[3].values['ACTUAL_ROOM_TEMPERATURE_HC1'] == 21.5
+        # One connection per gateway, never more units than the limit
+        assert len(gateways) == 20
+        assert conn.max_in_flight == 10 * 3
+
+    def test_failing_unit_backs_off(self):
+        async def factory(host, port):
+            if host == 'down':
+                raise OSError('unreachable')
+            return FakeAsyncModbusClient()
+
+        poller = FleetPoller([('up', 502, 1), Target('down', 502, 1, 0.5)],
+                             interval=10, jitter=0, client_factory=factory)
+        run(poller.sweep())
+        snapshots = run(poller.sweep())
+        up, down = snapshots
+        assert up.ok and up.error is None
+        assert not down.ok
+        assert down.error == 'OSError'
+        assert down.consecutive_failures == 2
+        assert down.values is None
+
+        due = run(poller.sweep(due_only=True))
+        assert due == []
+
+    def test_timeout_keeps_gateway(self):
+        class SlowUnitClient(FakeAsyncModbusClient):
+            """Unit 2 does not answer in time."""
+
+            def __getattr__(self, name):
+                call = super().__getattr__(name)
+
+                async def slow(*args, **kwargs):
+                    if kwargs.get('unit') == 2:
+                        await asyncio.sleep(1)
+                    return await call(*args, **kwargs)
+
+                return slow
+
+        gateways = []
+
+        async def factory(host, port):
+            gateways.append((host, port))
+            return SlowUnitClient()
+
+        poller = FleetPoller([('gw', 502, 1), Target('gw', 502, 2, 0.05)],
+                             client_factory=factory)
+        run(poller.sweep())
+        api = poller._units[0].api
+        fast, slow = run(poller.sweep())
+        assert fast.ok
+        assert not slow.ok and slow.error == 'TimeoutError'
+        # The gateway stays connected for the other unit
+        assert gateways == [('gw', 502)]
+        assert poller._units[0].api is api
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import asyncio
+import time
+
+import pytest
+
+from test.fake_modbus_client import FakeAsyncModbusClient, FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.history import Bucket, History, RingBuffer, Sample
+
+slave = 1
+
+
+class TestRingBuffer:
+
+    def test_overwrites_oldest(self):
+        buffer = RingBuffer(3)
+        assert buffer.latest() is None
+        for second in range(5):
+            buffer.append(float(second), second * 10)
+        assert len(buffer) == 3
+        times, values = buffer.arrays()
+        assert times.tolist() == [2.0, 3.0, 4.0]
+        assert values.tolist() == [20.0, 30.0, 40.0]
+        assert buffer.latest() == Sample(4.0, 40.0)
+
+    def test_range(self):
+        buffer = RingBuffer(4)
+        for second in range(6):
+            buffer.append(float(second), None if second == 4 else second)
+        times, _ = buffer.arrays(since=3, until=5)
+        assert times.tolist() == [3.0, 4.0]
+        assert buffer.latest() == Sample(5.0, 5.0)
+
+
+class TestHistory:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+
+    def test_records_updates(self):
+        history = self.api.record_history(['FLOW_TEMPERATURE',
+                                           'ROOM_TEMP_HEAT_DAY_HC1'])
+        assert self.api.get_history() is history
+        self.client.set_input_register(11, 352)
+        self.api.update()
+        self.client.set_input_register(11, 0x8000)
+        self.api.update(names=['FLOW_TEMPERATURE'])
+
+        samples = history.samples('FLOW_TEMPERATURE')
+        assert [sample.value for sample in samples] == [35.2, None]
+        assert history.latest('FLOW_TEMPERATURE').value is None
+        # Only the first update covered block 2
+        assert len(history.samples('ROOM_TEMP_HEAT_DAY_HC1')) == 1
+
+    def test_failed_update_not_recorded(self):
+        class FailingBlockClient(FakeModbusClient):
+            def read_holding_registers(self, address, count=1, **kwargs):
+                raise ConnectionError('Illegal data address')
+
+        api = pyse.StiebelEltronAPI(FailingBlockClient(), slave)
+        history = api.record_history(['FLOW_TEMPERATURE'])
+        assert api.update() is False
+        assert history.samples('FLOW_TEMPERATURE') == []
+
+    def test_downsample(self):
+        history = History(['FLOW_TEMPERATURE'], retention=3600, interval=1)
+        start = 1000200.0
+        for second in range(900):
+            value = None if 300 <= second < 600 else second % 300
+            history.append('FLOW_TEMPERATURE', value, start + second)
+        buckets = history.downsample('FLOW_TEMPERATURE', 300,
+                                     until=start + 900)
+        assert buckets == [Bucket(start, 0, 299, 149.5, 300),
+                           Bucket(start + 600, 0, 299, 149.5, 300)]
+        assert len(history.samples('FLOW_TEMPERATURE', last=60,
+                                   until=start + 900)) == 60
+
+    def test_retention(self):
+        history = History(['FLOW_TEMPERATURE'], retention=60, interval=10)
+        now = time.time()
+        for age in (120, 50, 10):
+            history.append('FLOW_TEMPERATURE', age, now - age)
+        assert [sample.value for sample
+                in history.samples('FLOW_TEMPERATURE')] == [50, 10]
+
+    def test_set_history(self):
+        history = History(['OPERATING_STATUS'])
+        self.api.set_history(history)
+        self.api.update(blocks=[3])
+        self.api.set_history(None)
+        self.api.update(blocks=[3])
+        assert len(history.samples('OPERATING_STATUS')) == 1
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            History(['NO_SUCH_REGISTER'])
+        with pytest.raises(ValueError):
+            History(retention=0)
+        with pytest.raises(ValueError):
+            History().downsample('FLOW_TEMPERATURE', 0)
+
+    def test_async_update(self):
+        api = AsyncStiebelEltronAPI(FakeAsyncModbusClient(self.client), slave)
+        history = api.record_history()
+        self.client.set_input_register(0, 215)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(api.update())
+        finally:
+            loop.close()
+        assert history.latest('ACTUAL_ROOM_TEMPERATURE_HC1').value == 21.5
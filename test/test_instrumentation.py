@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+from test.fake_modbus_client import FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.instrumentation import (
+    MetricsObserver, MetricsRegistry, Observer, read_bytes)
+
+slave = 1
+
+
+class RecordingObserver(Observer):
+
+    def __init__(self):
+        self.events = []
+
+    def on_request(self, slave, block, address, count, duration, nbytes):
+        self.events.append(('request', block, address, count, nbytes))
+
+    def on_request_error(self, slave, block, address, count, duration, exc):
+        self.events.append(('error', block, type(exc).__name__))
+
+    def on_decode(self, slave, stage, count, duration):
+        self.events.append(('decode', stage, count))
+
+
+class BrokenClient(FakeModbusClient):
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        raise ConnectionError('gateway down')
+
+
+class TestObservers:
+
+    def test_request_and_decode_events(self):
+        api = pyse.StiebelEltronAPI(FakeModbusClient(), slave)
+        observer = RecordingObserver()
+        api.add_observer(observer)
+        api.update()
+        api.snapshot(refresh=False)
+        assert observer.events == [
+            ('request', 1, 0, 33, read_bytes(33)),
+            ('request', 2, 1000, 27, read_bytes(27)),
+            ('request', 3, 2000, 3, read_bytes(3)),
+            ('decode', 'store', 63),
+            ('decode', 'snapshot', 63)]
+
+        api.remove_observer(observer)
+        api.update()
+        assert len(observer.events) == 5
+
+    def test_failures_by_exception_type(self):
+        api = pyse.StiebelEltronAPI(BrokenClient(), slave)
+        observer = RecordingObserver()
+        api.add_observer(observer)
+        assert api.update() is False
+        assert observer.events[-1] == ('error', 2, 'ConnectionError')
+
+
+class TestMetrics:
+
+    def test_prometheus_rendering(self):
+        metrics = MetricsObserver()
+        api = pyse.StiebelEltronAPI(FakeModbusClient(), slave)
+        api.add_observer(metrics)
+        api.update()
+        api.update()
+        broken = pyse.StiebelEltronAPI(BrokenClient(), 2)
+        broken.add_observer(metrics)
+        broken.update()
+
+        text = metrics.render()
+        assert '# TYPE stiebeleltron_request_duration_seconds histogram' \
+            in text
+        assert 'stiebeleltron_request_duration_seconds_count' \
+            '{slave="1",block="1"} 2' in text
+        assert 'stiebeleltron_request_bytes_total{slave="1",block="3"} %d' \
+            % (2 * read_bytes(3)) in text
+        assert 'stiebeleltron_request_errors_total' \
+            '{slave="2",block="2",error="ConnectionError"} 1' in text
+
+    def test_histogram_buckets(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency', 'Latency.', buckets=(1, 2))
+        for value in (0.5, 1.5, 3):
+            histogram.observe(value)
+        assert registry.render().splitlines()[2:] == [
+            'latency_bucket{le="1"} 1',
+            'latency_bucket{le="2"} 2',
+            'latency_bucket{le="+Inf"} 3',
+            'latency_sum 5.0',
+            'latency_count 3']
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import threading
+import time
+
+import pytest
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeModbusClient,
+                                     wait_for)
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.poller import PolledSnapshot, Poller
+
+slave = 1
+
+
+class CountingClient(FakeModbusClient):
+    """Client whose block 1 registers all hold the number of reads."""
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        if address == 0:
+            reads = self._store(1, 4)[0] + 1
+            self._store(1, 4)[:33] = [reads] * 33
+        return super().read_input_registers(address, count, **kwargs)
+
+
+class OfflineClient(FakeModbusClient):
+
+    def __init__(self):
+        super().__init__()
+        self.offline = False
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        if self.offline:
+            raise ConnectionError('offline')
+        return super().read_input_registers(address, count, **kwargs)
+
+
+class OverlapClient(FakeModbusClient):
+    """Client recording requests which overlap another request."""
+
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.overlaps = 0
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        self.active += 1
+        if self.active > 1:
+            self.overlaps += 1
+        time.sleep(0.0005)
+        try:
+            return super().read_input_registers(address, count, **kwargs)
+        finally:
+            self.active -= 1
+
+
+class TestPoller:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.client.set_input_register(0, 215)
+        self.api = pyse.StiebelEltronAPI(self.client, slave,
+                                         update_on_read=True)
+
+    def teardown_method(self):
+        self.api.stop_polling()
+
+    def test_getters_read_published_snapshot(self):
+        assert self.api.get_polled_snapshot() is None
+        self.api.start_polling(interval=60)
+        wait_for(lambda: self.api.get_polled_snapshot().snapshot is not None)
+        requests = len(self.client.requests)
+
+        assert self.api.get_current_temp() == 21.5
+        assert self.api.get_heating_status() is False
+        polled = self.api.get_polled_snapshot()
+        assert self.api.snapshot() is polled.snapshot
+        assert len(self.client.requests) == requests
+        assert polled.failures == 0 and polled.error is None
+        assert not polled.stale
+        assert polled.age < 60
+
+    def test_names_subset(self):
+        self.client.set_input_register(
+            2000, pyse.B3_OPERATING_STATUS['HEATING'])
+        self.api.start_polling(interval=60, names=['OPERATING_STATUS'])
+        wait_for(lambda: self.api.get_polled_snapshot().snapshot is not None)
+        snapshot = self.api.get_polled_snapshot().snapshot
+        assert snapshot['OPERATING_STATUS'] == 4
+        # Registers which were not polled are not reported as values
+        assert snapshot['OPERATING_MODE'] is None
+        assert snapshot.operating_mode == 'UNKNOWN'
+        assert self.api.get_current_temp() is None
+        assert self.api.get_operation() == 'UNKNOWN'
+        assert self.api.get_heating_status() is True
+
+    def test_failures_keep_last_snapshot(self):
+        client = OfflineClient()
+        client.set_input_register(0, 215)
+        api = pyse.StiebelEltronAPI(client, slave)
+        poller = Poller(api, interval=0.01)
+        first = poller.poll()
+        client.offline = True
+        poller.poll()
+        polled = poller.poll()
+        assert polled.snapshot is first.snapshot
+        assert polled.failures == 2
+        assert polled.error == 'ConnectionError'
+        assert polled.updated == first.updated < polled.attempted
+        time.sleep(0.03)
+        assert polled.stale
+
+        client.offline = False
+        assert poller.poll().failures == 0
+
+    def test_before_first_update(self):
+        polled = PolledSnapshot(None, None, None, 0, None, 10)
+        assert polled.age is None
+        assert polled.stale
+        with pytest.raises(ValueError):
+            Poller(self.api, interval=0)
+
+    def test_concurrent_readers(self):
+        api = pyse.StiebelEltronAPI(CountingClient(), slave)
+        api.start_polling(interval=0.001, blocks=[1])
+        errors = []
+
+        def read():
+            for _ in range(200):
+                snapshot = api.get_polled_snapshot().snapshot
+                if snapshot is not None and (
+                        snapshot['FLOW_TEMPERATURE'] !=
+                        snapshot['ACTUAL_ROOM_TEMPERATURE_HC1']):
+                    errors.append(snapshot)
+                api.get_current_temp()
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        api.stop_polling()
+        assert errors == []
+
+    def test_writes_while_polling(self):
+        self.api.start_polling(interval=0.005)
+        results = self.api.write_values({'DAY_STAGE': 3})
+        assert results == {'DAY_STAGE': pyse.WRITE_DONE}
+        self.api.set_target_temp(22.0)
+        assert self.client.units[slave][3][1001] == 220
+
+        poller = self.api._poller
+        wait_for(lambda: poller.polled.snapshot['DAY_STAGE'] == 3)
+
+    def test_updates_serialized_with_polls(self):
+        client = OverlapClient()
+        api = pyse.StiebelEltronAPI(client, slave)
+        api.start_polling(interval=0.001)
+        try:
+            wait_for(lambda: api.get_polled_snapshot().snapshot is not None)
+            for _ in range(20):
+                assert api.update()
+                api.probe_capabilities()
+                list(api.track_changes().poll(blocks=[1]))
+        finally:
+            api.stop_polling()
+        assert client.overlaps == 0
+
+    def test_stop_polling(self):
+        poller = self.api.start_polling(interval=60)
+        assert poller.running
+        self.api.stop_polling()
+        assert not poller.running
+        assert self.api.get_polled_snapshot() is None
+        self.client.set_input_register(0, 225)
+        # Reads hit the heat pump again with update_on_read
+        assert self.api.get_current_temp() == 22.5
+
+    def test_asyncio_not_supported(self):
+        api = AsyncStiebelEltronAPI(FakeAsyncModbusClient(), slave)
+        with pytest.raises(TypeError):
+            api.start_polling()
@@ -77,15 +77,15 @@ class TestStiebelEltronApi:
 
     def test_temperature_write(self, pyse_api):
         temperature = 22.5
-        pyse_api.set_target_temp(temperature)
-        time.sleep(3)
+        assert pyse_api.write_and_confirm('ROOM_TEMP_HEAT_DAY_HC1',
+                                          temperature)
 
         assert pyse_api.get_target_temp() == temperature
 
     def test_operation(self, pyse_api):
         operation = 'DHW'
-        pyse_api.set_operation(operation)
-        time.sleep(3)
+        assert pyse_api.write_and_confirm(
+            'OPERATING_MODE', pyse.B2_OPERATING_MODE_WRITE[operation])
 
         assert pyse_api.get_operation() == operation
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import json
+
+import pytest
+
+from test.fake_modbus_client import FakeModbusClient
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.capabilities import Capabilities
+from pystiebeleltron.registermap import RegisterMap, ReadRange, load_map
+
+slave = 1
+
+
+def large_map_data():
+    """Map of 5 blocks with 120 registers each, every 4th address unused."""
+    blocks = []
+    for number in range(1, 6):
+        start = number * 1000
+        blocks.append({
+            'block': number,
+            'kind': 'holding' if number == 5 else 'input',
+            'start': start,
+            'registers': [
+                {'name': 'B{}_R{}'.format(number, i),
+                 'addr': start + i + i // 3, 'type': 2}
+                for i in range(120)]})
+    return {'name': 'large', 'blocks': blocks}
+
+
+class TestRegisterMap:
+
+    def test_isg_map(self):
+        isg = load_map('isg')
+        assert isg is pyse.DEFAULT_MAP
+        assert len(isg.index) == 63
+        assert isg.index['FLOW_TEMPERATURE'][:2] == (1, 11)
+        assert isg.index['OPERATING_STATUS'][:2] == (3, 0)
+        assert pyse.B2_REGMAP_HOLDING['OPERATING_MODE'] == {
+            'addr': 1000, 'type': 8}
+        assert isg.block_ranges[2] == (ReadRange(2, 0, 27),)
+        assert isg.field_getter is None
+
+    def test_unknown_map(self):
+        with pytest.raises(ValueError):
+            load_map('no_such_map')
+
+    def test_compile_large_map(self):
+        large = RegisterMap.from_dict(large_map_data())
+        assert len(large.index) == 600
+        assert large.block_sizes[1] == 159
+        assert large.index['B1_R3'][:2] == (1, 4)
+        # Gaps are read along, the block is split at MAX_READ_COUNT
+        assert large.block_ranges[1] == (
+            ReadRange(1, 0, 125), ReadRange(1, 125, 34))
+        assert large.plan_reads(['B2_R0', 'B2_R3']) == (ReadRange(2, 0, 5),)
+
+    @pytest.mark.parametrize('change', [
+        lambda data: data['blocks'][0]['registers'].append(
+            {'name': 'B1_R0', 'addr': 1500, 'type': 2}),
+        lambda data: data['blocks'][0]['registers'].append(
+            {'name': 'OTHER', 'addr': 1000, 'type': 2}),
+        lambda data: data['blocks'][0]['registers'].append(
+            {'name': 'OTHER', 'addr': 999, 'type': 2}),
+        lambda data: data['blocks'][0]['registers'].append(
+            {'name': 'OTHER', 'addr': 1500, 'type': 3}),
+        lambda data: data['blocks'][0].update(kind='coil'),
+        lambda data: data['blocks'][0].pop('start'),
+    ])
+    def test_invalid_map(self, change):
+        data = large_map_data()
+        change(data)
+        with pytest.raises(ValueError):
+            RegisterMap.from_dict(data)
+
+    def test_load_file(self, tmp_path):
+        path = tmp_path / 'large.json'
+        path.write_text(json.dumps(large_map_data()))
+        assert len(RegisterMap.load(str(path)).index) == 600
+
+
+class TestApiWithRegisterMap:
+
+    def setup_method(self):
+        self.map = RegisterMap.from_dict(large_map_data())
+        self.client = FakeModbusClient(size=6000)
+        self.api = pyse.StiebelEltronAPI(self.client, slave,
+                                         register_map=self.map)
+
+    def test_update_and_decode(self):
+        self.client.set_input_register(2004, 215)
+        assert self.api.update() is True
+        assert len(self.client.requests) == 10
+        assert self.api.get_conv_val('B2_R3') == 21.5
+        assert self.api.get_conv_val('FLOW_TEMPERATURE') is None
+
+        snapshot = self.api.snapshot(refresh=False)
+        assert len(snapshot.values) == 600
+        assert snapshot['B2_R3'] == 21.5
+        assert snapshot.operating_mode == 'UNKNOWN'
+
+    def test_write_values(self):
+        results = self.api.write_values({'B5_R0': 1.0, 'B5_R1': 2.0,
+                                         'B5_R2': 3.0, 'B5_R3': 4.0})
+        assert set(results.values()) == {pyse.WRITE_DONE}
+        # B5_R3 follows an unused address
+        assert self.client.requests == [
+            ('write_registers', slave, 5000, 3),
+            ('write_register', slave, 5004, 1)]
+        with pytest.raises(ValueError):
+            self.api.write_values({'B1_R0': 1.0})
+
+    def test_capabilities(self):
+        for address in range(3000, 3159):
+            self.client.set_input_register(address, 0x8000)
+        caps = self.api.probe_capabilities()
+        assert not caps.supports_block(3)
+        assert caps.to_dict()['map'] == 'large'
+
+        with pytest.raises(ValueError):
+            Capabilities.from_dict(caps.to_dict())
+        with pytest.raises(ValueError):
+            pyse.StiebelEltronAPI(self.client, slave).set_capabilities(caps)
+        assert Capabilities.from_dict(caps.to_dict(), self.map) == caps
+
+    def test_changes(self):
+        tracker = self.api.track_changes()
+        assert len(list(tracker.poll())) == 600
+        self.client.set_input_register(1004, 10)
+        assert [change.name for change in tracker.poll()] == ['B1_R3']
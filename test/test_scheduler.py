@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import time
+
+import pytest
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeModbusClient,
+                                     run)
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.history import History
+from pystiebeleltron.scheduler import AdaptiveScheduler
+
+slave = 1
+
+FLOW_TEMPERATURE = 11
+OPERATING_STATUS = 2000
+
+
+class TestAdaptiveScheduler:
+
+    def setup_method(self):
+        self.client = FakeModbusClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave)
+        self.now = 0.0
+
+    def run(self, scheduler, until, flow_change_every=10):
+        """Tick on a simulated clock, FLOW_TEMPERATURE changes regularly."""
+        while self.now < until:
+            self.client.set_input_register(
+                FLOW_TEMPERATURE, 300 + int(self.now // flow_change_every))
+            scheduler.tick(self.now)
+            self.now += scheduler.delay(self.now)
+
+    def test_first_tick_reads_all_blocks(self):
+        scheduler = AdaptiveScheduler(self.api)
+        assert scheduler.tick(0.0)
+        assert len(self.client.requests) == 3
+        assert scheduler.get_stats() == {'ticks': 1, 'requests': 3,
+                                         'registers': 63}
+
+    def test_learns_intervals(self):
+        scheduler = AdaptiveScheduler(self.api, min_interval=10,
+                                      max_interval=600)
+        self.run(scheduler, 3600)
+        intervals = scheduler.get_intervals()
+        assert intervals['FLOW_TEMPERATURE'] == 10
+        assert intervals['OPERATING_STATUS'] == 10
+        assert intervals['DAY_STAGE'] == 600
+        assert intervals['OUTSIDE_TEMPERATURE'] == 600
+        # Polling all blocks every 10 seconds takes 1080 requests
+        stats = scheduler.get_stats()
+        assert stats['requests'] < 3 * 360
+        assert stats['registers'] < 63 * 360 / 10
+        assert ('read_holding_registers', slave, 1000, 27) in \
+            self.client.requests
+
+    def test_merged_ranges(self):
+        scheduler = AdaptiveScheduler(self.api, min_interval=10,
+                                      max_interval=600)
+        self.run(scheduler, 1800)
+        self.client.requests.clear()
+        scheduler.tick(self.now)
+        # OPERATING_STATUS and FLOW_TEMPERATURE only
+        assert sorted(self.client.requests) == [
+            ('read_input_registers', slave, 11, 1),
+            ('read_input_registers', slave, 2000, 1)]
+
+    def test_boost_on_compressor_start(self):
+        scheduler = AdaptiveScheduler(self.api, min_interval=10,
+                                      max_interval=600, boost_duration=120)
+        self.run(scheduler, 1800)
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] == 600
+
+        self.client.set_input_register(
+            OPERATING_STATUS, pyse.B3_OPERATING_STATUS['COMPRESSOR'])
+        self.now += scheduler.delay(self.now)
+        scheduler.tick(self.now)
+        assert scheduler.delay(self.now) == 0
+        self.client.requests.clear()
+        scheduler.tick(self.now)
+        assert ('read_input_registers', slave, 0, 33) in self.client.requests
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] == 10
+        # Setpoints are not boosted
+        assert scheduler.get_intervals()['DAY_STAGE'] == 600
+
+        self.run(scheduler, self.now + 1800)
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] > 10
+
+    def test_groups(self):
+        scheduler = AdaptiveScheduler(
+            self.api, groups=[['FLOW_TEMPERATURE', 'RETURN_TEMPERATURE'],
+                              ['DAY_STAGE']], watch=())
+        self.run(scheduler, 600)
+        intervals = scheduler.get_intervals()
+        assert set(intervals) == {'FLOW_TEMPERATURE', 'RETURN_TEMPERATURE',
+                                  'DAY_STAGE'}
+        assert intervals['RETURN_TEMPERATURE'] == 10
+        assert not any(request[2] == 2000
+                       for request in self.client.requests)
+
+    def test_boost_status_not_first_in_group(self):
+        scheduler = AdaptiveScheduler(
+            self.api, groups=[['FLOW_TEMPERATURE', 'OPERATING_STATUS'],
+                              ['HOT_GAS_TEMPERATURE']],
+            min_interval=10, max_interval=600)
+        self.run(scheduler, 1800)
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] == 600
+        # FLOW_TEMPERATURE keeps changing, only the status boosts
+        self.run(scheduler, self.now + 600)
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] == 600
+
+        self.client.set_input_register(
+            OPERATING_STATUS, pyse.B3_OPERATING_STATUS['COMPRESSOR'])
+        self.now += scheduler.delay(self.now)
+        scheduler.tick(self.now)
+        assert scheduler.delay(self.now) == 0
+        scheduler.tick(self.now)
+        assert scheduler.get_intervals()['HOT_GAS_TEMPERATURE'] == 10
+
+    def test_absent_registers(self):
+        for address in range(17, 33):
+            self.client.set_input_register(address, 0x8000)
+        self.api.probe_capabilities()
+        scheduler = AdaptiveScheduler(
+            self.api,
+            groups=[['COLLECTOR_TEMPERATURE'],
+                    ['FLOW_TEMPERATURE', 'DEW_POINT_TEMPERATUR_HC1']],
+            watch=(), min_interval=10, max_interval=600)
+        self.client.requests.clear()
+        assert scheduler.tick(0.0)
+        assert self.client.requests == [
+            ('read_input_registers', slave, 11, 1)]
+        # The absent group is never due
+        assert scheduler.delay(0.0) == 10
+        self.run(scheduler, 600)
+        assert scheduler.get_intervals()['FLOW_TEMPERATURE'] == 10
+
+        self.api.set_capabilities(None)
+        assert scheduler.delay(self.now) == 0
+
+    def test_no_supported_registers(self):
+        self.client.set_input_register(26, 0x8000)
+        self.api.probe_capabilities()
+        scheduler = AdaptiveScheduler(
+            self.api, groups=[['COLLECTOR_TEMPERATURE']], max_interval=600)
+        assert scheduler.tick(0.0)
+        assert scheduler.delay(0.0) == 600
+
+    def test_seed_from_history(self):
+        history = History(['DAY_STAGE', 'FLOW_TEMPERATURE'], retention=7200)
+        self.api.set_history(history)
+        start = time.time() - 3600
+        for second in range(0, 3600, 60):
+            history.append('DAY_STAGE', 3, start + second)
+            history.append('FLOW_TEMPERATURE', second, start + second)
+        scheduler = AdaptiveScheduler(self.api, min_interval=10,
+                                      max_interval=600)
+        intervals = scheduler.get_intervals()
+        assert intervals['DAY_STAGE'] == 600
+        assert intervals['FLOW_TEMPERATURE'] == 30
+
+    def test_failed_update(self):
+        class OfflineClient(FakeModbusClient):
+            def read_input_registers(self, address, count=1, **kwargs):
+                raise ConnectionError('offline')
+
+        scheduler = AdaptiveScheduler(
+            pyse.StiebelEltronAPI(OfflineClient(), slave), min_interval=5)
+        assert scheduler.tick(0.0) is False
+        assert scheduler.delay(0.0) == 5
+
+    def test_asyncio(self):
+        api = AsyncStiebelEltronAPI(FakeAsyncModbusClient(self.client), slave)
+        scheduler = AdaptiveScheduler(api)
+        with pytest.raises(TypeError):
+            scheduler.tick(0.0)
+        names = scheduler.plan(0.0)
+        assert run(api.update(names=names))
+        scheduler.observe(names, 0.0)
+        assert scheduler.delay(0.0) == scheduler.min_interval
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            AdaptiveScheduler(self.api, min_interval=10, max_interval=5)
+        with pytest.raises(ValueError):
+            AdaptiveScheduler(self.api, alpha=0)
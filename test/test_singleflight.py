@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import asyncio
+import threading
+
+import pytest
+
+from test.fake_modbus_client import (FakeAsyncModbusClient, FakeModbusClient,
+                                     wait_for)
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI
+from pystiebeleltron.instrumentation import MetricsObserver
+from pystiebeleltron.singleflight import SingleFlight
+
+slave = 1
+
+
+class GatedClient(FakeModbusClient):
+    """Client whose reads of block 1 wait until the gate is opened."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def read_input_registers(self, address, count=1, **kwargs):
+        if address == 0:
+            self.entered.set()
+            assert self.gate.wait(2)
+        return super().read_input_registers(address, count, **kwargs)
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class TestSingleFlight:
+
+    def test_shares_result_and_exception(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def slow(value):
+            started.set()
+            release.wait(2)
+            if value is None:
+                raise ConnectionError('failed')
+            return value
+
+        def call(value):
+            try:
+                results.append(flight.do('key', slow, value, cost=3))
+            except ConnectionError as exc:
+                results.append(exc)
+
+        leader = run_threads([lambda: call(42)])
+        started.wait(2)
+        # Joined while the leader is in flight, their arguments are unused
+        followers = run_threads([lambda: call(None)] * 4)
+        wait_for(lambda: flight.shared == 4)
+        release.set()
+        for thread in leader + followers:
+            thread.join()
+        assert results == [42] * 5
+        assert (flight.executed, flight.shared, flight.saved) == (1, 4, 12)
+
+        with pytest.raises(ConnectionError):
+            flight.do('key', slow, None)
+        assert flight.executed == 2
+
+
+class TestApiSingleFlight:
+
+    def setup_method(self):
+        self.client = GatedClient()
+        self.api = pyse.StiebelEltronAPI(self.client, slave,
+                                         single_flight=True)
+        self.metrics = MetricsObserver()
+        self.api.add_observer(self.metrics)
+
+    def test_concurrent_updates(self):
+        results = []
+        threads = run_threads([lambda: results.append(self.api.update())])
+        self.client.entered.wait(2)
+        threads += run_threads(
+            [lambda: results.append(self.api.update())] * 4)
+        wait_for(lambda: self.api.get_single_flight_stats()[
+            'updates_shared'] == 4)
+        self.client.gate.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == [True] * 5
+        assert len(self.client.requests) == 3
+        assert self.api.get_single_flight_stats() == {
+            'updates': 1, 'updates_shared': 4, 'reads': 3,
+            'reads_shared': 0, 'requests_saved': 12}
+        assert 'stiebeleltron_requests_saved_total{slave="1",kind="update"} ' \
+            '12' in self.metrics.render()
+
+    def test_block_read_shared(self):
+        self.client.set_input_register(0, 215)
+        api = pyse.StiebelEltronAPI(self.client, slave, update_on_read=True,
+                                    cache_ttl=10, single_flight=True)
+        temperatures = []
+        threads = run_threads([api.update])
+        self.client.entered.wait(2)
+        # A getter refreshing block 1 joins the block 1 read of the update
+        threads += run_threads(
+            [lambda: temperatures.append(api.get_current_temp())])
+        wait_for(lambda: api.get_single_flight_stats()['reads_shared'] == 1)
+        self.client.gate.set()
+        for thread in threads:
+            thread.join()
+
+        assert temperatures == [21.5]
+        assert len(self.client.requests) == 3
+        assert api.get_single_flight_stats()['requests_saved'] == 1
+
+    def test_disabled(self):
+        self.client.gate.set()
+        api = pyse.StiebelEltronAPI(self.client, slave)
+        assert api.update()
+        assert api.get_single_flight_stats()['requests_saved'] == 0
+
+    def test_async_concurrent_updates(self):
+        backend = FakeModbusClient()
+        api = AsyncStiebelEltronAPI(FakeAsyncModbusClient(backend, delay=0.01),
+                                    slave, single_flight=True)
+
+        async def updates():
+            return await asyncio.gather(
+                *[api.update() for _ in range(5)],
+                api.update(blocks=[2]))
+
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(updates()) == [True] * 6
+        finally:
+            loop.close()
+        assert len(backend.requests) == 3
+        stats = api.get_single_flight_stats()
+        assert stats['updates_shared'] == 4
+        assert stats['reads_shared'] == 1
+        assert stats['requests_saved'] == 13
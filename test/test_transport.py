@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+import asyncio
+
+import pytest
+
+from test.fake_modbus_client import run
+from benchmarks.simulator import Simulator
+from pystiebeleltron import pystiebeleltron as pyse
+from pystiebeleltron.aio import AsyncStiebelEltronAPI, open_connection
+from pystiebeleltron.connection import ManagedConnection
+from pystiebeleltron.fleet import FleetPoller
+from pystiebeleltron.transport import (ExceptionResponse, ModbusTcpTransport,
+                                       _parse_pdu)
+
+slave = 7
+
+
+@pytest.fixture
+def simulator():
+    sim = Simulator(rtt=0.001)
+    yield sim
+    sim.stop()
+
+
+class TestModbusTcpTransport:
+
+    def test_update_and_write(self, simulator):
+        host, port = simulator.start()
+        simulator.set_input_register(0, 215, unit=slave)
+        simulator.set_input_register(11, 0xFF9C, unit=slave)
+        conn = ModbusTcpTransport(host, port, timeout=2)
+        try:
+            api = pyse.StiebelEltronAPI(conn, slave)
+            assert api.update()
+            assert api.get_current_temp() == 21.5
+            assert api.get_conv_val('FLOW_TEMPERATURE') == -10.0
+            api.write_values({'DAY_STAGE': 3, 'NIGHT_STAGE': 2})
+            assert simulator.get_holding_register(1018, unit=slave) == 2
+            api.set_operation('DHW')
+            assert simulator.get_holding_register(1000, unit=slave) == 5
+        finally:
+            conn.close()
+
+    def test_exception_response(self, simulator):
+        host, port = simulator.start()
+        conn = ModbusTcpTransport(host, port, timeout=2)
+        try:
+            response = conn.read_input_registers(simulator.size, 2, unit=1)
+            assert isinstance(response, ExceptionResponse)
+            assert response.isError()
+            # The connection is still usable
+            assert not conn.read_input_registers(0, 2, unit=1).isError()
+        finally:
+            conn.close()
+
+    def test_timeout_and_reconnect(self, simulator):
+        host, port = simulator.start()
+        conn = ModbusTcpTransport(host, port, timeout=0.2)
+        try:
+            simulator.drop = 1.0
+            with pytest.raises(ConnectionError):
+                conn.read_input_registers(0, 1, unit=1)
+            assert not conn.is_socket_open()
+            simulator.drop = 0.0
+            assert conn.read_input_registers(0, 3, unit=1).registers.tolist() \
+                == [0, 0, 0]
+        finally:
+            conn.close()
+
+    def test_connect_failure(self):
+        conn = ModbusTcpTransport('127.0.0.1', 1, timeout=0.2)
+        assert conn.connect() is False
+        with pytest.raises(ConnectionError):
+            conn.read_input_registers(0, 1)
+
+    def test_request_limits(self):
+        conn = ModbusTcpTransport('127.0.0.1')
+        with pytest.raises(ValueError):
+            conn.read_input_registers(0, 126)
+        with pytest.raises(ValueError):
+            conn.write_registers(0, [0] * 124)
+
+    def test_invalid_response(self):
+        with pytest.raises(ConnectionError):
+            _parse_pdu(4, memoryview(b'\x03\x02\x00\x01'))
+        with pytest.raises(ConnectionError):
+            _parse_pdu(4, memoryview(b'\x04\x04\x00\x01'))
+        assert _parse_pdu(4, memoryview(b'\x04\x02\x01\x02')) \
+            .registers.tolist() == [0x0102]
+
+    def test_managed_connection(self, simulator):
+        host, port = simulator.start()
+        simulator.set_input_register(0, 215, unit=slave)
+        conn = ManagedConnection(host, port, timeout=2,
+                                 client_factory=ModbusTcpTransport)
+        try:
+            api = pyse.StiebelEltronAPI(conn, slave)
+            assert api.update()
+            assert api.get_current_temp() == 21.5
+            assert conn.get_health().connected
+        finally:
+            conn.close()
+
+
+class TestAsyncModbusTcpTransport:
+
+    def test_update_and_write(self, simulator):
+        host, port = simulator.start()
+        simulator.set_input_register(0, 215, unit=slave)
+
+        async def session():
+            conn = await open_connection(host, port)
+            try:
+                api = AsyncStiebelEltronAPI(conn, slave)
+                assert await api.update()
+                await api.write_values({'DAY_STAGE': 3})
+                return api.get_conv_val('ACTUAL_ROOM_TEMPERATURE_HC1')
+            finally:
+                conn.close()
+
+        assert run(session()) == 21.5
+        assert simulator.get_holding_register(1017, unit=slave) == 3
+
+    def test_pipelined_requests(self, simulator):
+        host, port = simulator.start()
+        for unit in range(1, 4):
+            simulator.set_input_register(0, unit, unit=unit)
+
+        async def session():
+            conn = await open_connection(host, port)
+            try:
+                responses = await asyncio.gather(*(
+                    conn.read_input_registers(0, 1, unit=unit)
+                    for unit in range(1, 4)))
+                return [response.registers[0] for response in responses]
+            finally:
+                conn.close()
+
+        assert run(session()) == [1, 2, 3]
+
+    def test_connection_lost(self, simulator):
+        host, port = simulator.start()
+        simulator.drop = 1.0
+
+        async def session():
+            conn = await open_connection(host, port)
+            request = asyncio.ensure_future(conn.read_input_registers(0, 1))
+            await asyncio.sleep(0.05)
+            conn.close()
+            with pytest.raises(ConnectionError):
+                await request
+            with pytest.raises(ConnectionError):
+                await conn.read_input_registers(0, 1)
+
+        run(session())
+
+    def test_fleet(self, simulator):
+        host, port = simulator.start()
+        simulator.set_input_register(0, 215, unit=2)
+        poller = FleetPoller([(host, port, unit) for unit in range(1, 4)],
+                             client_factory=open_connection)
+
+        async def sweep():
+            try:
+                return await poller.sweep()
+            finally:
+                poller.close()
+
+        snapshots = run(sweep())
+        assert all(snapshot.ok for snapshot in snapshots)
+        assert snapshots[1].values['ACTUAL_ROOM_TEMPERATURE_HC1'] == 21.5
+
+    def test_fleet_reconnects(self, simulator):
+        host, port = simulator.start()
+        connections = []
+
+        async def factory(host, port):
+            connections.append(await open_connection(host, port))
+            return connections[-1]
+
+        poller = FleetPoller([(host, port, 1), (host, port, 2)],
+                             client_factory=factory)
+
+        async def session():
+            try:
+                first = await poller.sweep()
+                simulator.disconnect()
+                await asyncio.sleep(0.05)
+                lost = await poller.sweep()
+                return first, lost, await poller.sweep()
+            finally:
+                poller.close()
+
+        first, lost, again = run(session())
+        assert all(snapshot.ok for snapshot in first)
+        assert [snapshot.error for snapshot in lost] == \
+            ['ModbusReadFailed'] * 2
+        assert all(snapshot.ok for snapshot in again)
+        assert len(connections) == 2